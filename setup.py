@@ -7,7 +7,7 @@ setup(
     author='James Muscat',
     author_email='jamesremuscat@gmail.com',
     url='https://github.com/jamesremuscat/avista',
-    packages=find_namespace_packages('src', exclude=["*.tests"]),
+    packages=find_namespace_packages('src', exclude=["*.tests", "*.benchmarks"]),
     package_dir={'': 'src'},
     long_description="""\
     avista is a library for controlling A/V devices such as video switchers. It
@@ -19,6 +19,7 @@ setup(
         'autobahn[serialization,twisted]',
         'construct',
         'mido',
+        'msgpack',
         'netaudio==0.0.10',
         'pyserial',
         'ratelimiter==1.2.0.post0',
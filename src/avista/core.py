@@ -11,7 +11,28 @@ from twisted.internet.defer import ensureDeferred
 from twisted.internet.task import LoopingCall
 from .constants import Messages, SystemPowerState, Topics, INFRASTRUCTURE_PUBLISH_OPTIONS
 
+from collections import deque
+
 import inspect
+import uuid
+
+
+# How many state changes Device keeps a record of, for get_state_since
+STATE_HISTORY = 1024
+# How many results of get_state_path are cached
+STATE_PATH_CACHE_SIZE = 256
+
+
+def _truncate(node, depth):
+    '''
+    Copies the dicts in `node` down to `depth` levels, replacing any deeper
+    dicts with a list of their keys.
+    '''
+    if not isinstance(node, dict) or depth is None:
+        return node
+    if depth <= 0:
+        return list(node)
+    return {key: _truncate(value, depth - 1) for key, value in node.items()}
 
 
 def expose(func):
@@ -31,10 +52,23 @@ def map_function_spec(func):
 
 
 class Device(ApplicationSession):
+    # Whether this device records changes to its state (see state_changed), so
+    # that clients can tell which messages they've missed
+    versioned_state = False
+
     def __init__(self, config):
         super().__init__(config)
         self.name = config.extra['name']
 
+        # Identifies this run of the device, since versions start again at 0
+        self.state_epoch = uuid.uuid4().hex
+        # The versions at which the top-level keys of `_state` changed
+        self._state_version = 0
+        self._state_journal = deque(maxlen=STATE_HISTORY)
+        # (path, depth) to the state version, the keys the path resolved to and
+        # the result of get_state_path
+        self._state_path_cache = {}
+
     async def onJoin(self, details):
 
         for method in self._get_exposed_methods():
@@ -116,17 +150,155 @@ class Device(ApplicationSession):
             return self._state
         return None
 
+    @property
+    def state_version(self):
+        '''
+        A number that increases with every change to this device's state. For
+        devices with versioned_state, it's included in every message they
+        publish, along with state_epoch; versions are only comparable within
+        the same epoch.
+        '''
+        return self._state_version
+
+    def state_changed(self, *keys):
+        '''
+        Records that the given top-level keys of `_state` have changed.
+        '''
+        self._state_version += 1
+        self._state_journal.append((self._state_version, keys))
+
+    def state_keys_changed_since(self, version):
+        '''
+        Returns the set of top-level keys of `_state` changed after `version`,
+        or None if that's not known (including for devices that don't record
+        their state changes).
+        '''
+        if not self.versioned_state or version > self.state_version or not self.state_version:
+            return None
+        if version < self.state_version and (not self._state_journal or self._state_journal[0][0] > version + 1):
+            return None
+
+        keys = set()
+        for entry_version, entry_keys in reversed(self._state_journal):
+            if entry_version <= version:
+                break
+            keys.update(entry_keys)
+        return keys
+
+    def state_paths_changed_since(self, version):
+        '''
+        As state_keys_changed_since, but returning a set of paths (tuples of
+        keys) under which the state has changed. Devices that record their
+        changes in more detail than top-level keys may override this.
+        '''
+        keys = self.state_keys_changed_since(version)
+        if keys is None:
+            return None
+        return set((key,) for key in keys)
+
+    def _get_state_root(self, key):
+        '''
+        The state from which get_state_path resolves paths beginning `key`.
+        '''
+        return self._get_state()
+
+    @expose
+    def get_state_path(self, path, depth=None):
+        '''
+        Returns the part of this device's state at `path` (keys separated by
+        `/`, such as `mes/0/program`), along with the state version and epoch. With
+        `depth`, dicts more than that many levels below `path` are replaced by
+        a list of their keys. Returns None as the state if there's nothing at
+        `path`.
+        '''
+        segments = tuple(segment for segment in path.split('/') if segment) if isinstance(path, str) else tuple(path)
+        root = self._get_state_root(segments[0] if segments else None)
+        version = self.state_version
+
+        # Without `depth` the result is the state itself, found by a walk that
+        # costs less than checking a cached result is still current
+        cache_key = (segments, depth)
+        cached = self._state_path_cache.get(cache_key) if depth is not None else None
+        if cached:
+            cached_version, keys, result = cached
+            if cached_version == version:
+                return {'version': version, 'epoch': self.state_epoch, 'state': result}
+
+            changed = self.state_paths_changed_since(cached_version)
+            if changed is not None and not any(
+                changed_path[:len(keys)] == keys[:len(changed_path)] for changed_path in changed
+            ):
+                self._state_path_cache[cache_key] = (version, keys, result)
+                return {'version': version, 'epoch': self.state_epoch, 'state': result}
+
+        node = root
+        keys = []
+        for segment in segments:
+            if isinstance(node, dict):
+                if segment not in node and isinstance(segment, str) and segment.lstrip('-').isdigit():
+                    segment = int(segment)
+                node = node.get(segment)
+            else:
+                node = None
+            keys.append(segment)
+
+        result = _truncate(node, depth)
+
+        # Results are only cached while changes to the state are being recorded
+        if depth is not None and self.state_paths_changed_since(version) is not None:
+            if len(self._state_path_cache) >= STATE_PATH_CACHE_SIZE:
+                self._state_path_cache.clear()
+            self._state_path_cache[cache_key] = (version, tuple(keys), result)
+
+        return {'version': version, 'epoch': self.state_epoch, 'state': result}
+
+    @expose
+    def get_state_since(self, version=None, epoch=None):
+        '''
+        Returns the state that has changed since `version` of `epoch` (as
+        included in published messages): either the top-level branches that
+        changed, or (with `full` set) the whole state if that can't be told,
+        such as when `version` is too old or from a different epoch. Removed
+        branches are returned as None.
+        '''
+        state = self._get_state()
+        changed = None
+        if version is not None and epoch == self.state_epoch and state is not None:
+            changed = self.state_keys_changed_since(version)
+
+        if changed is None:
+            return {
+                'version': self.state_version,
+                'epoch': self.state_epoch,
+                'full': True,
+                'state': state
+            }
+
+        return {
+            'version': self.state_version,
+            'epoch': self.state_epoch,
+            'full': False,
+            'state': {key: state.get(key) for key in changed}
+        }
+
     @property
     def broadcast_topic(self):
         return 'avista.devices.{}'.format(self.name)
 
-    def broadcast_device_message(self, msg_type, data=None, subtopic=None, **kwargs):
+    def broadcast_device_message(self, msg_type, data=None, subtopic=None, seq=None, **kwargs):
+        payload = {
+            'type': msg_type,
+            'data': data
+        }
+        if self.versioned_state:
+            payload['version'] = self.state_version
+            payload['epoch'] = self.state_epoch
+        if seq is not None:
+            payload['seq'] = seq
+
         self.publish(
             '{}/{}'.format(self.broadcast_topic, subtopic) if subtopic else self.broadcast_topic,
-            {
-                'type': msg_type,
-                'data': data
-            },
+            payload,
             options=PublishOptions(**kwargs)
         )
 
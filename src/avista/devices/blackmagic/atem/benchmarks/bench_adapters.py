@@ -0,0 +1,107 @@
+'''
+The per-field cost of decoding enum fields, comparing the table-driven
+EnumAdapter and EnumFlagAdapter with the per-value construction they replaced,
+and of building decoded commands, comparing positional construction with the
+keyword arguments of __init__.
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from avista.devices.blackmagic.atem.commands import AuxSource, InputProperties, ProgramInput  # noqa: E402
+from avista.devices.blackmagic.atem.commands.base import EnumAdapter, EnumFlagAdapter  # noqa: E402
+from avista.devices.blackmagic.atem.constants import MEAvailability, TransitionStyle, VideoMode, \
+    VideoSource  # noqa: E402
+from construct import Adapter, Int8ub, Int16ub, Int32ub  # noqa: E402
+
+
+class ConstructorEnumAdapter(Adapter):
+    # As EnumAdapter decoded before it was table-driven
+    def __init__(self, enum_class, subcon):
+        super().__init__(subcon)
+        self.enum_class = enum_class
+
+    def _decode(self, obj, context, path):
+        return self.enum_class(obj)
+
+
+class EnumeratingFlagAdapter(Adapter):
+    # As EnumFlagAdapter decoded before it cached decoded values
+    def __init__(self, enum_class, subcon):
+        super().__init__(subcon)
+        self.enum_class = enum_class
+
+    def _decode(self, obj, context, path):
+        values = {}
+        for idx, enum_value in enumerate(self.enum_class):
+            if idx > 0:
+                mask = 1 << idx - 1
+                values[enum_value] = (obj & mask) > 0
+        return values
+
+
+ENUM_FIELDS = {
+    'VideoSource': (VideoSource, Int16ub, [source.value for source in VideoSource]),
+    'TransitionStyle': (TransitionStyle, Int8ub, [style.value for style in TransitionStyle]),
+}
+
+FLAG_FIELDS = {
+    'MEAvailability': (MEAvailability, Int8ub, list(range(16))),
+    'VideoMode': (VideoMode, Int32ub, [0x0f, 0xff, 0x3ff00, 0x1ffff]),
+}
+
+
+def _decoder(adapter, values):
+    decode = adapter._decode
+    return lambda: [decode(value, None, None) for value in values]
+
+
+@pytest.mark.parametrize('implementation', ['constructor', 'table'])
+@pytest.mark.parametrize('field', sorted(ENUM_FIELDS))
+def test_enum_decode(benchmark, field, implementation):
+    enum_class, subcon, values = ENUM_FIELDS[field]
+    benchmark.group = 'EnumAdapter decode: {}'.format(field)
+    benchmark.extra_info['fields'] = len(values)
+
+    if implementation == 'constructor':
+        adapter = ConstructorEnumAdapter(enum_class, subcon)
+    else:
+        adapter = EnumAdapter(enum_class)(subcon)
+    benchmark(_decoder(adapter, values))
+
+
+@pytest.mark.parametrize('implementation', ['enumerate', 'cached'])
+@pytest.mark.parametrize('field', sorted(FLAG_FIELDS))
+def test_flag_decode(benchmark, field, implementation):
+    enum_class, subcon, values = FLAG_FIELDS[field]
+    benchmark.group = 'EnumFlagAdapter decode: {}'.format(field)
+    benchmark.extra_info['fields'] = len(values)
+
+    if implementation == 'enumerate':
+        adapter = EnumeratingFlagAdapter(enum_class, subcon)
+    else:
+        adapter = EnumFlagAdapter(enum_class)(subcon)
+    benchmark(_decoder(adapter, values))
+
+
+# Decoded from bodies of zeros, which are valid for each
+COMMANDS = {
+    'PrgI': ProgramInput,
+    'AuxS': AuxSource,
+    'InPr': InputProperties,
+}
+
+
+@pytest.mark.parametrize('implementation', ['kwargs', 'positional'])
+@pytest.mark.parametrize('command', sorted(COMMANDS))
+def test_command_construction(benchmark, command, implementation):
+    command_class = COMMANDS[command]
+    benchmark.group = 'Command construction: {}'.format(command)
+    benchmark.extra_info['fields'] = len(command_class._fields)
+
+    values = command_class._field_values(command_class._parser.parse(bytes(command_class.format.sizeof())))
+    if implementation == 'kwargs':
+        kwargs = dict(zip(command_class._fields, values))
+        benchmark(lambda: command_class(**kwargs))
+    else:
+        benchmark(lambda: command_class._from_values(*values))
@@ -0,0 +1,33 @@
+'''
+Parse throughput of commands' compiled formats (see
+BaseCommand.compile_codecs), against the interpreted formats they replaced,
+from body to command object.
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from avista.devices.blackmagic.atem.commands import get_dispatch_table  # noqa: E402
+
+from .dumps import sample_commands  # noqa: E402
+
+
+VERSION = 2.30
+COMMANDS = [b'PrgI', b'PrvI', b'TrPs', b'KeBP', b'AMIP', b'InPr', b'TlSr']
+
+BODIES = {}
+for name, body in sample_commands(VERSION):
+    BODIES.setdefault(name, body)
+
+
+@pytest.mark.parametrize('implementation', ['interpreted', 'compiled'])
+@pytest.mark.parametrize('command', COMMANDS, ids=[name.decode('latin-1') for name in COMMANDS])
+def test_parse_body(benchmark, command, implementation):
+    command_class = get_dispatch_table(VERSION)[command]
+    body = BODIES[command]
+    benchmark.group = 'Command parse: {}'.format(command.decode('latin-1'))
+
+    parse = command_class._parser.parse if implementation == 'compiled' else command_class.format.parse
+    build = command_class._from_values
+    values = command_class._field_values
+    benchmark(lambda: build(*values(parse(body))))
@@ -0,0 +1,138 @@
+'''
+Benchmarks for each stage of handling datagrams from an ATEM. Run with:
+
+    tox -e bench
+
+or, with pytest-benchmark installed:
+
+    pytest -o python_files='bench_*.py' src/avista/devices/blackmagic/atem/benchmarks
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from avista.devices.blackmagic.atem.commands import CommandParser, iter_commands  # noqa: E402
+from avista.devices.blackmagic.atem.packet import Packet  # noqa: E402
+from avista.devices.blackmagic.atem.replay import create_replay_device  # noqa: E402
+from avista.devices.blackmagic.atem.tally import recalculate_synthetic_tally  # noqa: E402
+
+from .dumps import load_dumps, transition_traffic  # noqa: E402
+
+
+DUMPS = load_dumps()
+TRANSITION = transition_traffic()
+
+
+def _parse_dump(datagrams):
+    parser = CommandParser()
+    return [parser.parse_commands(Packet.parse(datagram).payload) for datagram in datagrams], parser
+
+
+def _apply(commands, state=None):
+    state = state or {}
+    for command in commands:
+        state = command.apply_to_state(state)
+    return state
+
+
+PARSED = {name: _parse_dump(datagrams) for name, datagrams in DUMPS.items()}
+STATES = {name: _apply(c for batch in parsed for c in batch) for name, (parsed, _) in PARSED.items()}
+
+
+def _command_classes():
+    # (dump, command name, command class, command bodies) for each class in each dump
+    classes = []
+    for dump, datagrams in DUMPS.items():
+        parser = PARSED[dump][1]
+        bodies = {}
+        for datagram in datagrams:
+            for name, body in iter_commands(Packet.parse(datagram).payload):
+                if name in parser._commands:
+                    bodies.setdefault(name, []).append(bytes(body))
+        for name, command_bodies in sorted(bodies.items()):
+            classes.append((dump, name, parser._commands[name], command_bodies))
+    return classes
+
+
+COMMAND_CLASSES = _command_classes()
+COMMAND_CLASS_IDS = ['{}-{}'.format(dump, name.decode('latin-1')) for dump, name, _, _ in COMMAND_CLASSES]
+
+
+@pytest.mark.parametrize('dump', sorted(DUMPS))
+def test_packet_parse(benchmark, dump):
+    benchmark.group = 'Packet.parse'
+    datagrams = DUMPS[dump]
+    benchmark(lambda: [Packet.parse(datagram) for datagram in datagrams])
+
+
+@pytest.mark.parametrize('dump', sorted(DUMPS))
+def test_parse_commands(benchmark, dump):
+    benchmark.group = 'CommandParser.parse_commands'
+    payloads = [Packet.parse(datagram).payload for datagram in DUMPS[dump]]
+    parser = PARSED[dump][1]
+    benchmark(lambda: [parser.parse_commands(payload) for payload in payloads])
+
+
+@pytest.mark.parametrize('dump', sorted(DUMPS))
+def test_apply_to_state(benchmark, dump):
+    benchmark.group = 'apply_to_state'
+    commands = [command for batch in PARSED[dump][0] for command in batch]
+    benchmark(_apply, commands)
+
+
+@pytest.mark.parametrize('dump', sorted(DUMPS))
+def test_recalculate_synthetic_tally(benchmark, dump):
+    benchmark.group = 'recalculate_synthetic_tally'
+    benchmark(recalculate_synthetic_tally, STATES[dump])
+
+
+@pytest.mark.parametrize('dump,name,command_class,bodies', COMMAND_CLASSES, ids=COMMAND_CLASS_IDS)
+def test_parse_command_class(benchmark, dump, name, command_class, bodies):
+    benchmark.group = 'parse_body per class'
+    benchmark(lambda: [command_class.parse_body(body) for body in bodies])
+
+
+@pytest.mark.parametrize('dump,name,command_class,bodies', COMMAND_CLASSES, ids=COMMAND_CLASS_IDS)
+def test_apply_command_class(benchmark, dump, name, command_class, bodies):
+    benchmark.group = 'apply_to_state per class'
+    commands = [command_class.parse_body(body) for body in bodies]
+    benchmark(_apply, commands, STATES[dump])
+
+
+@pytest.mark.parametrize('dump', sorted(DUMPS))
+def test_receive_initial_dump(benchmark, dump):
+    '''
+    The whole receive path, from datagram to published state, for a dump.
+    '''
+    benchmark.group = 'datagramReceived'
+    datagrams = DUMPS[dump]
+
+    def receive():
+        device = create_replay_device()
+        protocol = device.get_protocol()
+        for datagram in datagrams:
+            protocol.datagramReceived(datagram, None)
+        device._send_updates()
+
+    benchmark(receive)
+
+
+def test_receive_transition(benchmark):
+    '''
+    The whole receive path for a 250-frame transition, with a datagram (and
+    a state update) per frame.
+    '''
+    benchmark.group = 'datagramReceived'
+    device = create_replay_device()
+    protocol = device.get_protocol()
+    for datagram in DUMPS[sorted(DUMPS)[-1]]:
+        protocol.datagramReceived(datagram, None)
+
+    def receive():
+        # Reset the duplicate window, as the same package IDs are sent each round
+        protocol._receive_window.reset()
+        for datagram in TRANSITION:
+            protocol.datagramReceived(datagram, None)
+            device._send_updates()
+
+    benchmark(receive)
@@ -0,0 +1,152 @@
+'''
+Datagrams to benchmark against. Captures recorded with the `capture` device
+option can be supplied by pointing ATEM_BENCHMARK_CAPTURES at a directory of
+`*.cap` files (named for the switcher and firmware, say `2me-8.1.1.cap`);
+otherwise synthetic initial dumps are generated for each firmware version.
+'''
+from avista.devices.blackmagic.atem.capture import read_capture
+from avista.devices.blackmagic.atem.commands import BaseCommand, BaseSetCommand, DataTransferComplete, \
+    DataTransferData, DataTransferError, DataTransferUploadContinue, InitComplete, MediaPoolLockObtained, \
+    TransitionPosition, Version, get_dispatch_table
+from avista.devices.blackmagic.atem.packet import Packet, split_commands
+
+import glob
+import os
+import struct
+
+
+# Protocol versions reported by each firmware version
+FIRMWARE_VERSIONS = {
+    '7.x': (2, 27),
+    '8.0': (2, 28),
+    '8.1.1': (2, 30)
+}
+
+MES = 4
+INPUTS = 40
+UID = 0x8001
+
+# Sent by the switcher only during media transfers, rather than in its dump
+TRANSFER_COMMANDS = frozenset([
+    DataTransferComplete.name,
+    DataTransferData.name,
+    DataTransferError.name,
+    DataTransferUploadContinue.name,
+    MediaPoolLockObtained.name
+])
+
+# Bodies for commands that can't be sampled by zero-filling their format
+SAMPLE_BODIES = {
+    b'AMIP': lambda idx: struct.pack('!HB3x?BBxHhx', idx + 1, 0, False, 1, 1, 32768, 0),
+    b'AMTl': lambda idx: struct.pack('!H', INPUTS) + b''.join(struct.pack('!H?', i + 1, i == idx) for i in range(INPUTS)),
+    b'TlIn': lambda idx: struct.pack('!H', INPUTS) + bytes(1 if i == idx else 0 for i in range(INPUTS)),
+    b'TlSr': lambda idx: struct.pack('!H', INPUTS) + b''.join(struct.pack('!HB', i + 1, i == idx) for i in range(INPUTS)),
+}
+
+
+def _in_dump(name, command_class):
+    '''
+    Whether the switcher sends a command in its initial dump. Those it sends
+    describe its state, so implement apply_to_state; those sent to it (set
+    commands, and others such as cuts) don't.
+    '''
+    if name in (Version.name, InitComplete.name) or name in TRANSFER_COMMANDS:
+        return False
+    return not issubclass(command_class, BaseSetCommand) and command_class.apply_to_state is not BaseCommand.apply_to_state
+
+
+def _indexed(command_class):
+    '''
+    The number of copies of a command in a dump (such as one per M/E or
+    input), distinguished by their first field.
+    '''
+    first = command_class.format.subcons[0].name if command_class.format.subcons else None
+    if first in ('index', 'me'):
+        return MES
+    if first in ('id', 'source'):
+        return INPUTS
+    return 1
+
+
+def sample_commands(version):
+    '''
+    Yields `(name, body)` for sample commands of each class that the ATEM
+    sends in its initial dump in a given protocol version.
+    '''
+    for name, command_class in sorted(get_dispatch_table(version).items()):
+        if not _in_dump(name, command_class):
+            continue
+
+        for idx in range(_indexed(command_class)):
+            if name in SAMPLE_BODIES:
+                body = SAMPLE_BODIES[name](idx)
+            else:
+                try:
+                    body = bytearray(command_class.format.sizeof())
+                    command_class.parse_body(bytes(body))
+                except Exception:
+                    # Variable-length or otherwise unsampleable
+                    break
+                if body:
+                    if _indexed(command_class) == INPUTS:
+                        struct.pack_into('!H', body, 0, idx + 1)
+                    else:
+                        body[0] = idx
+            yield name, bytes(body) + b'\x00' * (-len(body) % 4)
+
+
+def synthetic_dump(firmware):
+    major, minor = FIRMWARE_VERSIONS[firmware]
+    commands = [Version(major=major, minor=minor).to_bytes()]
+    commands.extend(name + body for name, body in sample_commands(float('{}.{}'.format(major, minor))))
+    commands.append(InitComplete(complete=True).to_bytes())
+    return packetise(commands)
+
+
+def transition_traffic(frames=250):
+    '''
+    Datagrams as sent during an auto transition on M/E 1: a transition
+    position for every frame.
+    '''
+    return packetise(
+        [
+            TransitionPosition(
+                index=0,
+                in_transition=True,
+                frames_remaining=frames - frame,
+                position=int(10000 * frame / frames)
+            ).to_bytes()
+        ] for frame in range(frames)
+    )
+
+
+def packetise(commands_or_batches):
+    '''
+    Packs commands into datagrams: a flat list of commands is packed as
+    tightly as possible, while a sequence of lists gives a datagram each.
+    '''
+    if isinstance(commands_or_batches, list) and commands_or_batches and isinstance(commands_or_batches[0], bytes):
+        batches = split_commands(commands_or_batches)
+    else:
+        batches = commands_or_batches
+
+    return [
+        Packet.create_commands(UID, batch, package_id).to_bytes()
+        for package_id, batch in enumerate(batches, start=1)
+    ]
+
+
+def load_dumps():
+    '''
+    Returns a dict of dump name to list of datagrams.
+    '''
+    capture_dir = os.environ.get('ATEM_BENCHMARK_CAPTURES')
+    if capture_dir:
+        captures = sorted(glob.glob(os.path.join(capture_dir, '*.cap')))
+        if captures:
+            return {
+                os.path.splitext(os.path.basename(path))[0]: [datagram for _, datagram in read_capture(path)]
+                for path in captures
+            }
+
+    return {firmware: synthetic_dump(firmware) for firmware in FIRMWARE_VERSIONS}
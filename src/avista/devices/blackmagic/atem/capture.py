@@ -0,0 +1,57 @@
+import struct
+import time
+
+
+# Captures start with this, followed by a record per datagram
+CAPTURE_MAGIC = b'ATEMCAP\x01'
+# Seconds since the epoch, and the length of the datagram that follows
+RECORD_HEADER = struct.Struct('!dH')
+
+
+class InvalidCaptureError(Exception):
+    pass
+
+
+class CaptureWriter(object):
+    '''
+    Records datagrams, with the time they were received, to a file that can
+    be read back by read_capture. An existing capture is appended to rather
+    than replaced.
+    '''
+    def __init__(self, path):
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+
+    def write(self, datagram, timestamp=None):
+        self._file.write(RECORD_HEADER.pack(time.time() if timestamp is None else timestamp, len(datagram)))
+        self._file.write(datagram)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path):
+    '''
+    Yields `(timestamp, datagram)` tuples from a capture file.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise InvalidCaptureError('{} is not an ATEM capture file'.format(path))
+
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                raise InvalidCaptureError('Truncated record in {}'.format(path))
+
+            timestamp, length = RECORD_HEADER.unpack(header)
+            datagram = f.read(length)
+            if len(datagram) < length:
+                raise InvalidCaptureError('Truncated record in {}'.format(path))
+
+            yield timestamp, datagram
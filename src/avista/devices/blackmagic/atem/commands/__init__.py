@@ -1,11 +1,11 @@
 from collections import defaultdict
+from functools import lru_cache
 from construct.core import StreamError
 from recordclass import RecordClass
-import inspect
 import struct
 import txaio
 
-from .base import BaseCommand, BaseSetCommand
+from .base import BaseCommand, BaseSetCommand, RawCommand
 from .audio import *
 from .auxes import *
 from .config import *
@@ -34,7 +34,9 @@ def get_all_subclasses(cls):
 
 COMMAND_LIST = defaultdict(list)
 
-IGNORED_UNIMPLEMENTED_COMMANDS = [
+NULL_COMMAND_NAME = b'\x00\x00\x00\x00'
+
+IGNORED_UNIMPLEMENTED_COMMANDS = frozenset([
     b'CCdP',  # Camera control
     b'CCdo',  # Camera control
     b'CCmd',  # Camera control
@@ -51,9 +53,12 @@ IGNORED_UNIMPLEMENTED_COMMANDS = [
     b'FIEP',
     b'FASP',
     b'FMTl',  # Fairlight audio tally
+    b'AMLv',  # Audio levels, handled by the device when metering is enabled
+    b'FMLv',
+    b'FDLv',
     b'Time',  # This causes pointless state updates multiple times per second
     b'MPfe',  # Bug in parsing this command at the moment
-]
+])
 
 
 for command_class in get_all_subclasses(BaseCommand):
@@ -65,6 +70,8 @@ for command_class in get_all_subclasses(BaseCommand):
             )
         )
         name = command_class.name
+        if hasattr(command_class, 'format'):
+            command_class.compile_codecs()
         COMMAND_LIST[name].append([
             command_class.minimum_version,
             command_class
@@ -73,64 +80,174 @@ for command_class in get_all_subclasses(BaseCommand):
         raise Exception('Command class without defined name: {}'.format(command_class))
 
 
+@lru_cache(maxsize=None)
+def get_dispatch_table(version=None):
+    '''
+    Resolves every command name to the class that parses it for the given
+    protocol version: the one with the highest minimum_version not above it.
+    With no version, the most recent class for each command is used. Classes
+    without a format (such as TopologyBase) can't be parsed and are skipped.
+    '''
+    table = {}
+    for name, options in COMMAND_LIST.items():
+        for minimum_version, command_class in sorted(options, key=lambda o: o[0]):
+            if not hasattr(command_class, 'format'):
+                continue
+            if version is None or minimum_version <= version:
+                table[name] = command_class
+    return table
+
+
+LATEST_COMMANDS = get_dispatch_table()
+
+
+# Size (including this header) and two padding bytes, followed by a four-byte command name
+COMMAND_HEADER = struct.Struct('!H2x4s')
+
+
+class MalformedCommandError(Exception):
+    pass
+
+
+def iter_commands(payload):
+    '''
+    Walks the commands framed in a packet payload by offset, yielding
+    `(name, body)` tuples where `body` is a memoryview into `payload`. Raises
+    MalformedCommandError for a size field that is too small or overruns the
+    payload, rather than looping over it.
+    '''
+    view = memoryview(payload)
+    end = len(view)
+    offset = 0
+
+    while offset + COMMAND_HEADER.size <= end:
+        size, name = COMMAND_HEADER.unpack_from(view, offset)
+
+        if size < COMMAND_HEADER.size or offset + size > end:
+            raise MalformedCommandError(
+                'Invalid size {} for command {} at offset {} of {}'.format(size, name, offset, end)
+            )
+
+        yield name, view[offset + COMMAND_HEADER.size:offset + size]
+        offset += size
+
+
+class DecodePolicy(object):
+    DECODE = 'decode'  # Fully decode (the default)
+    RAW = 'raw'  # Keep the undecoded bytes in the `raw` branch of state
+    SKIP = 'skip'  # Discard without decoding
+    LAZY = 'lazy'  # Hold undecoded until the state it feeds is requested
+
+    ALL = frozenset([DECODE, RAW, SKIP, LAZY])
+
+
+def parse_decode_policy(spec):
+    '''
+    Parses a decode policy from device config: either a dict of command name
+    to policy, or a string of the form `MPfM=skip,VuMC=lazy`.
+    '''
+    if not spec:
+        return {}
+
+    if isinstance(spec, str):
+        spec = dict(
+            entry.strip().split('=', 1) for entry in spec.split(',') if entry.strip()
+        )
+
+    policy = {}
+    for name, mode in spec.items():
+        mode = mode.strip().lower()
+        if mode not in DecodePolicy.ALL:
+            raise ValueError('Unknown decode policy {} for command {}'.format(mode, name))
+        if isinstance(name, str):
+            name = name.strip().encode('ascii')
+        if mode != DecodePolicy.DECODE:
+            policy[name] = mode
+    return policy
+
+
 class CommandParser(object):
-    def __init__(self):
+    '''
+    Parses commands from packet payloads. Commands with a handler (a callable
+    taking the command's body, keyed by name in `handlers`) are passed to it
+    undecoded rather than being parsed.
+    '''
+    def __init__(self, policy=None, handlers=None):
         self._version = None
+        self._commands = LATEST_COMMANDS
+        self._policy = policy or {}
+        self._handlers = handlers or {}
+
+    def set_version(self, version):
+        if version != self._version:
+            self._version = version
+            self._commands = get_dispatch_table(version)
+            log.info(
+                'Set ATEM protocol version to {ver}',
+                ver=self._version
+            )
 
     def parse_commands(self, payload):
         commands = []
-        if len(payload) > 2:
-            while len(payload) > 0:
-                size = struct.unpack('!H', payload[0:2])[0]
-                command = payload[4:size]
-                payload = payload[size:]
-
-                if int.from_bytes(command[:4], 'big') & 0xFFFFFFFF:
-                    cmd = self.parse_command(command)
+        try:
+            for name, body in iter_commands(payload):
+                if name != NULL_COMMAND_NAME:
+                    handler = self._handlers.get(name)
+                    if handler:
+                        try:
+                            handler(body)
+                        except Exception as e:
+                            # The rest of the payload is unaffected
+                            log.error(
+                                'Error handling command {cmd}: {err}',
+                                cmd=name,
+                                err=e
+                            )
+                        continue
+
+                    policy = self._policy.get(name)
+                    if policy is None:
+                        cmd = self.parse_command(name, body)
+                    elif policy == DecodePolicy.SKIP:
+                        continue
+                    else:
+                        cmd = RawCommand(name, bytes(body), lazy=(policy == DecodePolicy.LAZY))
+
                     if cmd:
                         commands.append(cmd)
                         if isinstance(cmd, Version):
-                            self._version = float(
-                                '{}.{}'.format(
-                                    cmd.major,
-                                    cmd.minor
+                            self.set_version(
+                                float(
+                                    '{}.{}'.format(
+                                        cmd.major,
+                                        cmd.minor
+                                    )
                                 )
                             )
-                            log.info(
-                                'Set ATEM protocol version to {ver}',
-                                ver=self._version
-                            )
+        except MalformedCommandError as e:
+            log.error(
+                'Discarding remainder of malformed payload: {err}',
+                err=e
+            )
         return commands
 
-    def parse_command(self, payload):
-        command_type = payload[:4]
-
-        cmd_class = COMMAND_LIST.get(command_type)
+    def parse_command(self, command_type, body):
+        cmd_class = self._commands.get(command_type)
 
         try:
-            if inspect.isclass(cmd_class):
-                return cmd_class.parse(payload)
-            elif isinstance(cmd_class, list):
-                if self._version is None:
-                    return cmd_class[-1][1].parse(payload)
-                else:
-                    version_options = sorted(cmd_class, key=lambda o: -o[0])
-
-                    res = next(
-                        val for val in version_options if val[0] <= self._version
-                    )
-                    return res[1].parse(payload)
+            if cmd_class:
+                return cmd_class.parse_body(body)
             elif command_type not in IGNORED_UNIMPLEMENTED_COMMANDS:
                 log.warn(
                     'Command {cmd} not recognised for version {ver}: {full}',
                     cmd=command_type,
                     ver=self._version,
-                    full=payload
+                    full=bytes(body)
                 )
         except (StreamError, UnicodeDecodeError) as e:
             log.error(
                 'Failed to parse command {cmd}! {full}',
                 cmd=command_type,
-                full=payload
+                full=bytes(body)
             )
             print(e)
@@ -1,7 +1,7 @@
 from construct import Const, Struct, Flag, Int8ub, Int16ub, Int16sb, Padding, Rebuild, len_, this
 
 from avista.devices.blackmagic.atem.constants import AudioSource, AudioSourceType, AudioSourcePlugType, AudioMixOption
-from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_key
+from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_key, clone_state_with_path
 
 
 class AudioMixerInput(BaseCommand):
@@ -20,8 +20,7 @@ class AudioMixerInput(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, audio_sources = clone_state_with_key(state, 'audio_sources')
-        input = audio_sources.setdefault(self.source, {})
+        new_state, input = clone_state_with_path(state, 'audio_sources', self.source)
 
         input['type'] = self.type
         input['from_media_player'] = self.from_media_player
@@ -136,3 +135,26 @@ class ResetInputAudioMeterPeaks(BaseSetCommand):
         Const(0, Int8ub),
         Padding(3)
     )
+
+
+class SendAudioLevels(BaseSetCommand):
+    '''
+    Enables or disables the switcher sending audio mixer levels (AMLv).
+    '''
+    name = b'SALN'
+    format = Struct(
+        'enabled' / Flag,
+        Padding(3)
+    )
+
+
+class SendFairlightLevels(BaseSetCommand):
+    '''
+    Enables or disables the switcher sending Fairlight mixer levels (FMLv
+    and FDLv).
+    '''
+    name = b'SFLN'
+    format = Struct(
+        'enabled' / Flag,
+        Padding(3)
+    )
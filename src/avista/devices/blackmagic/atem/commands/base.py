@@ -1,36 +1,88 @@
 from construct import Adapter, Const
-from avista.devices.blackmagic.atem.constants import VideoSource
+from operator import itemgetter
+from types import MemberDescriptorType
 
 import copy
+import keyword
+import txaio
+
+
+log = txaio.make_logger()
+
+
+# Above this, EnumFlagAdapter stops caching decoded values
+MAX_CACHED_FLAG_VALUES = 1024
+
+
+class FrozenDict(dict):
+    '''
+    A dict that can't be modified, so that one instance can be shared by every
+    command that decodes the same value.
+    '''
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenDict is immutable')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _enum_table(enum_class):
+    '''
+    A lookup from value to member: a list indexed by value if the enum's
+    values are small and dense enough (such as TransitionStyle), or a dict
+    otherwise (such as VideoSource).
+    '''
+    values = {member.value: member for member in enum_class}
+    if min(values) >= 0 and max(values) < 2 * len(values) + 16:
+        table = [None] * (max(values) + 1)
+        for value, member in values.items():
+            table[value] = member
+        return table
+    return values
 
 
 def EnumAdapter(enum_class):
+    table = _enum_table(enum_class)
+
+    if isinstance(table, list):
+        def lookup(obj):
+            member = table[obj] if 0 <= obj < len(table) else None
+            return enum_class(obj) if member is None else member
+    else:
+        def lookup(obj):
+            member = table.get(obj)
+            return enum_class(obj) if member is None else member
+
     class _EnumAdapter(Adapter):
         def _decode(self, obj, context, path):
-            return enum_class(obj)
+            return lookup(obj)
 
         def _encode(self, obj, context, path):
-            return obj.value if obj else None
+            return None if obj is None else int(obj)
     return _EnumAdapter
 
 
 def EnumFlagAdapter(enum_class):
+    # Each member after the first is flagged by a bit, in order of definition
+    flags = [(enum_value, 1 << idx - 1) for idx, enum_value in enumerate(enum_class) if idx > 0]
+    decoded = {}
+
     class _EnumFlagAdapter(Adapter):
         def _decode(self, obj, context, path):
-            values = {}
-
-            for idx, enum_value in enumerate(enum_class):
-                if idx > 0:
-                    mask = 1 << idx - 1
-                    values[enum_value] = (obj & mask) > 0
-
+            values = decoded.get(obj)
+            if values is None:
+                values = FrozenDict((enum_value, (obj & mask) > 0) for enum_value, mask in flags)
+                if len(decoded) < MAX_CACHED_FLAG_VALUES:
+                    decoded[obj] = values
             return values
 
         def _encode(self, obj, context, path):
             value = 0
-            for idx, enum_value in enumerate(enum_class):
-                if idx > 0 and obj.get(enum_value, False):
-                    value |= 1 << idx - 1
+            for enum_value, mask in flags:
+                if obj.get(enum_value, False):
+                    value |= mask
 
             return value
 
@@ -50,8 +102,114 @@ class PaddedCStringAdapter(Adapter):
         return obj
 
 
-class BaseCommand(object):
+def _values_constructor(fields):
+    '''
+    Generates `_from_values`, which constructs a command from the values of
+    `fields`, given positionally, in a single run of assignments.
+    '''
+    params = ['value{}'.format(i) for i in range(len(fields))]
+    lines = ['def _from_values(cls{}):'.format(''.join(', ' + param for param in params))]
+    lines.append('    self = cls.__new__(cls)')
+    for field, param in zip(fields, params):
+        if field.isidentifier() and not keyword.iskeyword(field):
+            lines.append('    self.{} = {}'.format(field, param))
+        else:
+            lines.append('    setattr(self, {!r}, {})'.format(field, param))
+    lines.append('    return self')
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return classmethod(namespace['_from_values'])
+
+
+def _values_getter(fields):
+    '''
+    Returns a function giving a tuple of the values of `fields` in a parsed
+    container.
+    '''
+    if len(fields) > 1:
+        return itemgetter(*fields)
+    if fields:
+        field, = fields
+        return lambda container: (container[field],)
+    return lambda container: ()
+
+
+class CommandMeta(type):
+    '''
+    Gives each command class a `_fields` tuple of the names of its format's
+    public fields, in order, and `__slots__` for those not already slotted by
+    a base class, so that instances don't each need a `__dict__`. Fields that
+    would shadow a class attribute (such as a `name` field, which would hide
+    the command name), or that aren't valid identifiers, are kept in an
+    instance `__dict__` instead.
+
+    Decoded commands are built by `_from_values`, which takes the fields'
+    values positionally (as `_field_values` gives them from a parsed
+    container) rather than through __init__.
+    '''
+    def __new__(mcs, cls_name, bases, namespace):
+        format = namespace.get('format')
+        if format is None:
+            format = next((base.format for base in bases if hasattr(base, 'format')), None)
+
+        fields = tuple(
+            subcon.name for subcon in getattr(format, 'subcons', ())
+            if subcon.name and subcon.name[0] != '_'
+        )
+        namespace['_fields'] = fields
+        namespace['_from_values'] = _values_constructor(fields)
+        namespace['_field_values'] = staticmethod(_values_getter(fields))
+
+        if '__slots__' not in namespace:
+            slots = []
+            unslotted = False
+            for field in fields:
+                inherited = [getattr(base, field) for base in bases if hasattr(base, field)]
+                if inherited and isinstance(inherited[0], MemberDescriptorType):
+                    continue
+                if inherited or field in namespace or not field.isidentifier():
+                    unslotted = True
+                else:
+                    slots.append(field)
+
+            if unslotted and not any(base.__dictoffset__ for base in bases):
+                slots.append('__dict__')
+            namespace['__slots__'] = tuple(slots)
+
+        return super().__new__(mcs, cls_name, bases, namespace)
+
+
+class BaseCommand(object, metaclass=CommandMeta):
+    __slots__ = ()
     minimum_version = -1
+    # Whether this command's format may be compiled for parsing
+    compile_format = True
+
+    @classmethod
+    def compile_codecs(cls):
+        '''
+        Builds this command's full struct, and compiles its format for parsing
+        where construct is able to. Formats that can't be compiled (such as
+        those with a Rebuild calculated by a function) are parsed by the
+        interpreted format instead. Called once per command class at import.
+        '''
+        cls._struct = Const(cls.name) + cls.format
+        if not cls.compile_format:
+            cls._parser = cls.format
+            return
+        try:
+            cls._parser = cls.format.compile()
+        except (NotImplementedError, SyntaxError) as e:
+            # construct raises NotImplementedError for constructs it can't
+            # compile, and emits invalid source for lambdas it can't represent
+            log.info(
+                'Unable to compile format of {cls} ({name}), so it will be parsed uncompiled: {e!r}',
+                cls=cls.__name__,
+                name=cls.name,
+                e=e
+            )
+            cls._parser = cls.format
 
     @classmethod
     def parse(cls, raw):
@@ -60,33 +218,50 @@ class BaseCommand(object):
             **struct
         )
 
+    @classmethod
+    def parse_body(cls, body):
+        parser = cls.__dict__.get('_parser', cls.format)
+        return cls._from_values(*cls._field_values(parser.parse(body)))
+
     @classmethod
     def _full_struct(cls):
-        return Const(cls.name) + cls.format
+        if '_struct' not in cls.__dict__:
+            cls._struct = Const(cls.name) + cls.format
+        return cls._struct
 
     def __init__(self, *args, **kwargs):
-        for subcon in self.format.subcons:
-            if subcon.name and subcon.name[0] != "_":
-                if subcon.name not in kwargs:
-                    self.handle_missing_value(subcon.name)
-                else:
-                    setattr(self, subcon.name, kwargs[subcon.name])
+        for field in self._fields:
+            if field in kwargs:
+                setattr(self, field, kwargs[field])
+            else:
+                self.handle_missing_value(field)
 
     def handle_missing_value(self, value_name):
         raise Exception('Missing needed value {}'.format(value_name))
 
+    def _values(self):
+        '''
+        The values of those fields that have been set.
+        '''
+        values = {}
+        for field in self._fields:
+            try:
+                values[field] = getattr(self, field)
+            except AttributeError:
+                pass
+        return values
+
     def to_bytes(self):
-        return self.__class__._full_struct().build(self.__dict__)
+        return self.__class__._full_struct().build(self._values())
 
     def to_object(self):
         return self.__class__._full_struct().parse(self.to_bytes())
 
     def __repr__(self):
-        struct = self.to_object()
         return '<{} ({}): {}>'.format(
             self.__class__.__name__,
-            self.name,
-            struct.__repr__()
+            self.__class__.name,
+            self._values()
         )
 
     def apply_to_state(self, state):
@@ -94,6 +269,30 @@ class BaseCommand(object):
         return state
 
 
+class RawCommand(object):
+    '''
+    A command left undecoded by the device's decode policy. Raw commands
+    store their most recent bytes in the `raw` branch of state; lazy ones are
+    held by the device and decoded when the state they feed is requested.
+    '''
+    def __init__(self, name, data, lazy=False):
+        self.name = name
+        self.data = data
+        self.lazy = lazy
+
+    def apply_to_state(self, state):
+        new_state, raw = clone_state_with_key(state, 'raw')
+        raw[self.name.decode('latin-1')] = self.data
+        return new_state
+
+    def __repr__(self):
+        return '<{} ({}): {}>'.format(
+            self.__class__.__name__,
+            self.name,
+            self.data
+        )
+
+
 class BaseSetCommand(BaseCommand):
     def handle_missing_value(self, value_name):
         pass
@@ -118,102 +317,20 @@ def clone_state_with_key(state, key, default=None):
     return (new_state, new_state[key])
 
 
-SUPER_SOURCES = [VideoSource.SUPER_SOURCE_1, VideoSource.SUPER_SOURCE_2]
-
-
-def recalculate_synthetic_tally(state):
-    new_state, tally = clone_state_with_key(state, 'tally')
-
-    tally['by_me'] = {}
-
-    for idx, me in new_state.get('mes', {}).items():
-        this_me = {}
-
-        if me.get('preview') is not None:
-            this_me.setdefault(me['preview'], {})['preview'] = True
-
-            if me['preview'] in SUPER_SOURCES:
-                for sssrc in _get_all_supersource_sources(new_state.get('super_source', {})):
-                    this_me.setdefault(sssrc, {})['preview'] = True
-
-        if me.get('program') is not None:
-            this_me.setdefault(me['program'], {})['program'] = True
-
-            if me['program'] in SUPER_SOURCES:
-                for sssrc in _get_all_supersource_sources(new_state.get('super_source', {})):
-                    this_me.setdefault(sssrc, {})['program'] = True
-
-        # Also consider any active upstream keyers:
-        for keyer in me.get('keyers', {}).values():
-            if keyer.get('on_air'):
-                if keyer.get('fill_source'):
-                    this_me.setdefault(keyer['fill_source'], {})['program'] = True
-                if keyer.get('key_source'):
-                    this_me.setdefault(keyer['key_source'], {})['program'] = True
-
-                if keyer.get('fill_source') in SUPER_SOURCES or keyer.get('key_source') in SUPER_SOURCES:
-                    for sssrc in _get_all_supersource_sources(new_state.get('super_source', {})):
-                        this_me.setdefault(sssrc, {})['program'] = True
-
-        # If we're transitioning, we need to consider both program and preview live
-        if me.get('transition'):
-            if me['transition'].get('next'):
-                transition = me['transition']
-
-                if transition.get('position', {}).get('in_transition'):
-                    tie = transition.get('next', {})
-
-                    if tie.get('background') and me.get('preview') is not None:
-                        this_me.setdefault(me['preview'], {})['program'] = True
-
-                    for index, keyer in enumerate(me.get('keyers', {}).values()):
-                        key_tie = "key_{}".format(index + 1)
-                        if tie.get(key_tie):
-                            if keyer.get('fill_source') is not None:
-                                this_me.setdefault(keyer['fill_source'], {})['program'] = True
-                            if keyer.get('key_source') is not None:
-                                this_me.setdefault(keyer['key_source'], {})['program'] = True
-
-                            if keyer.get('fill_source') in SUPER_SOURCES or keyer.get('key_source') in SUPER_SOURCES:
-                                for sssrc in _get_all_supersource_sources(new_state.get('super_source', {})):
-                                    this_me.setdefault(sssrc, {})['program'] = True
-
-        for source in new_state.get('sources', []):
-            this_source = this_me.setdefault(source, {})
-
-            if 'preview' not in this_source:
-                this_source['preview'] = False
-            if 'program' not in this_source:
-                this_source['program'] = False
-
-        tally['by_me'][idx] = this_me
-
-    # DSKs always appear on M/E 1 (index 0)
-    for dsk in new_state.get('dsks', {}).values():
-        dsk_state = dsk.get('state', {})
-        if dsk_state.get('on_air') or dsk_state.get('is_transitioning'):
-            if dsk.get('fill_source'):
-                tally['by_me'][0][dsk['fill_source']]['program'] = True
-            if dsk.get('key_source'):
-                tally['by_me'][0][dsk['key_source']]['program'] = True
-
-            if dsk.get('fill_source') in SUPER_SOURCES or dsk.get('key_source') in SUPER_SOURCES:
-                for sssrc in _get_all_supersource_sources(new_state.get('super_source', {})):
-                    tally['by_me'][0][sssrc]['program'] = True
-
-    return new_state
-
-
-def _get_all_supersource_sources(ssrc):
-    sources = []
-
-    if ssrc.get('fill_source'):
-        sources.append(ssrc['fill_source'])
-    if ssrc.get('key_source') and ssrc.get('foreground'):
-        sources.append(ssrc['key_source'])
+def clone_state_with_path(state, *path):
+    '''
+    Path-copies `state` down to the node at `path`, creating any missing
+    nodes: each dict on the path is shallow-copied, and everything else is
+    shared with `state`. Returns the new state and the node at `path`, which
+    (unlike its children) can be modified without affecting `state`.
+    '''
+    new_state = state.copy()
+    node = new_state
 
-    for box in ssrc.get('boxes', []):
-        if box.get('enabled'):
-            sources.append(box['source'])
+    for key in path:
+        child = node.get(key)
+        child = {} if child is None else child.copy()
+        node[key] = child
+        node = child
 
-    return sources
+    return (new_state, node)
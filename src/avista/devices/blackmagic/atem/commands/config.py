@@ -1,6 +1,6 @@
 from avista.devices.blackmagic.atem.constants import SDI3GOutputLevel, VideoMode
 from construct import Bytes, BitStruct, Struct, Const, Flag, Int8ub, Int16ub, Int32ub, Padding
-from .base import BaseCommand, EnumAdapter, EnumFlagAdapter, clone_state_with_key, PaddedCStringAdapter
+from .base import BaseCommand, EnumAdapter, EnumFlagAdapter, clone_state_with_key, clone_state_with_path, PaddedCStringAdapter
 
 import copy
 
@@ -125,8 +125,7 @@ class MixEffectBusConfig(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-        me = mes.setdefault(self.id, {})
+        new_state, me = clone_state_with_path(state, 'mes', self.id)
         me['keyers'] = {
             idx: {} for idx in range(self.keyers)
         }
@@ -141,8 +140,7 @@ class MediaPoolConfig(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mpl = config.setdefault('media_pool', {})
+        new_state, mpl = clone_state_with_path(state, 'config', 'media_pool')
         mpl['stills'] = self.stills
         mpl['clips'] = self.clips
         return new_state
@@ -162,8 +160,7 @@ class MultiviewerConfigV7(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvc = config.setdefault('multiviewer', {})
+        new_state, mvc = clone_state_with_path(state, 'config', 'multiviewer')
         mvc['count'] = self.count
         mvc['window_count'] = self.window_count
         mvc['can_route_inputs'] = self.can_route_inputs
@@ -188,8 +185,7 @@ class MultiviewerConfigV8(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvc = config.setdefault('multiviewer', {})
+        new_state, mvc = clone_state_with_path(state, 'config', 'multiviewer')
         mvc['count'] = self.count
         mvc['window_count'] = self.window_count
         mvc['can_route_inputs'] = self.can_route_inputs
@@ -215,8 +211,7 @@ class MultiviewerConfigV811(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvc = config.setdefault('multiviewer', {})
+        new_state, mvc = clone_state_with_path(state, 'config', 'multiviewer')
         mvc['window_count'] = self.window_count
         mvc['can_change_layout'] = self.can_change_layout
         mvc['can_route_inputs'] = self.can_route_inputs
@@ -236,8 +231,7 @@ class AudioMixerConfig(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        audio = config.setdefault('audio', {})
+        new_state, audio = clone_state_with_path(state, 'config', 'audio')
         audio['input_count'] = self.inputs
         audio['monitor_count'] = self.monitors
         audio['headphones_count'] = self.headphones
@@ -264,8 +258,7 @@ class DownConvertVideoMode(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        dc = config.setdefault('downconverter', {})
+        new_state, dc = clone_state_with_path(state, 'config', 'downconverter')
         dc[self.core_mode] = self.down_converted_mode
         return new_state
 
@@ -378,8 +371,9 @@ class SuperSourceBoxCount(BaseCommand):
 
     def apply_to_state(self, state):
         new_state, ssrc = clone_state_with_key(state, 'super_source')
-        for ss in ssrc.values():
-            boxes = ss.setdefault('boxes', {})
+        for idx in list(ssrc.keys()):
+            ss = ssrc[idx] = copy.copy(ssrc[idx])
+            boxes = ss['boxes'] = copy.copy(ss.get('boxes', {}))
             for i in range(self.count):
                 boxes[i] = {"enabled": False}
 
@@ -1,7 +1,7 @@
 from avista.devices.blackmagic.atem.constants import KeyType, VideoSource
 from construct import Struct, Int8ub, Int16ub, Int16sb, Padding, Flag
 
-from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_key, recalculate_synthetic_tally
+from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_path
 
 
 class DownstreamKeyerSource(BaseCommand):
@@ -15,13 +15,12 @@ class DownstreamKeyerSource(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, dsks = clone_state_with_key(state, 'dsks')
-        dsk = dsks.get(self.index, {})
+        new_state, dsk = clone_state_with_path(state, 'dsks', self.index)
 
         dsk['fill_source'] = self.fill_source
         dsk['key_source'] = self.key_source
 
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class DownstreamKeyerProperties(BaseCommand):
@@ -43,8 +42,7 @@ class DownstreamKeyerProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, dsks = clone_state_with_key(state, 'dsks')
-        dsk = dsks.get(self.index, {})
+        new_state, dsk = clone_state_with_path(state, 'dsks', self.index)
 
         dsk['tie'] = self.tie
         dsk['rate'] = self.rate
@@ -60,8 +58,6 @@ class DownstreamKeyerProperties(BaseCommand):
             'right': self.mask_right
         }
 
-        new_state['dsks'][self.index] = dsk
-
         return new_state
 
 
@@ -77,8 +73,7 @@ class DownstreamKeyerState(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, dsks = clone_state_with_key(state, 'dsks')
-        dsk = dsks.get(self.index, {})
+        new_state, dsk = clone_state_with_path(state, 'dsks', self.index)
 
         dsk['state'] = {
             'on_air': self.on_air,
@@ -87,9 +82,7 @@ class DownstreamKeyerState(BaseCommand):
             'frames_remaining': self.frames_remaining
         }
 
-        new_state['dsks'][self.index] = dsk
-
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SetDownstreamKeyerOnAir(BaseSetCommand):
@@ -1,6 +1,6 @@
 from avista.devices.blackmagic.atem.constants import MacroActionType
 from construct import Struct, Flag, Int8ub, Int16ub, PaddedString, Padding, this
-from .base import BaseCommand, BaseSetCommand, clone_state_with_key, EnumAdapter
+from .base import BaseCommand, BaseSetCommand, clone_state_with_path, EnumAdapter
 
 
 class MacroProperties(BaseCommand):
@@ -16,9 +16,8 @@ class MacroProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, macros = clone_state_with_key(state, 'macros')
+        new_state, macro = clone_state_with_path(state, 'macros', self.id)
 
-        macro = macros.setdefault(self.id, {})
         macro['used'] = self.used
         macro['name'] = self.name
         macro['description'] = self.description
@@ -1,6 +1,6 @@
 from avista.devices.blackmagic.atem.constants import MediaPoolFileType
-from construct import Struct, Bytes, Const, Flag, Int8ub, Int16ub, CString, Padding, GreedyBytes
-from .base import BaseCommand, EnumAdapter, PaddedCStringAdapter, clone_state_with_key
+from construct import Struct, Bytes, Const, Flag, Int8ub, Int16ub, Int32ub, CString, Padding, GreedyBytes, Prefixed
+from .base import BaseCommand, BaseSetCommand, EnumAdapter, PaddedCStringAdapter, clone_state_with_key, clone_state_with_path
 
 
 # class MediaPoolFrameDescription(BaseCommand):
@@ -37,8 +37,7 @@ class MediaPoolClipDescription(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, media = clone_state_with_key(state, 'media_pool')
-        clip_pool = media.setdefault('clip', {})
+        new_state, clip_pool = clone_state_with_path(state, 'media_pool', 'clip')
 
         clip_pool[self.index] = {
             'name': self.name,
@@ -67,8 +66,7 @@ class MediaPoolLockState(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, media = clone_state_with_key(state, 'media_pool')
-        locks = media.setdefault('locks', {})
+        new_state, locks = clone_state_with_path(state, 'media_pool', 'locks')
 
         locks[self.index] = self.lock
 
@@ -85,8 +83,8 @@ class MediaPlayerSplit(BaseCommand):
     def apply_to_state(self, state):
         new_state, media = clone_state_with_key(state, 'media_player')
 
-        media.setdefault(0, {})['storage'] = self.clip_1
-        media.setdefault(1, {})['storage'] = self.clip_2
+        media[0] = dict(media.get(0, {}), storage=self.clip_1)
+        media[1] = dict(media.get(1, {}), storage=self.clip_2)
 
         return new_state
 
@@ -101,8 +99,7 @@ class MediaPlayerSource(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, media = clone_state_with_key(state, 'media_player')
-        player = media.setdefault(self.index, {})
+        new_state, player = clone_state_with_path(state, 'media_player', self.index)
 
         player['source'] = {
             'type': self.type,
@@ -124,8 +121,7 @@ class MediaPlayerAudioSource(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, media = clone_state_with_key(state, 'media_player')
-        player = media.setdefault(self.index, {})
+        new_state, player = clone_state_with_path(state, 'media_player', self.index)
 
         player['audio'] = {
             'used': self.used,
@@ -146,8 +142,7 @@ class MediaPlayerState(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, media = clone_state_with_key(state, 'media_player')
-        player = media.setdefault(self.index, {})
+        new_state, player = clone_state_with_path(state, 'media_player', self.index)
 
         player['state'] = {
             'playing': self.playing,
@@ -157,3 +152,120 @@ class MediaPlayerState(BaseCommand):
         }
 
         return new_state
+
+
+class MediaPoolLock(BaseSetCommand):
+    name = b'LOCK'
+    format = Struct(
+        'index' / Int16ub,
+        'lock' / Flag,
+        Padding(1)
+    )
+
+
+class MediaPoolLockObtained(BaseCommand):
+    name = b'LKOB'
+    format = Struct(
+        'index' / Int16ub,
+        Padding(2)
+    )
+
+    def apply_to_state(self, state):
+        return state
+
+
+class DataTransferUploadRequest(BaseSetCommand):
+    name = b'FTSD'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'store' / Int16ub,
+        Padding(2),
+        'slot' / Int16ub,
+        'size' / Int32ub,
+        'mode' / Int16ub,
+        Padding(2)
+    )
+
+
+class DataTransferDownloadRequest(BaseSetCommand):
+    name = b'FTSU'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'store' / Int16ub,
+        Padding(2),
+        'slot' / Int16ub,
+        'mode' / Int16ub,
+        Padding(2)
+    )
+
+
+class DataTransferUploadContinue(BaseCommand):
+    name = b'FTCD'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        Padding(4),
+        'chunk_size' / Int16ub,
+        'chunk_count' / Int16ub,
+        Padding(2)
+    )
+
+    def apply_to_state(self, state):
+        return state
+
+
+class DataTransferData(BaseCommand):
+    # Sent in both directions
+    name = b'FTDa'
+    # Compiled, Prefixed doesn't check that there's as much data as the prefix
+    # claims, so truncated chunks would be accepted
+    compile_format = False
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'data' / Prefixed(Int16ub, GreedyBytes)
+    )
+
+    def apply_to_state(self, state):
+        return state
+
+
+class DataTransferFileDescription(BaseSetCommand):
+    name = b'FTFD'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'filename' / PaddedCStringAdapter(Bytes(64)),
+        'description' / PaddedCStringAdapter(Bytes(128)),
+        'hash' / Bytes(16),
+        Padding(2)
+    )
+
+
+class DataTransferAck(BaseSetCommand):
+    name = b'FTUA'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'slot' / Int8ub,
+        Padding(1)
+    )
+
+
+class DataTransferComplete(BaseCommand):
+    name = b'FTDC'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        Padding(2)
+    )
+
+    def apply_to_state(self, state):
+        return state
+
+
+class DataTransferError(BaseCommand):
+    name = b'FTDE'
+    format = Struct(
+        'transfer_id' / Int16ub,
+        'error_code' / Int8ub,
+        Padding(1)
+    )
+
+    def apply_to_state(self, state):
+        return state
@@ -1,9 +1,7 @@
 from avista.devices.blackmagic.atem.constants import KeyType, PatternStyle, TransitionStyle, VideoSource
 from construct import BitStruct, Const, Struct, Int8ub, Int16ub, Int16sb, Padding, Flag, Rebuild, obj_, Default
 
-from .base import BaseCommand, BaseSetCommand, EnumAdapter, EnumFlagAdapter, clone_state_with_key, recalculate_synthetic_tally
-
-import copy
+from .base import BaseCommand, BaseSetCommand, EnumAdapter, EnumFlagAdapter, clone_state_with_path
 
 
 class PreviewInput(BaseCommand):
@@ -16,11 +14,9 @@ class PreviewInput(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
+        new_state, me = clone_state_with_path(state, 'mes', self.index)
         me['preview'] = self.source
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SetPreviewInput(BaseCommand):
@@ -50,11 +46,9 @@ class ProgramInput(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
+        new_state, me = clone_state_with_path(state, 'mes', self.index)
         me['program'] = self.source
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class PerformCut(BaseCommand):
@@ -95,9 +89,7 @@ class TransitionProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
+        new_state, me = clone_state_with_path(state, 'mes', self.index)
         me['transition'] = {
             'style': self.style,
             'next': {
@@ -156,10 +148,8 @@ class TransitionPreview(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {})['preview'] = self.enabled
+        new_state, transition = clone_state_with_path(state, 'mes', self.index, 'transition')
+        transition['preview'] = self.enabled
         return new_state
 
 
@@ -175,15 +165,13 @@ class TransitionPosition(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {})['position'] = {
+        new_state, transition = clone_state_with_path(state, 'mes', self.index, 'transition')
+        transition['position'] = {
             'in_transition': self.in_transition,
             'frames_remaining': self.frames_remaining,
             'position': self.position
         }
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SetTransitionPosition(BaseSetCommand):
@@ -204,10 +192,8 @@ class TransitionMixProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {}).setdefault('properties', {})['mix'] = {
+        new_state, properties = clone_state_with_path(state, 'mes', self.index, 'transition', 'properties')
+        properties['mix'] = {
             'rate': self.rate
         }
         return new_state
@@ -231,10 +217,8 @@ class TransitionDipProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {}).setdefault('properties', {})['dip'] = {
+        new_state, properties = clone_state_with_path(state, 'mes', self.index, 'transition', 'properties')
+        properties['dip'] = {
             'rate': self.rate,
             'source': self.source
         }
@@ -289,10 +273,8 @@ class TransitionWipeProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {}).setdefault('properties', {})['wipe'] = {
+        new_state, properties = clone_state_with_path(state, 'mes', self.index, 'transition', 'properties')
+        properties['wipe'] = {
             'rate': self.rate,
             'pattern': self.pattern,
             'width': self.width,
@@ -329,10 +311,8 @@ class TransitionDVEProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {}).setdefault('properties', {})['dve'] = {
+        new_state, properties = clone_state_with_path(state, 'mes', self.index, 'transition', 'properties')
+        properties['dve'] = {
             'rate': self.rate,
             'style': self.style,
             'fill_source': self.fill_source,
@@ -367,10 +347,8 @@ class TransitionStingerProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        me.setdefault('transition', {}).setdefault('properties', {})['stinger'] = {
+        new_state, properties = clone_state_with_path(state, 'mes', self.index, 'transition', 'properties')
+        properties['stinger'] = {
             'source': self.source,
             'pre_multiplied': self.pre_multiplied,
             'clip': self.clip,
@@ -394,13 +372,8 @@ class KeyerOnAir(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        keyer = me.setdefault('keyers', {}).get(self.key_index, {})
-
-        me['keyers'][self.key_index] = copy.copy(keyer)
-        me['keyers'][self.key_index]['on_air'] = self.enabled
+        new_state, keyer = clone_state_with_path(state, 'mes', self.index, 'keyers', self.key_index)
+        keyer['on_air'] = self.enabled
 
         return new_state
 
@@ -435,18 +408,13 @@ class KeyerBaseProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        keyer = me.setdefault('keyers', {}).get(self.key_index, {})
-
-        me['keyers'][self.key_index] = copy.copy(keyer)
-        me['keyers'][self.key_index]['type'] = self.type
-        me['keyers'][self.key_index]['can_fly'] = self.can_fly
-        me['keyers'][self.key_index]['fly_enabled'] = self.fly_enabled
-        me['keyers'][self.key_index]['fill_source'] = self.fill_source
-        me['keyers'][self.key_index]['key_source'] = self.key_source
-        me['keyers'][self.key_index]['mask'] = {
+        new_state, keyer = clone_state_with_path(state, 'mes', self.index, 'keyers', self.key_index)
+        keyer['type'] = self.type
+        keyer['can_fly'] = self.can_fly
+        keyer['fly_enabled'] = self.fly_enabled
+        keyer['fill_source'] = self.fill_source
+        keyer['key_source'] = self.key_source
+        keyer['mask'] = {
             'enabled': self.mask_enabled,
             'top': self.mask_top,
             'bottom': self.mask_bottom,
@@ -502,13 +470,8 @@ class KeyLumaProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        keyer = me.setdefault('keyers', {}).get(self.key_index, {})
-
-        me['keyers'][self.key_index] = copy.copy(keyer)
-        me['keyers'][self.key_index]['luma'] = {
+        new_state, keyer = clone_state_with_path(state, 'mes', self.index, 'keyers', self.key_index)
+        keyer['luma'] = {
             'pre_multiplied': self.pre_multiplied,
             'clip': self.clip,
             'gain': self.gain,
@@ -532,13 +495,8 @@ class KeyChromaProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        keyer = me.setdefault('keyers', {}).get(self.key_index, {})
-
-        me['keyers'][self.key_index] = copy.copy(keyer)
-        me['keyers'][self.key_index]['chroma'] = {
+        new_state, keyer = clone_state_with_path(state, 'mes', self.index, 'keyers', self.key_index)
+        keyer['chroma'] = {
             'hue': self.hue,
             'gain': self.gain,
             'y-suppress': self.y_suppress,
@@ -566,13 +524,8 @@ class KeyPatternProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        keyer = me.setdefault('keyers', {}).get(self.key_index, {})
-
-        me['keyers'][self.key_index] = copy.copy(keyer)
-        me['keyers'][self.key_index]['pattern'] = {
+        new_state, keyer = clone_state_with_path(state, 'mes', self.index, 'keyers', self.key_index)
+        keyer['pattern'] = {
             'pattern': self.pattern,
             'size': self.size,
             'symmetry': self.symmetry,
@@ -598,10 +551,7 @@ class FadeToBlackProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        ftb = me.setdefault('fade_to_black', {})
+        new_state, ftb = clone_state_with_path(state, 'mes', self.index, 'fade_to_black')
         ftb['rate'] = self.rate
 
         return new_state
@@ -617,10 +567,7 @@ class FadeToBlackState(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        ftb = me.setdefault('fade_to_black', {})
+        new_state, ftb = clone_state_with_path(state, 'mes', self.index, 'fade_to_black')
         ftb['state'] = {
             'fully_black': self.fully_black,
             'in_transition': self.in_transition,
@@ -659,10 +606,7 @@ class ColorGeneratorState(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, mes = clone_state_with_key(state, 'mes')
-
-        me = mes.setdefault(self.index, {})
-        cg = me.setdefault('color_generators', {}).setdefault(self.index, {})
+        new_state, cg = clone_state_with_path(state, 'mes', self.index, 'color_generators', self.index)
         cg['state'] = {
             'hue': self.hue,
             'saturation': self.saturation,
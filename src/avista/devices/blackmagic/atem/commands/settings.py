@@ -1,7 +1,7 @@
 from avista.devices.blackmagic.atem.constants import ExternalPortType, InternalPortType, MEAvailability, \
     MultiviewLayout, MultiviewLayoutV8, SourceAvailability, VideoSource, VideoMode
 from construct import Adapter, Bytes, Double, Struct, Enum, Flag, Float32b, Int8ub, Int16ub, PaddedString, Padding, this, Probe
-from .base import BaseCommand, EnumAdapter, EnumFlagAdapter, PaddedCStringAdapter, clone_state_with_key
+from .base import BaseCommand, EnumAdapter, EnumFlagAdapter, PaddedCStringAdapter, clone_state_with_path
 
 
 ExternalPortTypeAdapter = EnumAdapter(ExternalPortType)
@@ -25,9 +25,8 @@ class InputProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, sources = clone_state_with_key(state, 'sources')
+        new_state, source = clone_state_with_path(state, 'sources', self.id)
 
-        source = sources.setdefault(self.id, {})
         source['id'] = self.id
         source['name'] = self.name
         source['short_name'] = self.short_name
@@ -49,8 +48,7 @@ class MultiviewVideoMode(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault('video_modes', {})
+        new_state, mvw_config = clone_state_with_path(state, 'config', 'multiviewers', 'video_modes')
 
         mvw_config[self.core_video_mode] = self.multiview_video_mode
         return new_state
@@ -64,8 +62,7 @@ class MultiviewLayout(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
+        new_state, mvw_config = clone_state_with_path(state, 'config', 'multiviewers', self.index)
         mvw_config['layout'] = self.layout
         return new_state
 
@@ -79,8 +76,7 @@ class MultiviewLayoutV8(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
+        new_state, mvw_config = clone_state_with_path(state, 'config', 'multiviewers', self.index)
         mvw_config['layout'] = self.layout
         return new_state
 
@@ -94,9 +90,7 @@ class MultiviewWindowVUMeter(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
-        window = mvw_config.setdefault('windows', {}).setdefault(self.window_index, {})
+        new_state, window = clone_state_with_path(state, 'config', 'multiviewers', self.index, 'windows', self.window_index)
         window['vu_meter_enabled'] = self.enabled
         return new_state
 
@@ -110,9 +104,7 @@ class MultiviewWindowSafeArea(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
-        window = mvw_config.setdefault('windows', {}).setdefault(self.window_index, {})
+        new_state, window = clone_state_with_path(state, 'config', 'multiviewers', self.index, 'windows', self.window_index)
         window['safe_area_enabled'] = self.enabled
         return new_state
 
@@ -130,9 +122,7 @@ class MultiviewInput(BaseCommand):
         old_value = state.get('config', {}).get('multiviewers', {}).get(self.index, {}).get('windows', {}).get(self.window_index, {}).get('source')
         if self.source == old_value:
             return state
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
-        window = mvw_config.setdefault('windows', {}).setdefault(self.window_index, {})
+        new_state, window = clone_state_with_path(state, 'config', 'multiviewers', self.index, 'windows', self.window_index)
         window['source'] = self.source
         return new_state
 
@@ -145,7 +135,6 @@ class MultiviewOpacity(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, config = clone_state_with_key(state, 'config')
-        mvw_config = config.setdefault('multiviewers', {}).setdefault(self.index, {})
+        new_state, mvw_config = clone_state_with_path(state, 'config', 'multiviewers', self.index)
         mvw_config['opacity'] = self.opacity
         return new_state
@@ -1,7 +1,7 @@
 from avista.devices.blackmagic.atem.constants import BevelType, VideoSource
 from construct import BitStruct, Struct, Default, Int8ub, Int16ub, Int16sb, Padding, Flag, Rebuild
 
-from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_key, recalculate_synthetic_tally, AutoMask
+from .base import BaseCommand, BaseSetCommand, EnumAdapter, clone_state_with_path, AutoMask
 
 
 class SuperSourceProperties(BaseCommand):
@@ -32,8 +32,7 @@ class SuperSourceProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, ssrc = clone_state_with_key(state, 'super_source')
-        my_ssrc = ssrc.setdefault(0, {})
+        new_state, my_ssrc = clone_state_with_path(state, 'super_source', 0)
 
         my_ssrc['fill_source'] = self.fill_source
         my_ssrc['key_source'] = self.key_source
@@ -62,7 +61,7 @@ class SuperSourceProperties(BaseCommand):
             }
         }
 
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SetSuperSourceProperties(BaseSetCommand):
@@ -138,9 +137,7 @@ class SuperSourceV8Properties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, ssrc = clone_state_with_key(state, 'super_source')
-
-        my_ssrc = ssrc.setdefault(self.id, {})
+        new_state, my_ssrc = clone_state_with_path(state, 'super_source', self.id)
 
         my_ssrc['fill_source'] = self.fill_source
         my_ssrc['key_source'] = self.key_source
@@ -150,7 +147,7 @@ class SuperSourceV8Properties(BaseCommand):
         my_ssrc['gain'] = self.gain
         my_ssrc['invert_key'] = self.invert_key
 
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SetSuperSourceV8Properties(BaseSetCommand):
@@ -204,9 +201,7 @@ class SuperSourceV8BorderProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, ssrc = clone_state_with_key(state, 'super_source')
-
-        my_ssrc = ssrc.setdefault(self.id, {})
+        new_state, my_ssrc = clone_state_with_path(state, 'super_source', self.id)
 
         my_ssrc['border'] = {
             'enabled': self.enabled,
@@ -288,8 +283,7 @@ class SuperSourceBoxProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, ssrc = clone_state_with_key(state, 'super_source')
-        boxes = ssrc.setdefault(0, {}).setdefault('boxes', {})
+        new_state, boxes = clone_state_with_path(state, 'super_source', 0, 'boxes')
 
         boxes[self.index] = {
             'enabled': self.enabled,
@@ -308,7 +302,7 @@ class SuperSourceBoxProperties(BaseCommand):
             }
         }
 
-        return recalculate_synthetic_tally(new_state)
+        return new_state
 
 
 class SuperSourceBoxV8Properties(BaseCommand):
@@ -333,8 +327,7 @@ class SuperSourceBoxV8Properties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, ssrc = clone_state_with_key(state, 'super_source')
-        boxes = ssrc.setdefault(self.ssrc_id, {}).setdefault('boxes', {})
+        new_state, boxes = clone_state_with_path(state, 'super_source', self.ssrc_id, 'boxes')
 
         boxes[self.index] = {
             'enabled': self.enabled,
@@ -353,4 +346,4 @@ class SuperSourceBoxV8Properties(BaseCommand):
             }
         }
 
-        return recalculate_synthetic_tally(new_state)
+        return new_state
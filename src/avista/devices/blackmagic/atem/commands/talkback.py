@@ -1,7 +1,7 @@
 from avista.devices.blackmagic.atem.constants import VideoSource
 from construct import Struct, Int8ub, Int16ub, Padding, Flag
 
-from .base import BaseCommand, EnumAdapter, clone_state_with_key
+from .base import BaseCommand, EnumAdapter, clone_state_with_path
 
 
 class TalkbackMixerInputProperties(BaseCommand):
@@ -17,9 +17,7 @@ class TalkbackMixerInputProperties(BaseCommand):
     )
 
     def apply_to_state(self, state):
-        new_state, talkback = clone_state_with_key(state, 'talkback')
-
-        channel = talkback.setdefault(self.channel, {})
+        new_state, channel = clone_state_with_path(state, 'talkback', self.channel)
 
         channel[self.video_source] = {
             'can_mute_sdi': self.can_mute_sdi,
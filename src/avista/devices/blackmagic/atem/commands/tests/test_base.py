@@ -0,0 +1,44 @@
+from avista.devices.blackmagic.atem.commands.base import EnumAdapter, EnumFlagAdapter, FrozenDict
+from avista.devices.blackmagic.atem.constants import MEAvailability, TransitionStyle, VideoSource
+from construct import Int8ub, Int16ub
+
+import pickle
+import pytest
+
+
+def test_enum_adapter():
+    dense = EnumAdapter(TransitionStyle)(Int8ub)
+    sparse = EnumAdapter(VideoSource)(Int16ub)
+
+    assert dense.parse(b'\x01') is TransitionStyle(1)
+    assert sparse.parse(b'\x03\xe8') is VideoSource.COLOUR_BARS
+    assert sparse.parse(b'\x00\x00') is VideoSource.BLACK
+
+    # Zero-valued members are encoded, rather than treated as missing
+    assert sparse.build(VideoSource.BLACK) == b'\x00\x00'
+    assert sparse.build(VideoSource.COLOUR_BARS) == b'\x03\xe8'
+
+    with pytest.raises(ValueError):
+        dense.parse(b'\xff')
+    with pytest.raises(ValueError):
+        sparse.parse(b'\xff\xff')
+
+
+def test_enum_flag_adapter():
+    adapter = EnumFlagAdapter(MEAvailability)(Int8ub)
+
+    values = adapter.parse(b'\x05')
+    assert values == {
+        MEAvailability.ME_1: True,
+        MEAvailability.ME_2: False,
+        MEAvailability.ME_3: True,
+        MEAvailability.ME_4: False
+    }
+    assert adapter.build(values) == b'\x05'
+
+    # Decoded values are shared, so can't be modified
+    assert adapter.parse(b'\x05') is values
+    assert isinstance(values, FrozenDict)
+    with pytest.raises(TypeError):
+        values[MEAvailability.ME_2] = True
+    assert pickle.loads(pickle.dumps(values)) == values
@@ -0,0 +1,90 @@
+from avista.devices.blackmagic.atem.commands import CommandParser, MalformedCommandError, RawCommand, \
+    iter_commands, parse_decode_policy
+from avista.devices.blackmagic.atem.commands.config import ProductName, TopologyV7, TopologyV8, TopologyV811
+from avista.devices.blackmagic.atem.commands.mix_effects import ProgramInput, SetTransitionDipProperties
+from avista.devices.blackmagic.atem.commands.supersource import SetSuperSourceV8BorderProperties
+from avista.devices.blackmagic.atem.constants import VideoSource
+
+import pytest
+
+
+PAYLOAD = b'\x00\x0c\x00\x00_ver\x00\x02\x00\x1e' \
+    b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03'
+
+
+def test_iter_commands():
+    commands = list(iter_commands(PAYLOAD))
+
+    assert [name for name, _ in commands] == [b'_ver', b'PrgI']
+    assert isinstance(commands[1][1], memoryview)
+    assert commands[1][1] == b'\x00\x00\x00\x03'
+
+
+def test_iter_commands_rejects_zero_size():
+    with pytest.raises(MalformedCommandError):
+        list(iter_commands(b'\x00\x00\x00\x00PrgI\x00\x00\x00\x03'))
+
+
+def test_parse_commands():
+    parser = CommandParser()
+    ver, prgi = parser.parse_commands(PAYLOAD)
+
+    assert parser._version == 2.30
+    assert prgi.index == 0
+    assert prgi.source == VideoSource.INPUT_3
+
+
+def test_parse_commands_discards_overrunning_command():
+    parser = CommandParser()
+    commands = parser.parse_commands(PAYLOAD + b'\x00\x40\x00\x00PrvI\x00\x00')
+
+    assert len(commands) == 2
+
+
+def test_dispatch_by_version():
+    parser = CommandParser()
+    assert parser._commands[b'_top'] is TopologyV811
+
+    parser.set_version(2.28)
+    assert parser._commands[b'_top'] is TopologyV8
+
+    parser.set_version(2.1)
+    assert parser._commands[b'_top'] is TopologyV7
+
+
+def test_parse_commands_with_decode_policy():
+    parser = CommandParser(parse_decode_policy('_ver=skip, PrgI=raw'))
+    commands = parser.parse_commands(PAYLOAD)
+
+    assert len(commands) == 1
+    assert isinstance(commands[0], RawCommand)
+    assert commands[0].data == b'\x00\x00\x00\x03'
+    assert parser._version is None
+
+
+def test_command_fields_are_slotted():
+    program = ProgramInput.parse_body(b'\x01\x00\x00\x03')
+    assert ProgramInput._fields == ('index', 'source')
+    assert not hasattr(program, '__dict__')
+    assert program.to_bytes() == b'PrgI\x01\x00\x00\x03'
+
+    # A `name` field can't be slotted without hiding the command name
+    product = ProductName(name='ATEM')
+    assert ProductName.name == b'_pin'
+    assert product.name == 'ATEM'
+
+    # Set commands may leave fields unset
+    assert not hasattr(SetTransitionDipProperties(index=0, rate=25), 'source')
+
+
+def test_decoded_commands_are_built_positionally():
+    program = ProgramInput._from_values(1, VideoSource.INPUT_3)
+    assert (program.index, program.source) == (1, VideoSource.INPUT_3)
+    assert ProgramInput._field_values({'source': 3, 'index': 1, '_io': None}) == (1, 3)
+
+    assert ProductName.parse_body(b'ATEM'.ljust(44, b'\x00')).name == 'ATEM'
+
+    # Fields that aren't identifiers are set all the same
+    fields = SetSuperSourceV8BorderProperties._fields
+    border = SetSuperSourceV8BorderProperties._from_values(*range(len(fields)))
+    assert getattr(border, 'light_source-altitude') == fields.index('light_source-altitude')
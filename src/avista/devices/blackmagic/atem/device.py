@@ -1,70 +1,613 @@
-from avista.devices.net import NetworkDevice
+from avista.core import expose
+from avista.devices.net import NetworkDevice, get_udp_hub
+from collections import OrderedDict
 from twisted.internet import reactor
 from twisted.internet.defer import DeferredLock
 from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 
-from .methods import Audio, Auxes, DSK, Macro, MixEffects
+from .capture import CaptureWriter
+from .commands import RawCommand, SendAudioLevels, SendFairlightLevels, parse_decode_policy
+from .meters import AudioMeters
+from .methods import Audio, Auxes, DSK, Macro, Media, MixEffects
 
 from .protocol import ATEMProtocol
+from .state import StateTree, get_product, load_state_snapshot, make_patch, save_state_snapshot
+from .tally import SyntheticTally, encode_tally_changes
+from .transfer import MediaTransfers
 
 
-class ATEM(NetworkDevice, Audio, Auxes, DSK, Macro, MixEffects):
+# Beyond this many distinct held commands, the oldest are decoded and applied
+MAX_LAZY_COMMANDS = 4096
+
+# In delta mode, how often (in seconds) retained full snapshots are refreshed
+DEFAULT_SNAPSHOT_INTERVAL = 30
+
+# The minimum time (in seconds) over which state changes are coalesced before
+# publishing, and the maximum rate (per second) at which any one top-level key
+# is published
+DEFAULT_COALESCE_WINDOW = 0.005
+DEFAULT_MAX_UPDATE_RATE = 20
+
+# How often (in seconds) the on-disk state cache is refreshed
+DEFAULT_STATE_CACHE_INTERVAL = 60
+# How long (in seconds) to wait for the initial dump to complete before
+# publishing live state regardless
+DEFAULT_STATE_CACHE_TIMEOUT = 10
+
+# The methods that may be combined in execute_batch
+BATCH_OPERATIONS = frozenset(
+    name
+    for mixin in (Audio, Auxes, DSK, Macro, MixEffects)
+    for name, member in vars(mixin).items()
+    if getattr(member, '__exposed__', False)
+)
+
+
+class InvalidBatchOperationError(Exception):
+    pass
+
+
+class ATEM(NetworkDevice, Audio, Auxes, DSK, Macro, Media, MixEffects):
     default_port = 9910
+    versioned_state = True
+
+    def __init__(self, config):
+        self._state_tree = StateTree()
+        self._synthetic_tally = SyntheticTally()
+        self._fast_tally_seq = 0
+        # The tally branch of state as of the last fast tally message
+        self._fast_tally = {}
+        self.decode_policy = parse_decode_policy(config.extra.get('decodePolicy'))
+        self._lazy_commands = OrderedDict()
+        self._lazy_command_keys = {}
+        # The parser of the most recent protocol, which decodes held commands
+        self._command_parser = None
+        # Commands collected by execute_batch, rather than sent
+        self._batch = None
+
+        # If set, every datagram received is recorded to this file, by one
+        # writer that outlives each connection's protocol
+        capture = config.extra.get('capture')
+        self.capture = CaptureWriter(capture) if capture else None
+
+        # Audio meters are published at this many frames per second, if set
+        self._audio_meter_rate = config.extra.get('audioMeters')
+        self._audio_meters = AudioMeters() if self._audio_meter_rate else None
+        self._audio_meter_loop = None
+        self._media_transfers = MediaTransfers(self.send_command, self._send_transfer_progress)
+        self.command_handlers = dict(self._media_transfers.handlers)
+        if self._audio_meters:
+            self.command_handlers.update(self._audio_meters.handlers)
+
+        self.delta_updates = config.extra.get('deltaUpdates', False)
+        self._snapshot_interval = config.extra.get('snapshotInterval', DEFAULT_SNAPSHOT_INTERVAL)
+        # Per top-level key: the state last published, the sequence number of
+        # the last patch, and the sequence number of the last snapshot
+        self._published = {}
+        self._patch_seq = {}
+        self._snapshot_seq = {}
+        self._snapshot_loop = None
+
+        self._coalesce_window = config.extra.get('coalesceWindow', DEFAULT_COALESCE_WINDOW)
+        max_update_rate = config.extra.get('maxUpdateRate', DEFAULT_MAX_UPDATE_RATE)
+        self._min_update_interval = 1.0 / max_update_rate if max_update_rate else 0
+        # Top-level keys awaiting publishing (as an ordered set), when each was
+        # last published, and the scheduled flush
+        self._pending_state_updates = {}
+        self._last_published = {}
+        self._flush_call = None
 
-    def __init__(self, *args, **kwargs):
-        self._state = {}
-        self._prev_state = {}
-        super(ATEM, self).__init__(*args, **kwargs)
+        self._state_cache = config.extra.get('stateCache')
+        self._state_cache_interval = config.extra.get('stateCacheInterval', DEFAULT_STATE_CACHE_INTERVAL)
+        self._state_cache_timeout = config.extra.get('stateCacheTimeout', DEFAULT_STATE_CACHE_TIMEOUT)
+        self._state_cache_loop = None
+        self._state_cache_version = None
+        self._stale_timeout = None
+        # State from the cache, published while awaiting the live state, and
+        # the product it was received from
+        self._stale_state = None
+        self._stale_product = None
+        self._load_state_cache(config.extra.get('host'))
+
+        super(ATEM, self).__init__(config)
         self._lock = DeferredLock()
 
-        self._pending_state_updates = []
+    async def onJoin(self, details):
+        await super(ATEM, self).onJoin(details)
+        if self._stale_state is not None:
+            self._publish_stale_state()
+
+    def onLeave(self, details):
+        self._stop_loops()
+        # Nothing more can be published once the session has left
+        for call in (self._flush_call, self._stale_timeout):
+            if call is not None and call.active():
+                call.cancel()
+        self._flush_call = None
+        self._stale_timeout = None
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+        return super(ATEM, self).onLeave(details)
+
+    def before_power_off(self):
+        if not self.always_powered:
+            self._stop_loops()
+        return super(ATEM, self).before_power_off()
+
+    def _stop_loops(self):
+        '''
+        Stops the periodic tasks that run while connected; each is started
+        again once the next initial dump completes.
+        '''
+        for loop in (self._snapshot_loop, self._state_cache_loop, self._audio_meter_loop):
+            if loop and loop.running:
+                loop.stop()
+        self._snapshot_loop = None
+        self._state_cache_loop = None
+        self._audio_meter_loop = None
+
+    @property
+    def _state(self):
+        return self._state_tree.root
+
+    @property
+    def state_version(self):
+        return self._state_tree.version
+
+    def state_keys_changed_since(self, version):
+        # While stale, clients are given the cached state, which isn't versioned
+        if self._stale_state is not None or version > self._state_tree.version:
+            return None
+        return self._state_tree.changed_keys_since(version)
+
+    def state_paths_changed_since(self, version):
+        if self._stale_state is not None or version > self._state_tree.version:
+            return None
+        return self._state_tree.changed_since(version)
 
     def create_protocol(self):
-        return ATEMProtocol(self)
+        protocol = ATEMProtocol(self)
+        self._command_parser = protocol._command_parser
+        return protocol
 
     def _connect(self):
-        protocol = self.get_protocol()
-        self._connection = reactor.listenUDP(
-            self.port,
-            protocol
-        )
-
-    def create_state_update_loop(self):
-        return LoopingCall(
-            self._lock.run,
-            self._send_updates
-        )
+        self._connection = get_udp_hub().attach(self.get_protocol(), (self.host, self.port))
 
     def send_command(self, command):
+        if self._batch is not None:
+            self._batch.append(command)
+            return None
         return self.get_protocol().send_command(command)
 
+    @expose
+    def execute_batch(self, operations):
+        '''
+        Performs a list of operations together, each a dict of the name of one
+        of this device's switching methods and its keyword arguments, such as
+        `{'operation': 'set_aux_source', 'aux': 0, 'source': 1}`. Every
+        operation is checked before any is sent, and they are packed into as
+        few packets as possible; the result fires once the ATEM has
+        acknowledged them all.
+        '''
+        commands = []
+        self._batch = commands
+        try:
+            for operation in operations:
+                kwargs = dict(operation)
+                name = kwargs.pop('operation', None)
+                if name not in BATCH_OPERATIONS:
+                    raise InvalidBatchOperationError('Unknown operation: {}'.format(name))
+                getattr(self, name)(**kwargs)
+        finally:
+            self._batch = None
+
+        return self.get_protocol().send_commands(commands)
+
     def receive_command(self, command):
         self._lock.run(self._receive_command, command)
 
+    def receive_commands(self, commands):
+        '''
+        Applies a batch of commands (such as those from a single datagram)
+        in one critical section, committing the resulting state and
+        recalculating derived state once for the whole batch.
+        '''
+        self._lock.run(self._receive_commands, commands)
+
     def _receive_command(self, command):
-        try:
-            new_state = command.apply_to_state(self._state)
-            if new_state is None:
+        return self._receive_commands((command,))
+
+    def _receive_commands(self, commands):
+        new_state = self._state
+        evicted = []
+
+        for command in commands:
+            if isinstance(command, RawCommand) and command.lazy:
+                evicted.extend(self._hold_lazy_command(command))
+                continue
+
+            try:
+                applied_state = command.apply_to_state(new_state)
+            except Exception as e:
+                self.log.error('Error when applying command {c}: {e}', c=command, e=e)
+                continue
+
+            if applied_state is None:
                 self.log.warn('apply_to_state returned None for {}'.format(command.name))
+                continue
+            new_state = applied_state
+
+        changed_keys = self._commit_state(new_state)
 
-            self._prev_state = self._state
-            self._state = new_state
+        # Held commands pushed out by this batch are applied once it has been
+        # committed, as otherwise its state would replace theirs
+        for raw in evicted:
+            self._decode_lazy_command(raw)
 
-            for nsk in new_state.keys():
-                if nsk not in self._prev_state or new_state[nsk] is not self._prev_state[nsk]:
-                    if nsk not in self._pending_state_updates:
-                        self._pending_state_updates.append(nsk)
+        return changed_keys
 
+    def _commit_state(self, new_state):
+        '''
+        Commits the state resulting from a batch of commands, along with the
+        synthetic tally, and queues publishing of the top-level keys that
+        changed, which are returned.
+        '''
+        paths = self._state_tree.update(new_state)
+        if not paths:
+            return []
+
+        # The sources whose synthetic tally changed, if known
+        tally_sources = None
+        try:
+            tally_state, tally_sources = self._synthetic_tally.update(new_state, paths)
+            if tally_state is not new_state:
+                paths = paths + self._state_tree.update(tally_state)
         except Exception as e:
-            self.log.error('Error when applying command {c}: {e}', c=command, e=e)
+            self.log.error('Error when calculating synthetic tally: {e}', e=e)
+
+        # Top-level keys in the order they were first changed, so that updates
+        # are published in a predictable order
+        changed_keys = list(dict.fromkeys(path[0] for path in paths))
+
+        if self._stale_state is not None and 'config' in changed_keys and not self._is_stale_product():
+            self.log.warn(
+                'State cache {path} is of a different switcher ({product}); discarding it',
+                path=self._state_cache,
+                product=self._stale_product
+            )
+            self._reconcile_stale_state(discard=True)
+
+        if 'tally' in changed_keys:
+            self._send_fast_tally(tally_sources)
+
+        for nsk in changed_keys:
+            self._pending_state_updates[nsk] = None
+        self._schedule_flush()
+
+        if 'state' in changed_keys and self._state.get('state', {}).get('initialized'):
+            self._initial_dump_complete()
+        elif self._stale_state is not None and self._stale_timeout is None:
+            self._stale_timeout = reactor.callLater(self._state_cache_timeout, self._reconcile_stale_state)
+
+        return changed_keys
+
+    def _hold_lazy_command(self, command):
+        '''
+        Holds a lazy command, returning those (the oldest) that no longer fit
+        and so must be decoded and applied.
+        '''
+        key = (command.name, command.data)
+        self._lazy_commands.pop(key, None)
+        self._lazy_commands[key] = command
+
+        evicted = []
+        while len(self._lazy_commands) > MAX_LAZY_COMMANDS:
+            evicted.append(self._lazy_commands.popitem(last=False)[1])
+        return evicted
+
+    def _decode_lazy_command(self, raw):
+        command = self._command_parser.parse_command(raw.name, raw.data) if self._command_parser else None
+        if command:
+            self._lazy_command_keys.setdefault(raw.name, set()).update(
+                self._receive_command(command)
+            )
+
+    def _decode_lazy_commands(self, key=None):
+        '''
+        Decodes and applies held lazy commands: all of them, or only those
+        known (from previous decoding) to feed the top-level state `key`.
+        This happens in the same critical section as received batches, so
+        runs straight away unless one is being applied, in which case it's
+        queued behind it.
+        '''
+        if self._lazy_commands:
+            self._lock.run(self._decode_held_commands, key)
+
+    def _decode_held_commands(self, key):
+        for held_key, raw in list(self._lazy_commands.items()):
+            known_keys = self._lazy_command_keys.get(raw.name)
+            if key is None or not known_keys or key in known_keys:
+                del self._lazy_commands[held_key]
+                self._decode_lazy_command(raw)
+
+    def _load_state_cache(self, host):
+        if self._state_cache:
+            try:
+                snapshot = load_state_snapshot(self._state_cache, host)
+            except Exception as e:
+                # Any cache that can't be used means a cold start
+                self.log.warn('Unable to load state cache from {path}: {e}', path=self._state_cache, e=e)
+                return
+            if snapshot:
+                self._stale_state = snapshot['state']
+                self._stale_product = snapshot['product']
+
+    def _is_stale_product(self):
+        '''
+        Whether the cached state is of the same model and version of switcher
+        as the live state, as far as the live state is known.
+        '''
+        live = get_product(self._state)
+        return all(
+            value is None or value == self._stale_product.get(key)
+            for key, value in live.items()
+        )
+
+    def _write_state_cache(self):
+        if self._state_cache_version == self._state_tree.version:
+            return
+        self._state_cache_version = self._state_tree.version
+
+        def failed(failure):
+            self.log.warn('Unable to write state cache to {path}: {e}', path=self._state_cache, e=failure.value)
+
+        return deferToThread(save_state_snapshot, self._state_cache, self._state, self.host).addErrback(failed)
+
+    def _initial_dump_complete(self):
+        if self._stale_state is not None:
+            self._reconcile_stale_state()
+
+        if self._audio_meters:
+            self._enable_audio_meters()
+
+        if self._state_cache:
+            self._write_state_cache()
+            if self._state_cache_loop is None:
+                self._state_cache_loop = LoopingCall(self._write_state_cache)
+                self._state_cache_loop.start(self._state_cache_interval, now=False)
+
+    def _enable_audio_meters(self):
+        '''
+        Asks the switcher to send audio levels (whichever of the classic and
+        Fairlight mixers it has will respond), and starts publishing them.
+        '''
+        def failed(failure):
+            self.log.warn('Unable to enable audio levels: {e}', e=failure.value)
+
+        for command in (SendAudioLevels(enabled=True), SendFairlightLevels(enabled=True)):
+            self.send_command(command).addErrback(failed)
+
+        if self._audio_meter_loop is None:
+            self._audio_meter_loop = LoopingCall(self._send_audio_meters)
+            self._audio_meter_loop.start(1.0 / self._audio_meter_rate, now=False)
+
+    def get_media_transfers(self):
+        return self._media_transfers
+
+    def _send_transfer_progress(self, stats):
+        self.broadcast_device_message(
+            'transfer',
+            stats,
+            subtopic='media/transfer'
+        )
+
+    def _send_audio_meters(self):
+        # Errors mustn't escape, as that would stop the LoopingCall for good
+        try:
+            frame, errors = self._audio_meters.get_frame()
+            for name, error in errors:
+                self.log.warn('Discarding malformed {name} levels: {e}', name=name, e=error)
+            if frame:
+                self.broadcast_device_message('audio_meters', subtopic='audio/meters', data=frame)
+        except Exception as e:
+            self.log.error('Error when sending audio meters: {e}', e=e)
+
+    def _publish_stale_state(self):
+        self.broadcast_device_message('stale', subtopic='stale', data=True, retain=True)
+        for nsk, data in self._stale_state.items():
+            if self.delta_updates:
+                self._published[nsk] = data
+                self._send_snapshot(nsk)
+            else:
+                self.broadcast_device_message(nsk, subtopic=nsk, data=data, retain=True)
+
+    def _reconcile_stale_state(self, discard=False):
+        '''
+        Replaces the cached state with the live state. Only those top-level
+        keys that differ from what was published from the cache are queued
+        for publishing, unless the cache is being discarded (as being of a
+        different switcher), in which case every key is.
+        '''
+        if self._stale_timeout is not None and self._stale_timeout.active():
+            self._stale_timeout.cancel()
+        self._stale_timeout = None
+
+        stale_state = self._stale_state
+        self._stale_state = None
+        self._stale_product = None
+
+        self._pending_state_updates = {
+            nsk: None for nsk in list(self._state.keys()) + list(stale_state.keys())
+            if discard or stale_state.get(nsk) != self._state.get(nsk)
+        }
+        self.broadcast_device_message('stale', subtopic='stale', data=False, retain=True)
+        if 'tally' in self._state:
+            self._send_fast_tally()
+        self._schedule_flush()
+
+    @expose
+    def _get_state(self, subtopic=None):
+        self._decode_lazy_commands(subtopic)
+        state = self._state if self._stale_state is None else self._stale_state
+        if subtopic:
+            return state.get(subtopic)
+        return state
+
+    def _get_state_root(self, key):
+        # Only those lazy commands feeding `key` need decoding
+        self._decode_lazy_commands(key)
+        return self._state if self._stale_state is None else self._stale_state
+
+    @expose
+    def _get_connection_stats(self):
+        '''
+        Returns counters for the outbound command pipeline: commands and
+        packets sent, acknowledged, retransmitted and lost, and the smoothed
+        acknowledgement latency in seconds.
+        '''
+        return self.get_protocol().get_stats()
+
+    @expose
+    def _get_snapshot(self, subtopic):
+        '''
+        In delta mode, returns the state of `subtopic` as last published along
+        with the sequence number of the patch that produced it, for clients
+        that have missed a patch.
+        '''
+        return {
+            'seq': self._patch_seq.get(subtopic, 0),
+            'data': self._published.get(subtopic, self._state.get(subtopic))
+        }
+
+    def _schedule_flush(self, delay=None):
+        '''
+        Arranges for pending updates to be published, after the coalescing
+        window (or `delay`) unless a flush is already due.
+        '''
+        if self._pending_state_updates and self._stale_state is None and self._flush_call is None:
+            self._flush_call = reactor.callLater(
+                self._coalesce_window if delay is None else delay,
+                self._flush_updates
+            )
+
+    def _flush_updates(self):
+        self._flush_call = None
+        self._lock.run(self._send_updates)
 
     def _send_updates(self):
-        self.log.debug('Sending updates: {updates}', updates=self._pending_state_updates)
+        if self._stale_state is not None:
+            # Hold updates until the live state can be reconciled with the cache
+            return
+
+        # Keys published too recently are held back until they're next due
+        now = reactor.seconds()
+        due = []
+        next_due = None
         for nsk in self._pending_state_updates:
-            self.broadcast_device_message(
-                nsk,
-                subtopic=nsk,
-                data=self._state.get(nsk),
-                retain=True
-            )
-        self._pending_state_updates.clear()
+            due_at = self._last_published.get(nsk, now) + self._min_update_interval
+            if nsk not in self._last_published or due_at <= now:
+                due.append(nsk)
+            elif next_due is None or due_at < next_due:
+                next_due = due_at
+
+        self.log.debug('Sending updates: {updates}', updates=due)
+
+        for nsk in due:
+            del self._pending_state_updates[nsk]
+            self._last_published[nsk] = now
+
+        if self.delta_updates:
+            self._send_patches(due)
+        else:
+            for nsk in due:
+                self.broadcast_device_message(
+                    nsk,
+                    subtopic=nsk,
+                    data=self._state.get(nsk),
+                    retain=True
+                )
+
+        if next_due is not None:
+            self._schedule_flush(next_due - now)
+
+    def _send_fast_tally(self, sources=None):
+        '''
+        Publishes the tally entries that have changed since the last message
+        on `tally/fast` straight away, bypassing coalescing and rate limiting,
+        in a compact form (see encode_tally_changes). Messages are numbered,
+        so that a client that misses one knows to fetch the whole of `tally`.
+        `sources`, if given, are the only sources whose per-M/E tally has
+        changed since the last message.
+        '''
+        if self._stale_state is not None:
+            return
+
+        tally = self._state.get('tally', {})
+        data = encode_tally_changes(self._fast_tally, tally, sources)
+        self._fast_tally = tally
+        if not (data['by_me'] or data['by_source'] or data['by_index']):
+            return
+
+        self._fast_tally_seq += 1
+        self.broadcast_device_message(
+            'tally',
+            subtopic='tally/fast',
+            data=data,
+            seq=self._fast_tally_seq
+        )
+
+    def _send_patches(self, keys):
+        for nsk in keys:
+            new = self._state.get(nsk)
+
+            if nsk not in self._published:
+                # Nothing to patch against yet; start with a snapshot
+                self._published[nsk] = new
+                self._send_snapshot(nsk)
+                continue
+
+            old = self._published[nsk]
+            self._published[nsk] = new
+            if new is None:
+                # The root can't be removed by a patch, so publish the removal
+                # as a snapshot instead
+                if old is not None:
+                    self._send_snapshot(nsk)
+                continue
+
+            if isinstance(old, dict) and isinstance(new, dict):
+                patch = make_patch(old, new)
+            else:
+                patch = [{'op': 'replace', 'path': '', 'value': new}]
+
+            if patch:
+                seq = self._patch_seq.get(nsk, 0) + 1
+                self._patch_seq[nsk] = seq
+                self.broadcast_device_message(
+                    nsk,
+                    subtopic='{}/patch'.format(nsk),
+                    data=patch,
+                    seq=seq
+                )
+
+        if self._snapshot_loop is None:
+            self._snapshot_loop = LoopingCall(self._lock.run, self._refresh_snapshots)
+            self._snapshot_loop.start(self._snapshot_interval, now=False)
+
+    def _refresh_snapshots(self):
+        for nsk in self._published.keys():
+            if self._snapshot_seq.get(nsk) != self._patch_seq.get(nsk, 0):
+                self._send_snapshot(nsk)
+
+    def _send_snapshot(self, nsk):
+        seq = self._patch_seq.get(nsk, 0)
+        self._snapshot_seq[nsk] = seq
+        self.broadcast_device_message(
+            nsk,
+            subtopic=nsk,
+            data=self._published[nsk],
+            seq=seq,
+            retain=True
+        )
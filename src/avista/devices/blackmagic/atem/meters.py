@@ -0,0 +1,155 @@
+from functools import lru_cache
+
+import struct
+
+
+# AMLv: input count and padding, then master and monitor levels (left, right,
+# peak left, peak right, as unsigned 32-bit values), input source IDs padded
+# to a multiple of four bytes, and four levels for each input in turn
+MIXER_LEVELS_HEADER = struct.Struct('!H2x')
+MIXER_LEVELS_OFFSET = MIXER_LEVELS_HEADER.size + 8 * 4
+LEVELS_PER_MIXER_SOURCE = 4
+
+# FMLv: input index, padding and (signed 64-bit) source, then levels as signed
+# 16-bit values: input left/right/peaks, expander, compressor and limiter gain
+# reduction, output left/right/peaks, and left/right/peaks
+FAIRLIGHT_SOURCE_HEADER = struct.Struct('!H6xq')
+LEVELS_PER_FAIRLIGHT_SOURCE = 15
+
+# FDLv: as for sources, but without the expander and with no header
+LEVELS_PER_FAIRLIGHT_MASTER = 14
+
+
+@lru_cache(maxsize=None)
+def _values_struct(typecode, count):
+    return struct.Struct('!{}{}'.format(count, typecode))
+
+
+def _unpack_values(typecode, count, data, offset=0):
+    '''
+    Unpacks `count` big-endian values of a struct `typecode` (so of a fixed
+    width, unlike those of array) from `data`, raising struct.error if it's
+    too short.
+    '''
+    return list(_values_struct(typecode, count).unpack_from(data, offset))
+
+
+def decode_mixer_levels(body):
+    '''
+    Decodes an AMLv body into a dict of lists of integers: `master` and
+    `monitor` (four levels each), `sources` (the input IDs) and `levels`
+    (four per input, in the same order).
+    '''
+    count, = MIXER_LEVELS_HEADER.unpack_from(body)
+    master_and_monitor = _unpack_values('I', 8, body, MIXER_LEVELS_HEADER.size)
+
+    levels_offset = MIXER_LEVELS_OFFSET + 2 * count
+    levels_offset += -levels_offset % 4
+
+    return {
+        'master': master_and_monitor[:4],
+        'monitor': master_and_monitor[4:],
+        'sources': _unpack_values('H', count, body, MIXER_LEVELS_OFFSET),
+        'levels': _unpack_values('I', LEVELS_PER_MIXER_SOURCE * count, body, levels_offset)
+    }
+
+
+def decode_fairlight_source_levels(body):
+    '''
+    Decodes an FMLv body into its input index, source and list of levels.
+    '''
+    index, source = FAIRLIGHT_SOURCE_HEADER.unpack_from(body)
+    return index, source, _unpack_values('h', LEVELS_PER_FAIRLIGHT_SOURCE, body, FAIRLIGHT_SOURCE_HEADER.size)
+
+
+def decode_fairlight_master_levels(body):
+    '''
+    Decodes an FDLv body into a list of levels.
+    '''
+    return _unpack_values('h', LEVELS_PER_FAIRLIGHT_MASTER, body)
+
+
+class AudioMeters(object):
+    '''
+    Holds the most recent audio level commands, undecoded, so that they can be
+    received far more often than they're published. A frame is only produced
+    (and the levels decoded) if something has changed since the last one.
+    Malformed commands are left out of frames; get_frame reports them.
+    '''
+    def __init__(self):
+        self._mixer = None
+        self._fairlight_master = None
+        self._fairlight_sources = {}
+        self._changed = False
+
+    @property
+    def handlers(self):
+        return {
+            b'AMLv': self.receive_mixer_levels,
+            b'FMLv': self.receive_fairlight_source_levels,
+            b'FDLv': self.receive_fairlight_master_levels
+        }
+
+    def receive_mixer_levels(self, body):
+        if body != self._mixer:
+            self._mixer = bytes(body)
+            self._changed = True
+
+    def receive_fairlight_source_levels(self, body):
+        key = bytes(body[:FAIRLIGHT_SOURCE_HEADER.size])
+        if body != self._fairlight_sources.get(key):
+            self._fairlight_sources[key] = bytes(body)
+            self._changed = True
+
+    def receive_fairlight_master_levels(self, body):
+        if body != self._fairlight_master:
+            self._fairlight_master = bytes(body)
+            self._changed = True
+
+    def get_frame(self):
+        '''
+        Returns the levels received since the last frame, or None if nothing
+        has changed, along with a list of errors decoding any commands (which
+        are then discarded, rather than failing every later frame). Fairlight
+        source levels are given as `sources`, a list of (index, source) pairs,
+        and `levels`, with fifteen values per source.
+        '''
+        if not self._changed:
+            return None, []
+        self._changed = False
+
+        frame = {}
+        errors = []
+
+        if self._mixer is not None:
+            try:
+                frame['mixer'] = decode_mixer_levels(self._mixer)
+            except struct.error as e:
+                errors.append(('AMLv', e))
+                self._mixer = None
+
+        if self._fairlight_master is not None or self._fairlight_sources:
+            sources = []
+            levels = []
+            for key, body in list(self._fairlight_sources.items()):
+                try:
+                    index, source, source_levels = decode_fairlight_source_levels(body)
+                except struct.error as e:
+                    errors.append(('FMLv', e))
+                    del self._fairlight_sources[key]
+                    continue
+                sources.append((index, source))
+                levels.extend(source_levels)
+
+            fairlight = frame['fairlight'] = {
+                'sources': sources,
+                'levels': levels
+            }
+            if self._fairlight_master is not None:
+                try:
+                    fairlight['master'] = decode_fairlight_master_levels(self._fairlight_master)
+                except struct.error as e:
+                    errors.append(('FDLv', e))
+                    self._fairlight_master = None
+
+        return frame, errors
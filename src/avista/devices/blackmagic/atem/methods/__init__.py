@@ -2,6 +2,7 @@ from .audio import Audio
 from .auxes import Auxes
 from .dsk import DSK
 from .macro import Macro
+from .media import Media
 from .mix_effects import MixEffects
 
 __all__ = [
@@ -9,5 +10,6 @@ __all__ = [
     'Auxes',
     'DSK',
     'Macro',
+    'Media',
     'MixEffects'
 ]
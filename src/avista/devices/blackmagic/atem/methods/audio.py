@@ -7,12 +7,12 @@ from avista.devices.blackmagic.atem.commands.audio import ResetMasterAudioMeterP
 class Audio(object):
     @expose
     def reset_master_audio_meter_peaks(self):
-        self.get_protocol().send_command(
+        return self.send_command(
             ResetMasterAudioMeterPeaks()
         )
 
     @expose
     def reset_input_audio_meter_peaks(self, source):
-        self.get_protocol().send_command(
+        return self.send_command(
             ResetMasterAudioMeterPeaks(source=source)
         )
@@ -9,7 +9,7 @@ from avista.devices.blackmagic.atem.constants import VideoSource
 class Auxes(object):
     @expose
     def set_aux_source(self, aux, source):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetAuxSource(
                 index=aux,
                 source=VideoSource(source)
@@ -7,7 +7,7 @@ from avista.devices.blackmagic.atem.commands.dsk import \
 class DSK(object):
     @expose
     def set_dsk_on_air(self, index, on_air):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetDownstreamKeyerOnAir(
                 index=index,
                 on_air=on_air
@@ -16,7 +16,7 @@ class DSK(object):
 
     @expose
     def set_dsk_tie(self, index, tie):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetDownstreamKeyerTie(
                 index=index,
                 tie=tie
@@ -25,7 +25,7 @@ class DSK(object):
 
     @expose
     def dsk_perform_auto(self, index):
-        self.get_protocol().send_command(
+        return self.send_command(
             DownstreamKeyerPerformAuto(
                 index=index
             )
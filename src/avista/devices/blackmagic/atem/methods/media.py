@@ -0,0 +1,34 @@
+from avista.core import expose
+
+from avista.devices.blackmagic.atem.transfer import STILLS_STORE
+
+
+class Media(object):
+    @expose
+    def upload_still(self, index, data, name, description='', rgba=False):
+        '''
+        Uploads a still to the media pool: `data` is a frame in the ATEM's
+        YCbCr format or, with `rgba` set, 8-bit RGBA pixels. Returns the
+        transfer's stats once the ATEM has stored it.
+        '''
+        return self.get_media_transfers().upload(STILLS_STORE, index, data, name, description, rgba=rgba)
+
+    @expose
+    def download_still(self, index):
+        '''
+        Downloads a still from the media pool, as a frame in the ATEM's YCbCr
+        format.
+        '''
+        return self.get_media_transfers().download(STILLS_STORE, index)
+
+    @expose
+    def upload_clip_frame(self, clip, frame, data, name, description=''):
+        return self.get_media_transfers().upload(clip + 1, frame, data, name, description)
+
+    @expose
+    def _get_media_transfers(self):
+        '''
+        Returns the stats of transfers in progress: bytes transferred so far,
+        the total if known, elapsed time and rate in bytes per second.
+        '''
+        return self.get_media_transfers().get_stats()
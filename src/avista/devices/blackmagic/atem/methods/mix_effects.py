@@ -13,26 +13,26 @@ class MixEffects(object):
     @expose
     def set_preview_input(self, input, me=0):
         cmd = SetPreviewInput(source=VideoSource(input), index=me)
-        self.get_protocol().send_command(cmd)
+        return self.send_command(cmd)
 
     @expose
     def set_program_input(self, input, me=0):
         cmd = SetProgramInput(source=VideoSource(input), index=me)
-        self.get_protocol().send_command(cmd)
+        return self.send_command(cmd)
 
     @expose
     def perform_cut(self, me=0):
         cmd = PerformCut(index=me)
-        self.get_protocol().send_command(cmd)
+        return self.send_command(cmd)
 
     @expose
     def perform_auto(self, me=0):
         cmd = PerformAuto(index=me)
-        self.get_protocol().send_command(cmd)
+        return self.send_command(cmd)
 
     @expose
     def set_transition_position(self, position, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetTransitionPosition(
                 position=position,
                 index=me
@@ -60,7 +60,7 @@ class MixEffects(object):
         if style is not None:
             args['style'] = TransitionStyle(style)
 
-        self.get_protocol().send_command(
+        return self.send_command(
             SetTransitionProperties(
                 **args
             )
@@ -68,7 +68,7 @@ class MixEffects(object):
 
     @expose
     def set_transition_mix_properties(self, rate, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetTransitionMixProperties(
                 rate=rate,
                 index=me
@@ -77,7 +77,7 @@ class MixEffects(object):
 
     @expose
     def set_transition_dip_properties(self, rate=None, source=None, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetTransitionDipProperties(
                 rate=rate,
                 source=source,
@@ -87,7 +87,7 @@ class MixEffects(object):
 
     @expose
     def set_keyer_on_air(self, keyer, on_air=True, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetKeyerOnAir(
                 key_index=keyer,
                 enabled=on_air,
@@ -97,12 +97,12 @@ class MixEffects(object):
 
     @expose
     def set_fade_to_black_rate(self, rate, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             SetFadeToBlackRate(rate=rate, index=me)
         )
 
     @expose
     def toggle_fade_to_black(self, me=0):
-        self.get_protocol().send_command(
+        return self.send_command(
             ToggleFadeToBlack(index=me)
         )
@@ -4,29 +4,91 @@ import struct
 
 
 SIZE_OF_HEADER = 12
+MAX_PACKET_SIZE = 0x07FF
+
+# Flags (5 bits) and size (11 bits), session UID, ACK ID, 4 unknown bytes, package ID
+HEADER = struct.Struct('!HHH4xH')
+# Hello packets omit the unknown bytes
+HELLO_HEADER = struct.Struct('!HHHH')
+# Payload size and two padding bytes, prefixed to any payload we send
+PAYLOAD_HEADER = struct.Struct('!H2x')
+# The package ID the ATEM would like resent, in place of the unknown bytes
+RESEND_ID = struct.Struct('!H')
+RESEND_ID_OFFSET = 6
+
+MAX_PAYLOAD_SIZE = MAX_PACKET_SIZE - SIZE_OF_HEADER
+
+# Package IDs are 15 bits, and wrap around
+PACKAGE_ID_MASK = 0x7FFF
+# How many package IDs before the most recent are tracked to spot duplicates
+RECEIVE_WINDOW = 64
 
 
 class PacketType(object):
     NULL_COMMAND = 0x00
     ACK_REQUEST = 0x01
     HELLO_PACKET = 0x02
+    # Set on packets that are retransmissions of ones already sent
     RESEND = 0x04
-    UNDEFINED = 0x08
+    # A request to resend the package ID given in place of the unknown bytes
+    RESEND_REQUEST = 0x08
     ACK = 0x10
 
 
+class ReceiveWindow(object):
+    '''
+    Tracks the package IDs received from a peer, to spot duplicates: the most
+    recent ID, and a bitmask of those received before it (bit n being set if
+    ID - n has been received), compared modulo 2^15 so that the window
+    survives wraparound.
+    '''
+    def __init__(self):
+        self._highest = None
+        self._mask = 0
+
+    def reset(self):
+        self._highest = None
+
+    def is_duplicate(self, package_id):
+        '''
+        Records receipt of `package_id`, returning whether it has been received
+        before. IDs that fall behind the window are assumed to be duplicates,
+        as they'll have been retransmitted until acknowledged.
+        '''
+        if self._highest is None:
+            self._highest = package_id
+            self._mask = 1
+            return False
+
+        ahead = (package_id - self._highest) & PACKAGE_ID_MASK
+        if 0 < ahead <= PACKAGE_ID_MASK // 2:
+            self._mask = ((self._mask << ahead) | 1) & ((1 << RECEIVE_WINDOW) - 1)
+            self._highest = package_id
+            return False
+
+        behind = (self._highest - package_id) & PACKAGE_ID_MASK
+        if behind >= RECEIVE_WINDOW:
+            return True
+
+        bit = 1 << behind
+        if self._mask & bit:
+            return True
+        self._mask |= bit
+        return False
+
+
 class Packet(recordclass('Packet', ['bitmask', 'size', 'uid', 'ack_id', 'package_id', 'payload'])):
     @staticmethod
     def parse(datagram):
         if len(datagram) >= SIZE_OF_HEADER:
-            bitmask = struct.unpack('B', datagram[0:1])[0] >> 3
+            flags_and_size, uid, ack_id, package_id = HEADER.unpack_from(datagram)
             return Packet(
-                bitmask,
-                struct.unpack('!H', datagram[0:2])[0] & 0x07FF,
-                struct.unpack('!H', datagram[2:4])[0],
-                struct.unpack('!H', datagram[4:6])[0],
-                struct.unpack('!H', datagram[10:12])[0],
-                datagram[12:]
+                flags_and_size >> 11,
+                flags_and_size & MAX_PACKET_SIZE,
+                uid,
+                ack_id,
+                package_id,
+                memoryview(datagram)[SIZE_OF_HEADER:]
             )
 
     @staticmethod
@@ -40,23 +102,86 @@ class Packet(recordclass('Packet', ['bitmask', 'size', 'uid', 'ack_id', 'package
             payload
         )
 
+    @staticmethod
+    def create_commands(uid, commands, package_id=0):
+        '''
+        Creates an ACK-requesting packet carrying several commands (as built by
+        their `to_bytes`), each of which is framed with its own size header.
+        '''
+        return Packet(
+            PacketType.ACK_REQUEST,
+            commands_size(commands) + SIZE_OF_HEADER,
+            uid,
+            0,
+            package_id,
+            list(commands)
+        )
+
+    def pack_into(self, buffer, offset=0):
+        '''
+        Writes this packet into `buffer` (a pre-allocated, writable buffer such
+        as a bytearray) at `offset`, returning the number of bytes written.
+        '''
+        if isinstance(self.payload, list):
+            payload_size = commands_size(self.payload)
+        else:
+            payload_size = len(self.payload)
+            if self.bitmask & PacketType.ACK_REQUEST:
+                payload_size += 4
+
+        flags_and_size = (self.bitmask << 11) | (payload_size + SIZE_OF_HEADER)
+
+        if self.bitmask & PacketType.HELLO_PACKET:
+            HELLO_HEADER.pack_into(buffer, offset, flags_and_size, self.uid, self.ack_id, self.package_id)
+            end = offset + HELLO_HEADER.size
+        else:
+            HEADER.pack_into(buffer, offset, flags_and_size, self.uid, self.ack_id, self.package_id)
+            end = offset + HEADER.size
+
+        if isinstance(self.payload, list):
+            for command in self.payload:
+                PAYLOAD_HEADER.pack_into(buffer, end, len(command) + PAYLOAD_HEADER.size)
+                end += PAYLOAD_HEADER.size
+                buffer[end:end + len(command)] = command
+                end += len(command)
+        elif self.payload:
+            PAYLOAD_HEADER.pack_into(buffer, end, payload_size)
+            end += PAYLOAD_HEADER.size
+            buffer[end:end + len(self.payload)] = self.payload
+            end += len(self.payload)
+
+        return end - offset
+
     def to_bytes(self):
-        buffer = b''
-        payload_size = len(self.payload)
-
-        if self.bitmask & PacketType.ACK_REQUEST:
-            payload_size += 4
-
-        val = self.bitmask << 11
-        val |= (payload_size + SIZE_OF_HEADER)
-        buffer += struct.pack('!H', val)
-        buffer += struct.pack('!H', self.uid)
-        buffer += struct.pack('!H', self.ack_id)
-        if not (self.bitmask & PacketType.HELLO_PACKET):
-            buffer += struct.pack('!I', 0)
-        buffer += struct.pack('!H', self.package_id)
-        if self.payload:
-            buffer += struct.pack('!H', payload_size)
-            buffer += b'\x00\x00'
-            buffer += self.payload
-        return buffer
+        buffer = bytearray(self.size + PAYLOAD_HEADER.size)
+        length = self.pack_into(buffer)
+        return bytes(buffer[:length])
+
+
+def commands_size(commands):
+    '''
+    The size of the given commands once framed within a packet payload.
+    '''
+    return sum(len(command) for command in commands) + PAYLOAD_HEADER.size * len(commands)
+
+
+def split_commands(commands, max_size=MAX_PAYLOAD_SIZE):
+    '''
+    Splits a list of commands into lists that will each fit, framed, within a
+    packet payload of `max_size`. A command too large to fit is given a list
+    of its own.
+    '''
+    batch = []
+    size = 0
+
+    for command in commands:
+        framed_size = len(command) + PAYLOAD_HEADER.size
+        if batch and size + framed_size > max_size:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(command)
+        size += framed_size
+
+    if batch:
+        yield batch
@@ -1,25 +1,56 @@
+from avista.devices.net import NotConnectedException
+from collections import OrderedDict, deque
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList
 from twisted.internet.protocol import DatagramProtocol
 from twisted.internet.task import LoopingCall
 
 from .commands import CommandParser
-from .packet import Packet, PacketType, SIZE_OF_HEADER
+from .packet import Packet, PacketType, ReceiveWindow, MAX_PACKET_SIZE, MAX_PAYLOAD_SIZE, PACKAGE_ID_MASK, \
+    PAYLOAD_HEADER, RESEND_ID, RESEND_ID_OFFSET, SIZE_OF_HEADER
 
 import struct
 import time
 
 
+# Defaults for the outbound pipeline, overridable in the device extras
+DEFAULT_SEND_WINDOW = 16
+DEFAULT_RETRANSMIT_TIMEOUT = 0.2
+DEFAULT_MAX_RETRANSMITS = 10
+
+
 class CommandVersionMismatchError(Exception):
     pass
 
 
+class CommandNotAcknowledgedError(Exception):
+    pass
+
+
+class CommandTooLargeError(Exception):
+    pass
+
+
+class OutboundPacket(object):
+    '''
+    A sent packet awaiting acknowledgement, and the Deferreds of the commands
+    it carries.
+    '''
+    def __init__(self, packet, deferreds):
+        self.packet = packet
+        self.deferreds = deferreds
+        self.first_sent = None
+        self.last_sent = None
+        self.attempts = 0
+
+
 class ATEMProtocol(DatagramProtocol):
     def __init__(self, device):
         super().__init__()
 
         self.device = device
         self.log = device.log
-        self._command_parser = CommandParser()
+        self._command_parser = CommandParser(device.decode_policy, device.command_handlers)
 
         self._packet_counter = 0
         self._current_uuid = 0x1337
@@ -31,7 +62,38 @@ class ATEMProtocol(DatagramProtocol):
 
         self._is_terminating = False
 
-        self._update_send_loop = None
+        self._send_buffer = bytearray(MAX_PACKET_SIZE + SIZE_OF_HEADER)
+        self._send_view = memoryview(self._send_buffer)
+
+        extra = device.config.extra
+        self._send_window = extra.get('sendWindow', DEFAULT_SEND_WINDOW)
+        self._retransmit_timeout = extra.get('retransmitTimeout', DEFAULT_RETRANSMIT_TIMEOUT)
+        self._max_retransmits = extra.get('maxRetransmits', DEFAULT_MAX_RETRANSMITS)
+
+        # Commands (as bytes, with their Deferreds) awaiting a packet
+        self._send_queue = deque()
+        self._flush_call = None
+        # Sent packets awaiting acknowledgement, keyed by package ID
+        self._unacked = OrderedDict()
+        self._retransmit_checker = LoopingCall(self._check_retransmits)
+
+        # The package IDs received, to spot duplicates
+        self._receive_window = ReceiveWindow()
+
+        # If set, every datagram received is recorded by this CaptureWriter
+        self._capture = device.capture
+
+        self.stats = {
+            'commands_sent': 0,
+            'packets_sent': 0,
+            'packets_acked': 0,
+            'retransmits': 0,
+            'resend_requests': 0,
+            'packets_lost': 0,
+            'latency': None,
+            'packets_received': 0,
+            'duplicates_received': 0
+        }
 
     def startProtocol(self):
         if self.transport and not self._is_initialised:
@@ -60,16 +122,18 @@ class ATEMProtocol(DatagramProtocol):
                     self.startProtocol
                 )
 
-            if self._update_send_loop is None:
-                self._update_send_loop = self.device.create_state_update_loop()
-                self._update_send_loop.start(0.25)
+            if not self._retransmit_checker.running:
+                self._retransmit_checker.start(self._retransmit_timeout / 2, now=False)
 
     def stopProtocol(self):
         self._is_terminating = True
-        if self._timeout_checker:
+        if self._timeout_checker.running:
             self._timeout_checker.stop()
-        if self._update_send_loop:
-            self._update_send_loop.stop()
+        if self._retransmit_checker.running:
+            self._retransmit_checker.stop()
+        self._abandon_outbound('Protocol stopped')
+        if self._capture:
+            self._capture.flush()
 
     def _check_timeout(self):
         if not self._is_terminating:
@@ -86,17 +150,30 @@ class ATEMProtocol(DatagramProtocol):
                 self._current_uuid = 0x1337
                 self._is_initialised = False
                 self._last_received = None
+                self._receive_window.reset()
+                self._abandon_outbound('Connection timed out')
                 self.startProtocol()
 
     def datagramReceived(self, datagram, _):
+        if self._capture:
+            self._capture.write(datagram)
+
         packet = Packet.parse(datagram)
         if packet:
             self._current_uid = packet.uid
             self.log.debug('Received packet {packet}', packet=packet)
             self._last_received = time.time()
 
+            if packet.bitmask & PacketType.ACK:
+                self._packet_acked(packet.ack_id)
+
+            if packet.bitmask & PacketType.RESEND_REQUEST:
+                self._resend_requested(RESEND_ID.unpack_from(datagram, RESEND_ID_OFFSET)[0])
+
             if packet.bitmask & PacketType.HELLO_PACKET:
                 self._is_initialised = False
+                self._receive_window.reset()
+                self._abandon_outbound('Connection reset')
 
                 ack = Packet.create(
                     PacketType.ACK,
@@ -115,22 +192,65 @@ class ATEMProtocol(DatagramProtocol):
                     packet.package_id
                 )
                 self.send_packet(ack)
+
+                self.stats['packets_received'] += 1
+                if self._receive_window.is_duplicate(packet.package_id):
+                    # Our ACK was lost; the payload has already been applied
+                    self.stats['duplicates_received'] += 1
+                    return
+
             if packet.payload:
                 commands = self._command_parser.parse_commands(packet.payload)
                 if commands:
-                    for command in commands:
-                        self.device.receive_command(command)
+                    self.device.receive_commands(commands)
 
     def send_packet(self, packet):
         if not (packet.bitmask & (PacketType.HELLO_PACKET | PacketType.ACK)):
-            self._packet_counter += 1
-            if self._packet_counter >= 32768:
-                self._packet_counter = 0
-            packet.package_id = self._packet_counter
-        self.log.debug('Sending packet {packet} => {b}', packet=packet, b=packet.to_bytes())
-        self.transport.write(packet.to_bytes(), (self.device.host, self.device.port))
+            packet.package_id = self._next_package_id()
+        self._write_packet(packet)
+
+    def _next_package_id(self):
+        self._packet_counter += 1
+        if self._packet_counter >= 32768:
+            self._packet_counter = 0
+        return self._packet_counter
+
+    def _write_packet(self, packet):
+        self.log.debug('Sending packet {packet}', packet=packet)
+        length = packet.pack_into(self._send_buffer)
+        self.transport.write(self._send_view[:length], (self.device.host, self.device.port))
 
     def send_command(self, command):
+        '''
+        Queues a command for sending, returning a Deferred that fires once the
+        ATEM has acknowledged the packet carrying it. Commands queued within
+        the same reactor iteration are packed into as few packets as possible.
+        '''
+        self._check_command(command)
+        return self._queue_command(self._encode_command(command))
+
+    def send_commands(self, commands):
+        '''
+        Queues several commands together, having checked and built all of them
+        (so that none is sent if any can't be), returning a Deferred that fires once the ATEM has acknowledged
+        every one of them.
+        '''
+        encoded = []
+        for command in commands:
+            self._check_command(command)
+            encoded.append(self._encode_command(command))
+
+        # Nothing is queued until every command has been built
+        return DeferredList(
+            [self._queue_command(data) for data in encoded],
+            fireOnOneErrback=True,
+            consumeErrors=True
+        ).addCallbacks(
+            lambda _: None,
+            lambda failure: failure.value.subFailure
+        )
+
+    def _check_command(self, command):
         if self._command_parser._version:
             if hasattr(command, 'maximum_version'):
                 if command.maximum_version < self._command_parser._version:
@@ -140,10 +260,154 @@ class ATEMProtocol(DatagramProtocol):
                 if command.minimum_version > self._command_parser._version:
                     raise CommandVersionMismatchError()
 
-        packet = Packet.create(
-            PacketType.ACK_REQUEST,
-            self._current_uid,
-            0,
-            payload=command.to_bytes()
-        )
-        self.send_packet(packet)
+        if not self._is_initialised:
+            raise NotConnectedException()
+
+    def _encode_command(self, command):
+        '''
+        Builds a command's bytes, checking that it fits in a packet.
+        '''
+        data = command.to_bytes()
+        if len(data) + PAYLOAD_HEADER.size > MAX_PAYLOAD_SIZE:
+            raise CommandTooLargeError(
+                '{} is {} bytes, more than fits in a packet'.format(command.__class__.__name__, len(data))
+            )
+        return data
+
+    def _queue_command(self, data):
+        d = Deferred()
+        self._send_queue.append((data, d))
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self._flush_send_queue)
+        return d
+
+    def _flush_send_queue(self):
+        self._flush_call = None
+
+        while self._send_queue and len(self._unacked) < self._send_window:
+            commands = []
+            deferreds = []
+            size = 0
+
+            while self._send_queue:
+                data, d = self._send_queue[0]
+                framed_size = len(data) + PAYLOAD_HEADER.size
+                if commands and size + framed_size > MAX_PAYLOAD_SIZE:
+                    break
+                self._send_queue.popleft()
+                commands.append(data)
+                deferreds.append(d)
+                size += framed_size
+
+            packet = Packet.create_commands(self._current_uid, commands, self._next_package_id())
+
+            # Track the packet before sending it, in case the ACK comes straight back
+            outbound = OutboundPacket(packet, deferreds)
+            outbound.first_sent = outbound.last_sent = time.time()
+            outbound.attempts = 1
+            self._unacked[packet.package_id] = outbound
+
+            self.stats['commands_sent'] += len(commands)
+            self.stats['packets_sent'] += 1
+            self._write_packet(packet)
+
+    def _packet_acked(self, package_id):
+        '''
+        Acknowledges `package_id` and every unacknowledged packet before it
+        (modulo wraparound), as the ATEM's ACKs are cumulative.
+        '''
+        acked = [
+            unacked_id for unacked_id in self._unacked
+            if (package_id - unacked_id) & PACKAGE_ID_MASK <= PACKAGE_ID_MASK // 2
+        ]
+        for unacked_id in acked:
+            outbound = self._unacked.pop(unacked_id)
+            self.stats['packets_acked'] += 1
+            if outbound.attempts == 1:
+                # Only unambiguous round trips contribute to the latency estimate
+                latency = time.time() - outbound.first_sent
+                previous = self.stats['latency']
+                self.stats['latency'] = latency if previous is None else previous * 0.875 + latency * 0.125
+
+            for d in outbound.deferreds:
+                d.callback(None)
+
+        if acked and self._send_queue and self._flush_call is None:
+            self._flush_send_queue()
+
+    def _resend_requested(self, package_id):
+        '''
+        Resends every unacknowledged packet from `package_id` onwards, which
+        the ATEM is missing.
+        '''
+        self.stats['resend_requests'] += 1
+        due = []
+        for unacked_id, outbound in self._unacked.items():
+            if (unacked_id - package_id) & PACKAGE_ID_MASK <= PACKAGE_ID_MASK // 2:
+                self._count_retransmit(outbound)
+                due.append(outbound.packet)
+        self._write_packets(due)
+
+    def _write_packets(self, packets):
+        if packets:
+            address = (self.device.host, self.device.port)
+            self.transport.write_batch((packet.to_bytes(), address) for packet in packets)
+
+    def _count_retransmit(self, outbound):
+        outbound.attempts += 1
+        outbound.last_sent = time.time()
+        self.stats['retransmits'] += 1
+
+    def _check_retransmits(self):
+        deadline = time.time() - self._retransmit_timeout
+        due = []
+
+        for package_id, outbound in list(self._unacked.items()):
+            if outbound.last_sent > deadline:
+                continue
+
+            if outbound.attempts > self._max_retransmits:
+                del self._unacked[package_id]
+                self.stats['packets_lost'] += 1
+                self.log.warn(
+                    'Packet {package_id} was not acknowledged after {attempts} attempts',
+                    package_id=package_id,
+                    attempts=outbound.attempts
+                )
+                for d in outbound.deferreds:
+                    d.errback(CommandNotAcknowledgedError())
+            else:
+                self._count_retransmit(outbound)
+                due.append(outbound.packet)
+
+        self._write_packets(due)
+
+        # Lost packets free up the send window for queued commands
+        if self._send_queue and self._flush_call is None:
+            self._flush_send_queue()
+
+    def _abandon_outbound(self, reason):
+        '''
+        Fails all queued and unacknowledged commands, which belong to a session
+        that no longer exists.
+        '''
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+
+        deferreds = [d for _, d in self._send_queue]
+        for outbound in self._unacked.values():
+            deferreds.extend(outbound.deferreds)
+            self.stats['packets_lost'] += 1
+
+        self._send_queue.clear()
+        self._unacked.clear()
+
+        for d in deferreds:
+            d.errback(CommandNotAcknowledgedError(reason))
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self._unacked)
+        stats['queued'] = len(self._send_queue)
+        return stats
@@ -0,0 +1,155 @@
+'''
+Replays a capture of the datagrams received from an ATEM (recorded by setting
+`capture` in the device extras) through ATEMProtocol, without a network
+connection or router, for profiling and debugging:
+
+    python -m avista.devices.blackmagic.atem.replay [--realtime] [--profile] capture.bin
+'''
+from argparse import ArgumentParser
+from autobahn.wamp.types import ComponentConfig
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.task import cooperate, react
+
+from .capture import read_capture
+from .device import ATEM
+
+import cProfile
+import json
+import pstats
+import sys
+import time
+
+
+class NullTransport(object):
+    '''
+    Discards everything written to it (such as ACKs for replayed packets).
+    '''
+    def write(self, data, address=None):
+        pass
+
+    def write_batch(self, datagrams):
+        pass
+
+
+def create_replay_device(**extra):
+    extra.setdefault('name', 'ATEM')
+    extra.setdefault('host', '127.0.0.1')
+    device = ATEM(ComponentConfig(realm='avista', extra=extra))
+    device.get_protocol().transport = NullTransport()
+    return device
+
+
+def replay(path, device, realtime=False):
+    '''
+    Feeds the datagrams in the capture at `path` to the device's protocol,
+    either with their recorded timing or as fast as possible (yielding to the
+    reactor between datagrams, so that scheduled publishing still happens).
+    Returns a Deferred firing with the number of datagrams replayed.
+    '''
+    protocol = device.get_protocol()
+    records = read_capture(path)
+    replayed = [0]
+
+    def receive(datagram):
+        protocol.datagramReceived(datagram, (device.host, device.port))
+        replayed[0] += 1
+
+    if realtime:
+        finished = Deferred()
+        start = [None]
+
+        def next_record():
+            for timestamp, datagram in records:
+                if start[0] is None:
+                    start[0] = (time.time(), timestamp)
+                delay = start[0][0] + (timestamp - start[0][1]) - time.time()
+                if delay > 0:
+                    reactor.callLater(delay, deliver, datagram)
+                    return
+                receive(datagram)
+            finished.callback(replayed[0])
+
+        def deliver(datagram):
+            receive(datagram)
+            next_record()
+
+        next_record()
+        return finished
+
+    def fast():
+        for _, datagram in records:
+            receive(datagram)
+            yield
+
+    return cooperate(fast()).whenDone().addCallback(lambda _: replayed[0])
+
+
+def _parse_args(args):
+    parser = ArgumentParser(description='Replay a capture of ATEM datagrams through ATEMProtocol')
+
+    parser.add_argument(
+        '-o', '--option',
+        action='append',
+        help='Additional device options, specified as `option=value` pairs'
+    )
+
+    parser.add_argument(
+        '--realtime',
+        default=False,
+        action='store_true',
+        help='Replay with the timing recorded in the capture, rather than as fast as possible'
+    )
+
+    parser.add_argument(
+        '--profile',
+        default=False,
+        action='store_true',
+        help='Profile the replay and print the most expensive functions'
+    )
+
+    parser.add_argument('capture')
+
+    return parser.parse_args(args)
+
+
+def parse_options(options):
+    '''
+    Parses `option=value` pairs into device extras. Values are JSON literals
+    (such as `maxUpdateRate=0` or `deltaUpdates=true`), or otherwise strings.
+    '''
+    extra = {}
+    for optval in options:
+        option, value = optval.split('=', 1)
+        try:
+            extra[option] = json.loads(value)
+        except ValueError:
+            extra[option] = value
+    return extra
+
+
+def main(_reactor, *argv):
+    args = _parse_args(argv)
+
+    device = create_replay_device(**parse_options(args.option or []))
+    profile = cProfile.Profile() if args.profile else None
+    started = time.time()
+
+    if profile:
+        profile.enable()
+
+    def done(count):
+        elapsed = time.time() - started
+        if profile:
+            profile.disable()
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(30)
+
+        device.get_protocol().stopProtocol()
+        print('Replayed {} datagrams in {:.3f}s ({:.0f}/s)'.format(count, elapsed, count / elapsed if elapsed else 0))
+        print('Protocol stats: {}'.format(device.get_protocol().get_stats()))
+
+    return replay(args.capture, device, args.realtime).addCallback(done)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
@@ -0,0 +1,322 @@
+'''
+A minimal ATEM switcher simulator, for testing and benchmarking without real
+hardware. It performs the UDP handshake, sends an initial dump (synthetic, or
+taken from a capture recorded with the `capture` device option) ending in
+InCm, and responds to program/preview changes, cuts and autos with the
+resulting PrgI, PrvI and TlIn. Any number of clients may connect at once;
+state changes are sent to all of them. Media pool uploads and downloads are
+also supported, with files held in memory.
+
+    python -m avista.devices.blackmagic.atem.simulator [--port 9910] [--mes 2] [--inputs 20] [--dump capture.bin]
+'''
+from argparse import ArgumentParser
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import LoopingCall
+
+from .capture import read_capture
+from .commands import CommandParser, DataTransferAck, DataTransferComplete, DataTransferData, \
+    DataTransferDownloadRequest, DataTransferError, DataTransferFileDescription, DataTransferUploadContinue, \
+    DataTransferUploadRequest, InitComplete, MediaPoolLock, MediaPoolLockObtained, MediaPoolLockState, PerformAuto, \
+    PerformCut, PreviewInput, ProductName, ProgramInput, SetPreviewInput, SetProgramInput, TallyByIndex, Version, \
+    iter_commands
+from .constants import VideoSource
+from .packet import PAYLOAD_HEADER, Packet, PacketType, ReceiveWindow, split_commands
+
+import struct
+import sys
+import time
+
+
+# InPr: ID, name, short name, names default, available external ports,
+# external port type, internal port type, source and M/E availability
+INPUT_PROPERTIES = struct.Struct('!H20s4s?xHHBBBx')
+HELLO_RESPONSE = b'\x02\x00\x00\x00\x00\x00\x00\x00'
+
+# The size of, and number of, upload chunks granted by each FTCD
+TRANSFER_CHUNK_SIZE = 1396
+TRANSFER_CHUNK_COUNT = 20
+TRANSFER_ERROR_NOT_FOUND = 2
+
+
+def _command(name, body):
+    # Pad command bodies to a multiple of four bytes, as the ATEM does
+    return name + body + b'\x00' * (-len(body) % 4)
+
+
+def read_dump(path):
+    '''
+    Reads the commands of an initial dump from a capture file, up to and
+    including InCm.
+    '''
+    commands = []
+    for _, datagram in read_capture(path):
+        packet = Packet.parse(datagram)
+        if packet and packet.bitmask & PacketType.ACK_REQUEST and packet.payload:
+            for name, body in iter_commands(packet.payload):
+                commands.append(name + bytes(body))
+                if name == InitComplete.name:
+                    return commands
+
+    commands.append(InitComplete(complete=True).to_bytes())
+    return commands
+
+
+class SimulatorSession(object):
+    def __init__(self, address, uid):
+        self.address = address
+        self.uid = uid
+        self.package_id = 0
+        self.connected = False
+        self.last_received = time.time()
+        # The client's package IDs received, so that its retransmissions
+        # aren't applied again
+        self.received = ReceiveWindow()
+
+    def next_package_id(self):
+        self.package_id = (self.package_id + 1) & 0x7FFF
+        return self.package_id
+
+
+class ATEMSimulator(DatagramProtocol):
+    def __init__(self, mes=2, inputs=20, dump=None, ping_interval=0.5, session_timeout=10):
+        self._inputs = inputs
+        self._dump = dump
+        self._ping_interval = ping_interval
+        self._session_timeout = session_timeout
+        self._parser = CommandParser()
+        self._next_uid = 0
+
+        # Program and preview source for each M/E
+        self.mes = {idx: [VideoSource.INPUT_1, VideoSource.INPUT_2] for idx in range(mes)}
+        if dump:
+            for command in self._parser.parse_commands(self._frame(dump)):
+                if isinstance(command, ProgramInput):
+                    self.mes.setdefault(command.index, [None, None])[0] = command.source
+                elif isinstance(command, PreviewInput):
+                    self.mes.setdefault(command.index, [None, None])[1] = command.source
+
+        self.sessions = {}
+        self._ping_loop = LoopingCall(self._ping)
+
+        # Media pool files by (store, slot), and uploads in progress by ID
+        self.media = {}
+        self._uploads = {}
+
+    def startProtocol(self):
+        self._ping_loop.start(self._ping_interval, now=False)
+
+    def stopProtocol(self):
+        if self._ping_loop.running:
+            self._ping_loop.stop()
+
+    @staticmethod
+    def _frame(commands):
+        return b''.join(
+            PAYLOAD_HEADER.pack(len(command) + PAYLOAD_HEADER.size) + command for command in commands
+        )
+
+    def initial_dump(self):
+        '''
+        The commands sent to a newly-connected client, finishing with the
+        current state of each M/E, tally and InCm.
+        '''
+        if self._dump:
+            # The captured dump, less InCm
+            commands = self._dump[:-1]
+        else:
+            commands = [
+                Version(major=2, minor=30).to_bytes(),
+                ProductName(name=b'ATEM Simulator'.ljust(44, b'\x00')).to_bytes()
+            ]
+            commands.extend(self._input_properties())
+
+        for idx, (program, preview) in self.mes.items():
+            commands.append(ProgramInput(index=idx, source=program).to_bytes())
+            commands.append(PreviewInput(index=idx, source=preview).to_bytes())
+        commands.append(self._tally())
+        commands.append(InitComplete(complete=True).to_bytes())
+        return commands
+
+    def _input_properties(self):
+        for input_id in range(1, self._inputs + 1):
+            yield _command(b'InPr', INPUT_PROPERTIES.pack(
+                input_id,
+                'Camera {}'.format(input_id).encode('utf-8'),
+                'CM{}'.format(input_id).encode('utf-8')[:4],
+                True,
+                1,
+                1,
+                0,
+                3,
+                (1 << len(self.mes)) - 1
+            ))
+
+    def _tally(self):
+        programs = set(me[0] for me in self.mes.values())
+        previews = set(me[1] for me in self.mes.values())
+        return _command(TallyByIndex.name, TallyByIndex.format.build({
+            'source_count': self._inputs,
+            'sources': [
+                {'program': source in programs, 'preview': source in previews}
+                for source in range(1, self._inputs + 1)
+            ]
+        }))
+
+    def datagramReceived(self, datagram, address):
+        packet = Packet.parse(datagram)
+        if not packet:
+            return
+
+        if packet.bitmask & PacketType.HELLO_PACKET:
+            self._next_uid = (self._next_uid + 1) & 0x7FFF
+            self.sessions[address] = SimulatorSession(address, self._next_uid | 0x8000)
+            self._write(Packet.create(PacketType.HELLO_PACKET, packet.uid, 0, 0, HELLO_RESPONSE), address)
+            return
+
+        session = self.sessions.get(address)
+        if not session:
+            return
+        session.last_received = time.time()
+
+        if packet.bitmask & PacketType.ACK and not session.connected:
+            session.connected = True
+            self._send(session, self.initial_dump())
+
+        if packet.bitmask & PacketType.ACK_REQUEST:
+            self._write(Packet.create(PacketType.ACK, session.uid, packet.package_id), address)
+            if packet.payload and not session.received.is_duplicate(packet.package_id):
+                for command in self._parser.parse_commands(packet.payload):
+                    self._handle_command(command, session)
+
+    def _handle_command(self, command, session):
+        if isinstance(command, (MediaPoolLock, DataTransferUploadRequest, DataTransferFileDescription,
+                                DataTransferData, DataTransferDownloadRequest, DataTransferAck)):
+            self._handle_transfer_command(command, session)
+            return
+
+        if not isinstance(command, (SetProgramInput, SetPreviewInput, PerformCut, PerformAuto)):
+            return
+        if command.index not in self.mes:
+            return
+        me = self.mes[command.index]
+
+        if isinstance(command, SetProgramInput):
+            me[0] = command.source
+            changes = [ProgramInput(index=command.index, source=me[0]).to_bytes()]
+        elif isinstance(command, SetPreviewInput):
+            me[1] = command.source
+            changes = [PreviewInput(index=command.index, source=me[1]).to_bytes()]
+        elif isinstance(command, (PerformCut, PerformAuto)):
+            me.reverse()
+            changes = [
+                ProgramInput(index=command.index, source=me[0]).to_bytes(),
+                PreviewInput(index=command.index, source=me[1]).to_bytes()
+            ]
+
+        changes.append(self._tally())
+        for session in self.sessions.values():
+            if session.connected:
+                self._send(session, changes)
+
+    def _handle_transfer_command(self, command, session):
+        if isinstance(command, MediaPoolLock):
+            responses = [MediaPoolLockState(index=command.index, lock=int(command.lock)).to_bytes()]
+            if command.lock:
+                responses.insert(0, MediaPoolLockObtained(index=command.index).to_bytes())
+            self._send(session, responses)
+
+        elif isinstance(command, DataTransferUploadRequest):
+            self._uploads[command.transfer_id] = {
+                'store': command.store,
+                'slot': command.slot,
+                'size': command.size,
+                'filename': None,
+                'data': bytearray(),
+                'chunks': 0
+            }
+            self._send(session, [self._upload_continue(command.transfer_id)])
+
+        elif isinstance(command, DataTransferFileDescription):
+            if command.transfer_id in self._uploads:
+                self._uploads[command.transfer_id]['filename'] = command.filename
+
+        elif isinstance(command, DataTransferData):
+            upload = self._uploads.get(command.transfer_id)
+            if upload is None:
+                return
+            upload['data'] += command.data
+            upload['chunks'] += 1
+
+            if len(upload['data']) >= upload['size']:
+                del self._uploads[command.transfer_id]
+                self.media[(upload['store'], upload['slot'])] = (bytes(upload['data']), upload['filename'])
+                self._send(session, [DataTransferComplete(transfer_id=command.transfer_id).to_bytes()])
+            elif upload['chunks'] % TRANSFER_CHUNK_COUNT == 0:
+                self._send(session, [self._upload_continue(command.transfer_id)])
+
+        elif isinstance(command, DataTransferDownloadRequest):
+            media = self.media.get((command.store, command.slot))
+            if media is None:
+                self._send(session, [
+                    DataTransferError(transfer_id=command.transfer_id, error_code=TRANSFER_ERROR_NOT_FOUND).to_bytes()
+                ])
+                return
+
+            data = media[0]
+            chunk_size = TRANSFER_CHUNK_SIZE - 4
+            self._send(session, [
+                DataTransferData(transfer_id=command.transfer_id, data=data[offset:offset + chunk_size]).to_bytes()
+                for offset in range(0, len(data), chunk_size)
+            ] + [DataTransferComplete(transfer_id=command.transfer_id).to_bytes()])
+
+    @staticmethod
+    def _upload_continue(transfer_id):
+        return DataTransferUploadContinue(
+            transfer_id=transfer_id,
+            chunk_size=TRANSFER_CHUNK_SIZE,
+            chunk_count=TRANSFER_CHUNK_COUNT
+        ).to_bytes()
+
+    def _send(self, session, commands):
+        for batch in split_commands(commands):
+            self._write(Packet.create_commands(session.uid, batch, session.next_package_id()), session.address)
+
+    def _ping(self):
+        expired = time.time() - self._session_timeout
+        for address, session in list(self.sessions.items()):
+            if session.last_received < expired:
+                del self.sessions[address]
+            elif session.connected:
+                self._write(Packet.create_commands(session.uid, [], session.next_package_id()), address)
+
+    def _write(self, packet, address):
+        self.transport.write(packet.to_bytes(), address)
+
+
+def _parse_args(args):
+    parser = ArgumentParser(description='Simulate an ATEM switcher')
+
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=9910, help='Port to listen on')
+    parser.add_argument('--mes', type=int, default=2, help='Number of M/Es')
+    parser.add_argument('--inputs', type=int, default=20, help='Number of inputs')
+    parser.add_argument('--dump', default=None, help='Capture file from which to take the initial dump')
+
+    return parser.parse_args(args)
+
+
+def main(argv):
+    args = _parse_args(argv)
+    simulator = ATEMSimulator(
+        mes=args.mes,
+        inputs=args.inputs,
+        dump=read_dump(args.dump) if args.dump else None
+    )
+    reactor.listenUDP(args.port, simulator, interface=args.host)
+    print('ATEM simulator listening on {}:{}'.format(args.host, args.port))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,194 @@
+from collections import deque
+
+import msgpack
+import os
+
+
+_MISSING = object()
+
+# Increased whenever the layout of state snapshots changes, so that older
+# snapshots are discarded rather than misread
+STATE_SNAPSHOT_FORMAT = 1
+
+
+def changed_paths(old, new, depth, prefix=()):
+    '''
+    Lists the paths (as tuples of keys, at most `depth` long) at which `new`
+    differs from `old`. Relies on unchanged nodes being shared between the
+    two, as they are when state is updated by path-copying, so only nodes
+    that have been replaced are descended into.
+    '''
+    paths = []
+
+    for key, value in new.items():
+        old_value = old.get(key, _MISSING)
+        if value is old_value:
+            continue
+
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            if depth > 1:
+                paths.extend(changed_paths(old_value, value, depth - 1, prefix + (key,)))
+                continue
+        elif value == old_value:
+            continue
+
+        paths.append(prefix + (key,))
+
+    for key in old.keys():
+        if key not in new:
+            paths.append(prefix + (key,))
+
+    return paths
+
+
+class StateTree(object):
+    '''
+    Persistent device state. Each update supplies a new root that shares its
+    unchanged nodes with the previous one (see clone_state_with_path); the
+    paths that changed are journaled against an increasing version number so
+    that they can be queried cheaply afterwards.
+    '''
+    def __init__(self, root=None, depth=2, history=4096):
+        self.root = root if root is not None else {}
+        self.version = 0
+
+        self._depth = depth
+        self._journal = deque(maxlen=history)
+        # Versions before this may have been partially dropped from the journal
+        self._horizon = 0
+
+    def update(self, new_root):
+        '''
+        Replaces the root, returning the list of paths that changed.
+        '''
+        if new_root is self.root:
+            return []
+
+        paths = changed_paths(self.root, new_root, self._depth)
+        self.root = new_root
+
+        if paths:
+            self.version += 1
+            for path in paths:
+                if len(self._journal) == self._journal.maxlen:
+                    self._horizon = self._journal[0][0]
+                self._journal.append((self.version, path))
+
+        return paths
+
+    def changed_since(self, version):
+        '''
+        Returns the set of paths changed after `version`, or None if the
+        journal no longer reaches back that far.
+        '''
+        if version < self._horizon:
+            return None
+
+        changes = set()
+        for entry_version, path in reversed(self._journal):
+            if entry_version <= version:
+                break
+            changes.add(path)
+
+        return changes
+
+    def changed_keys_since(self, version):
+        '''
+        As changed_since, but for top-level keys only.
+        '''
+        changes = self.changed_since(version)
+        if changes is None:
+            return None
+        return set(path[0] for path in changes)
+
+
+def _pointer_token(key):
+    if isinstance(key, int):
+        return str(int(key))
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def make_patch(old, new, pointer=''):
+    '''
+    Builds an RFC 6902 JSON patch (a list of operations) that transforms
+    `old` into `new`. As with changed_paths, nodes shared between the two are
+    skipped without comparison. Lists are treated as values and replaced
+    whole.
+    '''
+    patch = []
+
+    for key, value in new.items():
+        old_value = old.get(key, _MISSING)
+        if value is old_value:
+            continue
+
+        path = pointer + '/' + _pointer_token(key)
+
+        if old_value is _MISSING:
+            patch.append({'op': 'add', 'path': path, 'value': value})
+        elif isinstance(value, dict) and isinstance(old_value, dict):
+            patch.extend(make_patch(old_value, value, path))
+        elif value != old_value:
+            patch.append({'op': 'replace', 'path': path, 'value': value})
+
+    for key in old.keys():
+        if key not in new:
+            patch.append({'op': 'remove', 'path': pointer + '/' + _pointer_token(key)})
+
+    return patch
+
+
+def get_product(state):
+    '''
+    Identifies the switcher model and firmware protocol version that `state`
+    was received from, as far as is known.
+    '''
+    config = state.get('config', {})
+    return {
+        'name': config.get('name'),
+        'version': config.get('version')
+    }
+
+
+class InvalidStateSnapshotError(Exception):
+    pass
+
+
+def save_state_snapshot(path, state, host=None):
+    '''
+    Writes `state`, as received from the switcher at `host`, to `path`,
+    atomically replacing any previous snapshot. Safe to call from a thread,
+    since state trees are never modified in place.
+    '''
+    snapshot = {
+        'format': STATE_SNAPSHOT_FORMAT,
+        'host': host,
+        'product': get_product(state),
+        'state': state
+    }
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'wb') as f:
+        msgpack.pack(snapshot, f, use_bin_type=True)
+    os.replace(temp_path, path)
+
+
+def load_state_snapshot(path, host=None):
+    '''
+    Reads a snapshot written by save_state_snapshot, returning None if there
+    isn't one. Raises InvalidStateSnapshotError if it's in a different
+    format or from a switcher other than the one at `host`. Returns a dict of
+    the `state` and the `product` it came from (see get_product).
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        snapshot = msgpack.unpack(f, raw=False, strict_map_key=False)
+
+    if not isinstance(snapshot, dict) or snapshot.get('format') != STATE_SNAPSHOT_FORMAT:
+        raise InvalidStateSnapshotError('Unrecognised state snapshot format')
+    if snapshot.get('host') != host:
+        raise InvalidStateSnapshotError('State snapshot is of the switcher at {}'.format(snapshot.get('host')))
+    if not isinstance(snapshot.get('state'), dict):
+        raise InvalidStateSnapshotError('State snapshot contains no state')
+
+    return snapshot
@@ -0,0 +1,285 @@
+from avista.devices.blackmagic.atem.constants import VideoSource
+
+
+SUPER_SOURCES = [VideoSource.SUPER_SOURCE_1, VideoSource.SUPER_SOURCE_2]
+
+# DSKs always appear on M/E 1 (index 0)
+DSK_ME = 0
+
+
+def _get_all_supersource_sources(ssrc):
+    sources = []
+
+    if ssrc.get('fill_source'):
+        sources.append(ssrc['fill_source'])
+    if ssrc.get('key_source') and ssrc.get('foreground'):
+        sources.append(ssrc['key_source'])
+
+    for box in ssrc.get('boxes', {}).values():
+        if box.get('enabled'):
+            sources.append(box['source'])
+
+    return sources
+
+
+def _me_live_sources(state, idx, me):
+    '''
+    The sources live on a single M/E: a dict of source to program/preview
+    flags, for only those sources that are on program or preview. Also
+    returns whether this depends on the state of SuperSource.
+    '''
+    this_me = {}
+    uses_super_source = False
+
+    def add(source, kind):
+        nonlocal uses_super_source
+        this_me.setdefault(source, {})[kind] = True
+        if source in SUPER_SOURCES:
+            uses_super_source = True
+            ssrc = state.get('super_source', {}).get(SUPER_SOURCES.index(source), {})
+            for sssrc in _get_all_supersource_sources(ssrc):
+                this_me.setdefault(sssrc, {})[kind] = True
+
+    def add_keyer(keyer):
+        if keyer.get('fill_source'):
+            add(keyer['fill_source'], 'program')
+        if keyer.get('key_source'):
+            add(keyer['key_source'], 'program')
+
+    if me.get('preview') is not None:
+        add(me['preview'], 'preview')
+
+    if me.get('program') is not None:
+        add(me['program'], 'program')
+
+    # Also consider any active upstream keyers:
+    for keyer in me.get('keyers', {}).values():
+        if keyer.get('on_air'):
+            add_keyer(keyer)
+
+    # If we're transitioning, we need to consider both program and preview live
+    transition = me.get('transition', {})
+    if transition.get('next') and transition.get('position', {}).get('in_transition'):
+        tie = transition['next']
+
+        if tie.get('background') and me.get('preview') is not None:
+            add(me['preview'], 'program')
+
+        for index, keyer in enumerate(me.get('keyers', {}).values()):
+            if tie.get('key_{}'.format(index + 1)):
+                add_keyer(keyer)
+
+    if idx == DSK_ME:
+        for dsk in state.get('dsks', {}).values():
+            dsk_state = dsk.get('state', {})
+            if dsk_state.get('on_air') or dsk_state.get('is_transitioning'):
+                add_keyer(dsk)
+
+    for this_source in this_me.values():
+        this_source.setdefault('preview', False)
+        this_source.setdefault('program', False)
+
+    return this_me, uses_super_source
+
+
+def calculate_me_tally(state, idx, me):
+    '''
+    Calculates the synthetic tally of a single M/E. Returns the tally (a dict
+    of source to program/preview flags, for every source) and whether it
+    depends on the state of SuperSource.
+    '''
+    live, uses_super_source = _me_live_sources(state, idx, me)
+
+    this_me = {source: {'preview': False, 'program': False} for source in state.get('sources', {})}
+    this_me.update(live)
+
+    return this_me, uses_super_source
+
+
+class SyntheticTally(object):
+    '''
+    Maintains `tally.by_me`, the per-M/E tally calculated from M/E, keyer,
+    DSK and SuperSource state, incrementally.
+
+    Two indexes drive this. From the changed state paths, the M/Es that could
+    be affected are found: an M/E for changes to itself (including its
+    keyers), M/E 1 for changes to DSKs, and only those M/Es currently
+    showing SuperSource for changes to SuperSource boxes. Then, for each of
+    those M/Es, the sources now live on it are compared with those that were
+    (a handful, rather than every input), and only the entries of sources
+    whose tally differs are replaced. Every M/E is built in full on the
+    first update, and again when sources are added or removed; changes to
+    existing sources (such as their names) don't affect tally.
+    '''
+    def __init__(self):
+        # M/Es whose tally currently depends on SuperSource
+        self._super_source_dependents = set()
+        # Per M/E, the sources last found live on it (see _me_live_sources)
+        self._live = {}
+
+    def update(self, state, paths=None):
+        '''
+        Recalculates the tally affected by the changes at `paths` (or all of
+        it, if None). Returns the new state, and the set of sources whose
+        tally has changed on any M/E.
+        '''
+        mes = state.get('mes', {})
+        by_me = state.get('tally', {}).get('by_me', {})
+        dirty = set()
+        # M/Es to build in full, rather than by changing individual sources
+        rebuild = set(idx for idx in mes if idx not in by_me)
+
+        if paths is None:
+            rebuild.update(mes.keys())
+        else:
+            for path in paths:
+                key = path[0]
+                if key == 'mes':
+                    if len(path) > 1:
+                        dirty.add(path[1])
+                    else:
+                        dirty.update(mes.keys())
+                elif key == 'dsks':
+                    dirty.add(DSK_ME)
+                elif key == 'super_source':
+                    dirty.update(self._super_source_dependents)
+                elif key == 'sources':
+                    # Only the addition or removal of a source affects tally
+                    if len(path) == 1 or path[1] not in state.get('sources', {}) or any(
+                        path[1] not in me_tally for me_tally in by_me.values()
+                    ):
+                        rebuild.update(mes.keys())
+
+        dirty.update(rebuild)
+        if not dirty:
+            return state, set()
+
+        new_by_me = None
+        changed_sources = set()
+
+        for idx in dirty:
+            if idx not in mes:
+                continue
+
+            live, uses_super_source = _me_live_sources(state, idx, mes[idx])
+            if uses_super_source:
+                self._super_source_dependents.add(idx)
+            else:
+                self._super_source_dependents.discard(idx)
+
+            old_live = self._live.get(idx, {})
+            self._live[idx] = live
+            old_me = by_me.get(idx, {})
+
+            if idx in rebuild:
+                this_me = {source: {'preview': False, 'program': False} for source in state.get('sources', {})}
+                this_me.update(live)
+                changed = set(
+                    source for source in set(this_me.keys()) | set(old_me.keys())
+                    if this_me.get(source) != old_me.get(source)
+                )
+            else:
+                changed = set(
+                    source for source in set(live.keys()) | set(old_live.keys())
+                    if live.get(source) != old_live.get(source)
+                )
+                if not changed:
+                    continue
+                sources = state.get('sources', {})
+                this_me = dict(old_me)
+                for source in changed:
+                    if source in live:
+                        this_me[source] = live[source]
+                    elif source in sources:
+                        this_me[source] = {'preview': False, 'program': False}
+                    else:
+                        this_me.pop(source, None)
+
+            if changed or idx not in by_me:
+                changed_sources.update(changed)
+                if new_by_me is None:
+                    new_by_me = dict(by_me)
+                new_by_me[idx] = this_me
+
+        if new_by_me is None:
+            return state, changed_sources
+
+        new_state = dict(state)
+        tally = new_state['tally'] = dict(state.get('tally', {}))
+        tally['by_me'] = new_by_me
+
+        return new_state, changed_sources
+
+
+def recalculate_synthetic_tally(state):
+    '''
+    Recalculates the whole of `tally.by_me` from scratch.
+    '''
+    new_state, _ = SyntheticTally().update(state)
+    return new_state
+
+
+# Bits of a tally entry in fast tally messages
+TALLY_PROGRAM = 0x01
+TALLY_PREVIEW = 0x02
+
+
+def encode_tally_flags(entry):
+    '''
+    Packs a tally entry's program and preview flags into an int.
+    '''
+    return (TALLY_PROGRAM if entry.get('program') else 0) | (TALLY_PREVIEW if entry.get('preview') else 0)
+
+
+def _changed_entries(old, new, keys=None):
+    if old is new:
+        return {}
+    if keys is not None:
+        changed = {}
+        for key in keys:
+            entry = new.get(key)
+            if entry is not old.get(key) and entry != old.get(key):
+                changed[int(key)] = encode_tally_flags(entry) if entry is not None else 0
+        return changed
+
+    changed = {
+        int(key): encode_tally_flags(entry) for key, entry in new.items()
+        if entry is not old.get(key) and entry != old.get(key)
+    }
+    for key in old.keys():
+        if key not in new:
+            changed[int(key)] = 0
+    return changed
+
+
+def encode_tally_changes(old, new, sources=None):
+    '''
+    Encodes compactly the entries that differ between two versions of the
+    tally branch of state: per M/E (synthetic tally), and for the ATEM's own
+    by-source (TlSr) and by-index (TlIn) tally, a dict of changed entries to
+    their flags (see encode_tally_flags). Entries that have disappeared have
+    no flags set. Also lists the sources whose tally changed in any of these
+    but by-index tally, which is keyed by tally index rather than source.
+
+    If `sources` is given (as returned by SyntheticTally.update), only the
+    per-M/E entries of those sources are compared.
+    '''
+    old_by_me = old.get('by_me', {})
+    by_me = {}
+    for idx, me in new.get('by_me', {}).items():
+        changed = _changed_entries(old_by_me.get(idx, {}), me, sources)
+        if changed:
+            by_me[idx] = changed
+
+    by_source = _changed_entries(old.get('by_source', {}), new.get('by_source', {}))
+
+    changed_sources = set(by_source)
+    for changed in by_me.values():
+        changed_sources.update(changed)
+
+    return {
+        'by_me': by_me,
+        'by_source': by_source,
+        'by_index': _changed_entries(old.get('by_index', {}), new.get('by_index', {})),
+        'changed': sorted(changed_sources)
+    }
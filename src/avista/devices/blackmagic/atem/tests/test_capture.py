@@ -0,0 +1,60 @@
+from autobahn.wamp.types import CloseDetails
+from avista.devices.blackmagic.atem.capture import CaptureWriter, InvalidCaptureError, read_capture
+from avista.devices.blackmagic.atem.packet import Packet, PacketType
+from avista.devices.blackmagic.atem.replay import parse_options
+
+import pytest
+
+from .test_device import _create_device
+
+
+class NullTransport(object):
+    def write(self, data, address):
+        pass
+
+
+def test_protocol_capture(tmp_path):
+    path = str(tmp_path / 'atem.cap')
+    device = _create_device(capture=path)
+    protocol = device.get_protocol()
+    protocol.transport = NullTransport()
+
+    datagram = Packet.create(PacketType.ACK_REQUEST, 0x8001, 0, 1, b'PrgI\x00\x00\x00\x03').to_bytes()
+    protocol.datagramReceived(datagram, None)
+    protocol.stopProtocol()
+
+    records = list(read_capture(path))
+    assert [d for _, d in records] == [datagram]
+    assert device._state['mes'][0]['program'] == 3
+
+    # The protocol is replaced after a power cycle, but the capture continues
+    device.protocol = None
+    protocol = device.get_protocol()
+    protocol.transport = NullTransport()
+    protocol.datagramReceived(datagram, None)
+    device.onLeave(CloseDetails())
+
+    assert [d for _, d in read_capture(path)] == [datagram, datagram]
+
+
+def test_replay_options():
+    assert parse_options(['maxUpdateRate=0', 'deltaUpdates=true', 'decodePolicy=VuMo=lazy']) == {
+        'maxUpdateRate': 0,
+        'deltaUpdates': True,
+        'decodePolicy': 'VuMo=lazy'
+    }
+
+
+def test_truncated_capture(tmp_path):
+    path = str(tmp_path / 'atem.cap')
+    writer = CaptureWriter(path)
+    writer.write(b'\x00' * 20, 1.5)
+    writer.close()
+
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x01')
+
+    records = read_capture(path)
+    assert next(records) == (1.5, b'\x00' * 20)
+    with pytest.raises(InvalidCaptureError):
+        next(records)
@@ -0,0 +1,301 @@
+from autobahn.wamp.types import CloseDetails, ComponentConfig
+from avista.devices.blackmagic.atem import ATEM, device as atem_device
+from avista.devices.blackmagic.atem.state import save_state_snapshot
+from twisted.internet.task import Clock
+
+
+def _create_device(**extra):
+    extra.setdefault('name', 'ATEM')
+    extra.setdefault('host', '127.0.0.1')
+    return ATEM(ComponentConfig(realm='avista', extra=extra))
+
+
+def _receive(device, payload):
+    device.receive_commands(device.get_protocol()._command_parser.parse_commands(payload))
+
+
+def test_lazy_decode_policy():
+    device = _create_device(decodePolicy='VuMo=lazy')
+
+    _receive(device, b'\x00\x0a\x00\x00VuMo\x01d\x00\x0c\x00\x00PrgI\x00\x00\x00\x03')
+
+    assert 'config' not in device._state
+    assert device._state['mes'][0]['program'] == 3
+
+    assert device._get_state('config') == {'multiviewers': {1: {'opacity': 100}}}
+    assert len(device._lazy_commands) == 0
+
+    # Held commands are decoded after the batch being applied, and without a
+    # protocol being created for a device that's powered off
+    _receive(device, b'\x00\x0a\x00\x00VuMo\x01\x32')
+    device.protocol = None
+    device._lock.acquire()
+    device._get_state('config')
+    assert device._state['config']['multiviewers'][1]['opacity'] == 100
+    device._lock.release()
+    assert device._state['config']['multiviewers'][1]['opacity'] == 50
+    assert device.protocol is None
+
+
+def test_lazy_commands_beyond_the_limit(monkeypatch):
+    monkeypatch.setattr(atem_device, 'MAX_LAZY_COMMANDS', 2)
+    device = _create_device(decodePolicy='VuMo=lazy')
+
+    # The oldest held command is pushed out by the same datagram as the
+    # commands after it, and mustn't be lost when that datagram is applied
+    _receive(
+        device,
+        b'\x00\x0a\x00\x00VuMo\x00\x0a\x00\x0a\x00\x00VuMo\x01\x14\x00\x0a\x00\x00VuMo\x02\x1e'
+        b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03'
+    )
+    assert device._state['config'] == {'multiviewers': {0: {'opacity': 10}}}
+    assert device._state['mes'][0]['program'] == 3
+    assert len(device._lazy_commands) == 2
+
+    assert device._get_state('config')['multiviewers'] == {0: {'opacity': 10}, 1: {'opacity': 20}, 2: {'opacity': 30}}
+
+
+def test_receive_commands_batch():
+    device = _create_device()
+    tally_updates = []
+    tally_update = device._synthetic_tally.update
+    device._synthetic_tally.update = lambda state, paths: tally_updates.append(paths) or tally_update(state, paths)
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03\x00\x0c\x00\x00PrvI\x00\x00\x00\x04\x00\x00\x00\x00')
+
+    assert device._state['mes'][0]['program'] == 3
+    assert device._state['mes'][0]['preview'] == 4
+    assert device._state['tally']['by_me'][0][3]['program'] is True
+    assert tally_updates == [[('mes',)]]
+    assert list(device._pending_state_updates) == ['mes', 'tally']
+
+
+def test_updates_are_coalesced_and_rate_limited(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(atem_device, 'reactor', clock)
+    device = _create_device(coalesceWindow=0.01, maxUpdateRate=10)
+    published = []
+
+    def publish(topic, payload, **kwargs):
+        if not topic.endswith('/fast'):
+            published.append((topic, payload['data']))
+    device.publish = publish
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03')
+    _receive(device, b'\x00\x0c\x00\x00PrvI\x00\x00\x00\x04')
+    assert published == []
+
+    clock.advance(0.01)
+    assert sorted(topic for topic, _ in published) == ['avista.devices.ATEM/mes', 'avista.devices.ATEM/tally']
+    published.clear()
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x05')
+    clock.advance(0.01)
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x06')
+    clock.advance(0.01)
+    assert published == []
+
+    clock.advance(0.08)
+    mes = [data for topic, data in published if topic == 'avista.devices.ATEM/mes']
+    assert mes == [{0: {'program': 6, 'preview': 4}}]
+    assert device._pending_state_updates == {}
+
+
+def test_fast_tally_is_published_immediately(monkeypatch):
+    monkeypatch.setattr(atem_device, 'reactor', Clock())
+    device = _create_device()
+    published = []
+    device.publish = lambda topic, payload, **kwargs: published.append((topic, payload))
+
+    device._state_tree.update({'sources': {1: {}, 2: {}}})
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x01')
+
+    assert published[-1] == (
+        'avista.devices.ATEM/tally/fast',
+        {
+            'type': 'tally',
+            'data': {
+                'by_me': {0: {1: 1, 2: 0}},
+                'by_source': {},
+                'by_index': {},
+                'changed': [1, 2]
+            },
+            'version': 3,
+            'epoch': device.state_epoch,
+            'seq': 1
+        }
+    )
+
+    # Only changed entries are sent, including those of the ATEM's own tally
+    _receive(device, b'\x00\x0c\x00\x00PrvI\x00\x00\x00\x02\x00\x0e\x00\x00TlSr\x00\x01\x00\x05\x01\x00')
+    assert published[-1][1]['data'] == {
+        'by_me': {0: {2: 2}},
+        'by_source': {5: 1},
+        'by_index': {},
+        'changed': [2, 5]
+    }
+    assert published[-1][1]['seq'] == 2
+
+
+def test_delta_updates():
+    device = _create_device(deltaUpdates=True, maxUpdateRate=0)
+    published = []
+    device.publish = lambda topic, payload, **kwargs: published.append((topic, payload, kwargs['options'].retain))
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03')
+    device._send_updates()
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x04')
+    device._send_updates()
+
+    snapshot = [p for p in published if p[0] == 'avista.devices.ATEM/mes']
+    assert snapshot == [('avista.devices.ATEM/mes', {'type': 'mes', 'data': {0: {'program': 3}}, 'version': 2, 'epoch': device.state_epoch, 'seq': 0}, True)]
+
+    patches = [p for p in published if p[0] == 'avista.devices.ATEM/mes/patch']
+    assert patches == [(
+        'avista.devices.ATEM/mes/patch',
+        {'type': 'mes', 'data': [{'op': 'replace', 'path': '/0/program', 'value': 4}], 'version': 4, 'epoch': device.state_epoch, 'seq': 1},
+        None
+    )]
+    assert device._get_snapshot('mes') == {'seq': 1, 'data': {0: {'program': 4}}}
+
+    # A branch that disappears is published as an empty snapshot, not a patch
+    del published[:]
+    device._state_tree.update({key: value for key, value in device._state.items() if key != 'mes'})
+    device._pending_state_updates['mes'] = None
+    device._send_updates()
+    assert [(topic, payload['data'], retain) for topic, payload, retain in published] == [
+        ('avista.devices.ATEM/mes', None, True)
+    ]
+
+
+def test_warm_start_from_state_cache(tmp_path):
+    cache = str(tmp_path / 'atem.state')
+    save_state_snapshot(
+        cache,
+        {'mes': {0: {'program': 3}}, 'auxes': {0: {'source': 1}}, 'state': {'initialized': True}},
+        '127.0.0.1'
+    )
+
+    device = _create_device(stateCache=cache)
+    published = []
+    device.publish = lambda topic, payload, **kwargs: published.append((topic, payload['data']))
+
+    device._publish_stale_state()
+    assert ('avista.devices.ATEM/stale', True) in published
+    assert ('avista.devices.ATEM/mes', {0: {'program': 3}}) in published
+    assert device._get_state('mes') == {0: {'program': 3}}
+
+    published.clear()
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x04')
+    device._send_updates()
+    assert published == []
+
+    _receive(device, b'\x00\x0c\x00\x00InCm\x01\x00\x00\x00')
+    assert sorted(device._pending_state_updates) == ['auxes', 'mes', 'tally']
+    assert published[0] == ('avista.devices.ATEM/stale', False)
+    assert published[1][0] == 'avista.devices.ATEM/tally/fast'
+    assert device._get_state('mes') == {0: {'program': 4}}
+
+    loop = device._state_cache_loop
+    assert loop.running
+    device.before_power_off()
+    assert not loop.running
+    assert device._state_cache_loop is None
+
+
+def test_leaving_cancels_delayed_publishing(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(atem_device, 'reactor', clock)
+    cache = str(tmp_path / 'atem.state')
+    save_state_snapshot(cache, {'mes': {0: {'program': 3}}}, '127.0.0.1')
+
+    stale = _create_device(stateCache=cache)
+    live = _create_device()
+    published = []
+    for device in (stale, live):
+        device.publish = lambda topic, payload, **kwargs: published.append(topic)
+        _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x04')
+    assert stale._stale_timeout.active()
+    assert live._flush_call.active()
+
+    published.clear()
+    for device in (stale, live):
+        device.onLeave(CloseDetails())
+    clock.advance(60)
+    assert published == []
+    assert stale._stale_timeout is None and live._flush_call is None
+
+
+def test_unusable_state_caches_are_ignored(tmp_path):
+    cache = str(tmp_path / 'atem.state')
+    state = {'config': {'name': 'ATEM 1 M/E'}, 'mes': {0: {'program': 3}}}
+
+    with open(cache, 'wb') as f:
+        f.write(b'\x80\x04not a snapshot')
+    assert _create_device(stateCache=cache)._stale_state is None
+
+    save_state_snapshot(cache, state, '10.0.0.1')
+    assert _create_device(stateCache=cache)._stale_state is None
+
+    # A cache of a different model is discarded as soon as the model is known
+    save_state_snapshot(cache, state, '127.0.0.1')
+    device = _create_device(stateCache=cache)
+    device.publish = lambda topic, payload, **kwargs: None
+    assert device._stale_state == state
+
+    _receive(device, b'\x00\x34\x00\x00_pin' + b'ATEM 2 M/E'.ljust(44, b'\x00'))
+    assert device._stale_state is None
+    assert list(device._pending_state_updates) == ['config', 'mes']
+
+
+def test_get_state_since():
+    device = _create_device()
+    device.publish = lambda topic, payload, **kwargs: None
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03')
+    version = device.state_version
+    epoch = device.state_epoch
+    assert device.get_state_since(None) == {'version': version, 'epoch': epoch, 'full': True, 'state': device._state}
+    assert device.get_state_since(version, epoch) == {'version': version, 'epoch': epoch, 'full': False, 'state': {}}
+    # Versions from another run of the device can't be compared
+    assert device.get_state_since(version, 'earlier')['full'] is True
+
+    _receive(device, b'\x00\x0c\x00\x00AuxS\x00\x00\x00\x02')
+    since = device.get_state_since(version, epoch)
+    assert since['version'] > version
+    assert since['full'] is False
+    assert since['state'] == {'auxes': {0: {'source': 2}}}
+
+    # Versions from before the history, or after the current one, get the whole state
+    device._state_tree._horizon = version + 1
+    assert device.get_state_since(version, epoch)['full'] is True
+    assert device.get_state_since(since['version'] + 1, epoch)['full'] is True
+
+
+def test_get_state_path():
+    device = _create_device()
+    device.publish = lambda topic, payload, **kwargs: None
+
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03\x00\x0c\x00\x00PrgI\x01\x00\x00\x04')
+    assert device.get_state_path('mes/0/program') == {
+        'version': device.state_version,
+        'epoch': device.state_epoch,
+        'state': 3
+    }
+    assert device.get_state_path('mes', depth=0)['state'] == [0, 1]
+    assert device.get_state_path('/mes/', depth=1)['state'] == {0: ['program'], 1: ['program']}
+    assert device.get_state_path('mes/2/program')['state'] is None
+    assert device.get_state_path('mes/0/program/nothing')['state'] is None
+
+    assert device.get_state_path('mes', depth=2)['state'] == {0: {'program': 3}, 1: {'program': 4}}
+    me_1 = device.get_state_path('mes/1', depth=1)['state']
+    assert device.get_state_path('mes/1', depth=1)['state'] is me_1
+
+    # Changes elsewhere leave cached results in place; changes to the path replace them
+    _receive(device, b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x05')
+    assert device.get_state_path('mes/1', depth=1)['state'] is me_1
+    assert device.get_state_path('mes/0/program')['state'] == 5
+    assert device.get_state_path('mes', depth=2)['state'] == {0: {'program': 5}, 1: {'program': 4}}
+
+    # Results without a depth are the state itself, so aren't cached
+    assert all(depth is not None for _, depth in device._state_path_cache)
@@ -0,0 +1,53 @@
+from avista.devices.blackmagic.atem.commands import CommandParser
+from avista.devices.blackmagic.atem.meters import AudioMeters, decode_mixer_levels
+
+import struct
+
+
+# Three inputs (1, 2 and 1301), so the source IDs are padded by two bytes
+AMLV = struct.pack('!H2x8I3H2x12I', 3, *range(1, 9), 1, 2, 1301, *range(100, 112))
+
+
+def test_decode_mixer_levels():
+    levels = decode_mixer_levels(AMLV)
+
+    assert levels['master'] == [1, 2, 3, 4]
+    assert levels['monitor'] == [5, 6, 7, 8]
+    assert levels['sources'] == [1, 2, 1301]
+    assert levels['levels'] == list(range(100, 112))
+
+
+def test_audio_meters_skip_unchanged_frames():
+    meters = AudioMeters()
+    parser = CommandParser(handlers=meters.handlers)
+    payload = struct.pack('!H2x4s', len(AMLV) + 8, b'AMLv') + AMLV
+
+    assert parser.parse_commands(payload) == []
+    frame, errors = meters.get_frame()
+    assert frame['mixer']['sources'] == [1, 2, 1301]
+    assert errors == []
+    assert meters.get_frame() == (None, [])
+
+    parser.parse_commands(payload)
+    assert meters.get_frame() == (None, [])
+
+    fairlight = struct.pack('!H6xq15h', 1, -256, *range(15))
+    meters.receive_fairlight_source_levels(memoryview(fairlight))
+    frame, _ = meters.get_frame()
+    assert frame['fairlight'] == {'sources': [(1, -256)], 'levels': list(range(15))}
+
+
+def test_audio_meters_discard_malformed_levels():
+    meters = AudioMeters()
+    meters.receive_mixer_levels(AMLV[:-4])
+    meters.receive_fairlight_source_levels(struct.pack('!H6xq15h', 1, 1, *range(15)))
+
+    frame, errors = meters.get_frame()
+    assert 'mixer' not in frame
+    assert frame['fairlight']['sources'] == [(1, 1)]
+    assert [name for name, _ in errors] == ['AMLv']
+
+    meters.receive_mixer_levels(AMLV)
+    frame, errors = meters.get_frame()
+    assert frame['mixer']['levels'] == list(range(100, 112))
+    assert errors == []
@@ -0,0 +1,42 @@
+from avista.devices.blackmagic.atem.packet import Packet, PacketType
+
+
+def test_parse_packet():
+    raw = b'\x08\x18\x80\x01\x00\x00\x00\x00\x00\x00\x00\x07\x00\x0c\x00\x00_ver\x00\x02\x00\x1e'
+
+    packet = Packet.parse(raw)
+
+    assert packet.bitmask == PacketType.ACK_REQUEST
+    assert packet.size == 24
+    assert packet.uid == 0x8001
+    assert packet.package_id == 7
+    assert isinstance(packet.payload, memoryview)
+    assert packet.payload == raw[12:]
+
+
+def test_packet_to_bytes():
+    packet = Packet.create(PacketType.ACK_REQUEST, 0x8001, 0, 3, b'DCut\x00\x00\x00\x00')
+
+    assert packet.to_bytes() == b'\x08\x18\x80\x01\x00\x00\x00\x00\x00\x00\x00\x03\x00\x0c\x00\x00DCut\x00\x00\x00\x00'
+
+
+def test_packet_pack_into_reuses_buffer():
+    buffer = bytearray(64)
+    ack = Packet.create(PacketType.ACK, 0x8001, 7)
+
+    length = ack.pack_into(buffer)
+
+    assert length == 12
+    assert bytes(buffer[:length]) == ack.to_bytes()
+
+
+def test_create_commands_frames_each_command():
+    packet = Packet.create_commands(0x8001, [b'DCut\x00\x00\x00\x00', b'DAut\x01\x00\x00\x00'], package_id=3)
+
+    assert packet.to_bytes() == (
+        b'\x08\x24\x80\x01\x00\x00\x00\x00\x00\x00\x00\x03'
+        b'\x00\x0c\x00\x00DCut\x00\x00\x00\x00'
+        b'\x00\x0c\x00\x00DAut\x01\x00\x00\x00'
+    )
+    assert Packet.create_commands(0x8001, [b'DCut\x00\x00\x00\x00'], 3).to_bytes() == \
+        Packet.create(PacketType.ACK_REQUEST, 0x8001, 0, 3, b'DCut\x00\x00\x00\x00').to_bytes()
@@ -0,0 +1,208 @@
+from avista.devices.blackmagic.atem import protocol
+from avista.devices.blackmagic.atem.commands import iter_commands
+from avista.devices.blackmagic.atem.commands.mix_effects import PerformAuto, PerformCut
+from avista.devices.blackmagic.atem.device import InvalidBatchOperationError
+from avista.devices.blackmagic.atem.packet import Packet, PacketType
+from construct import FormatFieldError
+from twisted.internet.task import Clock
+
+import pytest
+
+from .test_device import _create_device
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data, address):
+        self.written.append(bytes(data))
+
+    def write_batch(self, datagrams):
+        for data, address in datagrams:
+            self.write(data, address)
+
+
+@pytest.fixture
+def connected(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(protocol, 'reactor', clock)
+
+    device = _create_device(maxRetransmits=2)
+    proto = device.get_protocol()
+    proto.transport = FakeTransport()
+    proto._is_initialised = True
+    proto._current_uid = 0x8001
+    return proto, clock
+
+
+def _ack(proto, package_id):
+    proto.datagramReceived(Packet.create(PacketType.ACK, 0x8001, package_id).to_bytes(), None)
+
+
+def test_commands_are_packed_and_acknowledged(connected):
+    proto, clock = connected
+    acked = []
+
+    proto.send_command(PerformCut(index=0)).addCallback(acked.append)
+    proto.send_command(PerformAuto(index=1)).addCallback(acked.append)
+    assert proto.transport.written == []
+
+    clock.advance(0)
+    assert len(proto.transport.written) == 1
+    assert Packet.parse(proto.transport.written[0]).package_id == 1
+    assert proto.transport.written[0][12:] == b'\x00\x0c\x00\x00DCut\x00\x00\x00\x00\x00\x0c\x00\x00DAut\x01\x00\x00\x00'
+
+    _ack(proto, 1)
+    assert acked == [None, None]
+    assert proto.get_stats()['packets_acked'] == 1
+    assert proto.get_stats()['in_flight'] == 0
+
+
+def test_acks_are_cumulative(connected):
+    proto, clock = connected
+    acked = []
+    proto._packet_counter = 32766
+    for index in range(3):
+        proto.send_command(PerformCut(index=index)).addCallback(lambda _, index=index: acked.append(index))
+        clock.advance(0)
+    assert list(proto._unacked) == [32767, 0, 1]
+
+    # The ACK for 32767 was lost; that for 0 covers it too
+    _ack(proto, 0)
+    assert acked == [0, 1]
+    assert list(proto._unacked) == [1]
+    assert proto.get_stats()['packets_acked'] == 2
+
+
+def test_resend_request_retransmits(connected):
+    proto, clock = connected
+    for index in range(3):
+        proto.send_command(PerformCut(index=index))
+        clock.advance(0)
+    _ack(proto, 1)
+
+    # The ATEM asks for everything from package 2 onwards
+    resend = bytearray(Packet.create(PacketType.RESEND_REQUEST, 0x8001, 0).to_bytes())
+    resend[6:8] = b'\x00\x02'
+    proto.datagramReceived(bytes(resend), None)
+
+    assert len(proto.transport.written) == 5
+    assert proto.transport.written[3:] == proto.transport.written[1:3]
+    assert proto.get_stats()['retransmits'] == 2
+
+
+def test_unacknowledged_packets_fail(connected):
+    proto, clock = connected
+    failures = []
+    proto.send_command(PerformCut(index=0)).addErrback(failures.append)
+    clock.advance(0)
+
+    for _ in range(3):
+        for outbound in proto._unacked.values():
+            outbound.last_sent -= 1
+        proto._check_retransmits()
+
+    assert len(proto.transport.written) == 3
+    assert len(failures) == 1
+    assert failures[0].check(protocol.CommandNotAcknowledgedError)
+    assert proto.get_stats()['packets_lost'] == 1
+
+
+def test_queue_is_flushed_when_packets_are_lost(connected):
+    proto, clock = connected
+    proto._send_window = 1
+    failures = []
+    proto.send_command(PerformCut(index=0)).addErrback(failures.append)
+    clock.advance(0)
+    proto.send_command(PerformAuto(index=0)).addErrback(failures.append)
+    clock.advance(0)
+    assert proto.get_stats()['queued'] == 1
+
+    for _ in range(3):
+        for outbound in proto._unacked.values():
+            outbound.last_sent -= 1
+        proto._check_retransmits()
+
+    assert len(failures) == 1
+    assert proto.get_stats()['queued'] == 0
+    assert proto.transport.written[-1][12:] == b'\x00\x0c\x00\x00DAut\x00\x00\x00\x00'
+
+
+def test_oversized_commands_are_rejected(connected):
+    proto, clock = connected
+
+    class LargeCommand(object):
+        def to_bytes(self):
+            return b'\x00' * 2048
+
+    with pytest.raises(protocol.CommandTooLargeError):
+        proto.send_command(LargeCommand())
+    assert proto.get_stats()['queued'] == 0
+
+
+def test_duplicate_packets_are_acked_but_not_applied(connected):
+    proto, clock = connected
+    received = []
+    proto.device.receive_commands = received.append
+
+    def receive(package_id):
+        packet = Packet.create(PacketType.ACK_REQUEST, 0x8001, 0, package_id, b'PrgI\x00\x00\x00\x03')
+        proto.datagramReceived(packet.to_bytes(), None)
+
+    for package_id in (32766, 32767, 0, 32767, 2, 1, 2, 32766 - 64):
+        receive(package_id)
+
+    acks = [Packet.parse(data).ack_id for data in proto.transport.written]
+    assert acks == [32766, 32767, 0, 32767, 2, 1, 2, 32766 - 64]
+    assert len(received) == 5
+    assert proto.get_stats()['duplicates_received'] == 3
+
+
+def test_execute_batch(connected):
+    proto, clock = connected
+    done = []
+
+    proto.device.execute_batch([
+        {'operation': 'set_preview_input', 'input': 2},
+        {'operation': 'set_aux_source', 'aux': 0, 'source': 3},
+        {'operation': 'set_dsk_on_air', 'index': 0, 'on_air': True},
+        {'operation': 'perform_cut'}
+    ]).addCallback(done.append)
+    clock.advance(0)
+
+    assert len(proto.transport.written) == 1
+    names = [name for name, _ in iter_commands(Packet.parse(proto.transport.written[0]).payload)]
+    assert names == [b'CPvI', b'CAuS', b'CDsL', b'DCut']
+    assert done == []
+
+    _ack(proto, 1)
+    assert done == [None]
+
+
+def test_execute_batch_is_checked_before_sending(connected):
+    proto, clock = connected
+
+    with pytest.raises(InvalidBatchOperationError):
+        proto.device.execute_batch([
+            {'operation': 'perform_cut'},
+            {'operation': 'get_protocol'}
+        ])
+
+    with pytest.raises(TypeError):
+        proto.device.execute_batch([
+            {'operation': 'perform_cut'},
+            {'operation': 'set_aux_source', 'aux': 0}
+        ])
+
+    # Commands that can't be built prevent the batch from being sent too
+    with pytest.raises(FormatFieldError):
+        proto.device.execute_batch([
+            {'operation': 'perform_cut'},
+            {'operation': 'set_transition_position', 'position': 70000}
+        ])
+
+    clock.advance(0)
+    assert proto.transport.written == []
+    assert proto.get_stats()['queued'] == 0
+    assert proto.device._batch is None
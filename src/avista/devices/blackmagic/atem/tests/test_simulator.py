@@ -0,0 +1,78 @@
+from avista.devices.blackmagic.atem import device as atem_device, protocol
+from avista.devices.blackmagic.atem.commands import PerformCut, SetPreviewInput
+from avista.devices.blackmagic.atem.constants import VideoSource
+from avista.devices.blackmagic.atem.packet import Packet, PacketType
+from avista.devices.blackmagic.atem.simulator import ATEMSimulator
+from twisted.internet.task import Clock
+
+from .test_device import _create_device
+
+
+class LoopbackTransport(object):
+    def __init__(self, peer, address):
+        self.peer = peer
+        self.address = address
+
+    def write(self, data, address):
+        self.peer.datagramReceived(bytes(data), self.address)
+
+
+def test_simulator_session(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(protocol, 'reactor', clock)
+    monkeypatch.setattr(atem_device, 'reactor', clock)
+
+    simulator = ATEMSimulator(mes=2, inputs=4)
+    clients = []
+    for port in (50001, 50002):
+        client = _create_device(port=port).get_protocol()
+        client.transport = LoopbackTransport(simulator, ('127.0.0.1', port))
+        clients.append(client)
+    simulator.transport = LoopbackTransport(None, None)
+    simulator.transport.write = lambda data, address: clients[address[1] - 50001].datagramReceived(data, None)
+
+    for client in clients:
+        client.startProtocol()
+
+    for client in clients:
+        state = client.device._state
+        assert state['state']['initialized'] is True
+        assert state['mes'][0] == {'program': VideoSource.INPUT_1, 'preview': VideoSource.INPUT_2}
+        assert state['tally']['by_index'][0] == {'program': True, 'preview': False}
+        assert len(state['sources']) == 4
+
+    acked = []
+    clients[0].send_command(SetPreviewInput(index=1, source=VideoSource.INPUT_3))
+    clients[0].send_command(PerformCut(index=1)).addCallback(acked.append)
+    clock.advance(0)
+
+    assert acked == [None]
+    for client in clients:
+        state = client.device._state
+        assert state['mes'][1] == {'program': VideoSource.INPUT_3, 'preview': VideoSource.INPUT_1}
+        assert state['tally']['by_index'][2] == {'program': True, 'preview': False}
+
+    for client in clients:
+        client.stopProtocol()
+
+
+def test_simulator_ignores_retransmissions():
+    simulator = ATEMSimulator(mes=1, inputs=2)
+    written = []
+    simulator.transport = LoopbackTransport(None, None)
+    simulator.transport.write = lambda data, address: written.append(data)
+
+    address = ('127.0.0.1', 50001)
+    simulator.datagramReceived(Packet.create(PacketType.HELLO_PACKET, 0x1337, 0, 0, bytes(8)).to_bytes(), address)
+    uid = simulator.sessions[address].uid
+    simulator.datagramReceived(Packet.create(PacketType.ACK, uid, 0).to_bytes(), address)
+
+    cut = Packet.create_commands(uid, [PerformCut(index=0).to_bytes()], 1).to_bytes()
+    simulator.datagramReceived(cut, address)
+    assert simulator.mes[0] == [VideoSource.INPUT_2, VideoSource.INPUT_1]
+
+    # A resend whose ACK was lost is ACKed again, but the cut isn't repeated
+    del written[:]
+    simulator.datagramReceived(cut, address)
+    assert simulator.mes[0] == [VideoSource.INPUT_2, VideoSource.INPUT_1]
+    assert [Packet.parse(data).ack_id for data in written] == [1]
@@ -0,0 +1,50 @@
+from avista.devices.blackmagic.atem.commands.mix_effects import KeyerOnAir, TransitionPreview
+from avista.devices.blackmagic.atem.state import StateTree, make_patch
+
+
+def test_apply_to_state_shares_unchanged_nodes():
+    state = KeyerOnAir(index=0, key_index=0, enabled=False).apply_to_state({'mes': {0: {}, 1: {}}})
+
+    new_state = KeyerOnAir(index=0, key_index=0, enabled=True).apply_to_state(state)
+
+    assert state['mes'][0]['keyers'][0]['on_air'] is False
+    assert new_state['mes'][0]['keyers'][0]['on_air'] is True
+    assert new_state['mes'][1] is state['mes'][1]
+
+
+def test_state_tree_changed_since():
+    tree = StateTree({'mes': {0: {}, 1: {}}}, depth=5)
+    tree.update(KeyerOnAir(index=0, key_index=0, enabled=True).apply_to_state(tree.root))
+    version = tree.version
+
+    tree.update(TransitionPreview(index=1, enabled=True).apply_to_state(tree.root))
+    # Re-applying an identical value doesn't count as a change
+    tree.update(KeyerOnAir(index=0, key_index=0, enabled=True).apply_to_state(tree.root))
+
+    assert tree.changed_since(version) == {('mes', 1, 'transition')}
+    assert tree.changed_keys_since(0) == {'mes'}
+    assert tree.changed_since(tree.version) == set()
+
+
+def test_state_tree_history_exceeded():
+    tree = StateTree(history=2)
+
+    for index in range(4):
+        tree.update(TransitionPreview(index=index, enabled=True).apply_to_state(tree.root))
+
+    assert tree.changed_since(1) is None
+    assert tree.changed_since(2) == {('mes', 2), ('mes', 3)}
+
+
+def test_make_patch():
+    shared = {'a': 1}
+    old = {'mes': {0: {'program': 1, 'shared': shared, 'keyers': {0: {'on_air': False}}}}}
+    new = {'mes': {0: {'program': 2, 'shared': shared, 'keyers': {}, 'preview': 3}}}
+
+    assert make_patch(old, new) == [
+        {'op': 'replace', 'path': '/mes/0/program', 'value': 2},
+        {'op': 'remove', 'path': '/mes/0/keyers/0'},
+        {'op': 'add', 'path': '/mes/0/preview', 'value': 3},
+    ]
+
+    assert make_patch({'x/y': 1}, {'x/y': 2}) == [{'op': 'replace', 'path': '/x~1y', 'value': 2}]
@@ -0,0 +1,97 @@
+from avista.devices.blackmagic.atem.commands.dsk import DownstreamKeyerSource, DownstreamKeyerState
+from avista.devices.blackmagic.atem.commands.mix_effects import PreviewInput, ProgramInput
+from avista.devices.blackmagic.atem.constants import VideoSource
+from avista.devices.blackmagic.atem.state import StateTree
+from avista.devices.blackmagic.atem.tally import SyntheticTally, encode_tally_changes, recalculate_synthetic_tally
+
+
+def _apply(tree, tally, command):
+    paths = tree.update(command.apply_to_state(tree.root))
+    new_state, changed = tally.update(tree.root, paths)
+    tree.update(new_state)
+    return changed
+
+
+def test_incremental_tally():
+    tree = StateTree({
+        'mes': {0: {}, 1: {}},
+        'sources': {VideoSource.INPUT_1: {}, VideoSource.INPUT_2: {}, VideoSource.INPUT_3: {}}
+    })
+    tally = SyntheticTally()
+
+    assert _apply(tree, tally, ProgramInput(index=0, source=VideoSource.INPUT_1)) == {
+        VideoSource.INPUT_1, VideoSource.INPUT_2, VideoSource.INPUT_3
+    }
+    me_2_tally = tree.root['tally']['by_me'].get(1)
+
+    assert _apply(tree, tally, PreviewInput(index=0, source=VideoSource.INPUT_2)) == {VideoSource.INPUT_2}
+    assert _apply(tree, tally, PreviewInput(index=0, source=VideoSource.INPUT_2)) == set()
+
+    by_me = tree.root['tally']['by_me']
+    assert by_me[0][VideoSource.INPUT_1] == {'program': True, 'preview': False}
+    assert by_me[0][VideoSource.INPUT_2] == {'program': False, 'preview': True}
+    assert by_me[0][VideoSource.INPUT_3] == {'program': False, 'preview': False}
+    # M/E 2 wasn't affected and so wasn't recalculated
+    assert by_me.get(1) is me_2_tally
+
+
+def test_dsk_tally_appears_on_me_1():
+    tree = StateTree({'mes': {0: {}, 1: {}}, 'dsks': {0: {}}})
+    tally = SyntheticTally()
+
+    _apply(tree, tally, DownstreamKeyerSource(index=0, fill_source=VideoSource.INPUT_4, key_source=VideoSource.INPUT_5))
+    changed = _apply(
+        tree,
+        tally,
+        DownstreamKeyerState(index=0, on_air=True, is_transitioning=False, is_auto_transitioning=False, frames_remaining=0)
+    )
+
+    assert changed == {VideoSource.INPUT_4, VideoSource.INPUT_5}
+    assert tree.root['tally']['by_me'][0][VideoSource.INPUT_4]['program'] is True
+
+
+def test_encode_tally_changes():
+    me_tally = {VideoSource.INPUT_1: {'program': True, 'preview': False}, VideoSource.INPUT_2: {'program': False, 'preview': True}}
+    old = {
+        'by_me': {0: me_tally, 1: me_tally},
+        'by_index': {0: {'program': False, 'preview': True}, 1: {'program': True, 'preview': False}}
+    }
+    new = {
+        'by_me': {0: {**me_tally, VideoSource.INPUT_1: {'program': False, 'preview': False}}, 1: me_tally},
+        'by_source': {VideoSource.INPUT_3: {'program': True, 'preview': True}},
+        'by_index': {0: {'program': False, 'preview': True}}
+    }
+
+    assert encode_tally_changes(old, new) == {
+        'by_me': {0: {1: 0}},
+        'by_source': {3: 3},
+        'by_index': {1: 0},
+        'changed': [1, 3]
+    }
+    assert encode_tally_changes(new, new) == {'by_me': {}, 'by_source': {}, 'by_index': {}, 'changed': []}
+
+    # Given the sources whose synthetic tally changed, only they are compared
+    assert encode_tally_changes(old, new, {VideoSource.INPUT_1}) == encode_tally_changes(old, new)
+    assert encode_tally_changes(old, new, {VideoSource.INPUT_2})['by_me'] == {}
+    assert encode_tally_changes(old, {**new, 'by_me': {0: {}}}, {VideoSource.INPUT_1})['by_me'] == {0: {1: 0}}
+
+
+def test_incremental_tally_matches_full_calculation():
+    sources = {source: {} for source in (VideoSource.INPUT_1, VideoSource.INPUT_2, VideoSource.INPUT_3)}
+    tree = StateTree({'mes': {0: {}, 1: {}, 2: {}}, 'sources': sources})
+    tally = SyntheticTally()
+
+    # Every M/E is given a tally on the first update, changed or not
+    _apply(tree, tally, ProgramInput(index=0, source=VideoSource.INPUT_1))
+    assert sorted(tree.root['tally']['by_me']) == [0, 1, 2]
+
+    for command in (
+        PreviewInput(index=1, source=VideoSource.INPUT_2),
+        ProgramInput(index=0, source=VideoSource.INPUT_3),
+        ProgramInput(index=2, source=VideoSource.BLACK),
+        PreviewInput(index=1, source=VideoSource.INPUT_3),
+        ProgramInput(index=2, source=VideoSource.INPUT_1)
+    ):
+        _apply(tree, tally, command)
+        expected = recalculate_synthetic_tally(tree.root)
+        assert tree.root['tally']['by_me'] == expected['tally']['by_me']
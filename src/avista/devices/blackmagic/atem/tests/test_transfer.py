@@ -0,0 +1,189 @@
+from avista.devices.blackmagic.atem import device as atem_device, protocol, transfer
+from avista.devices.blackmagic.atem.commands import DataTransferComplete, DataTransferData, DataTransferError, \
+    DataTransferUploadContinue, DataTransferUploadRequest, MediaPoolLockObtained
+from avista.devices.blackmagic.atem.simulator import ATEMSimulator
+from avista.devices.blackmagic.atem.transfer import RLE_MARKER, Download, MediaTransfers, TransferError, \
+    chunk_ends, rgba_to_ycbcr, rle_decode, rle_encode, rle_runs
+from construct import StreamError
+from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.task import Clock
+
+import pytest
+import struct
+
+from .test_device import _create_device
+from .test_simulator import LoopbackTransport
+
+
+def test_rle_round_trip():
+    word = b'\x01\x02\x03\x04\x05\x06\x07\x08'
+    other = b'\x11' * 8
+    frame = word * 100 + other + other + word + RLE_MARKER + word * 3
+
+    encoded = rle_encode(frame)
+    assert encoded == (
+        RLE_MARKER + struct.pack('!Q', 100) + word +
+        other + other + word +
+        RLE_MARKER + struct.pack('!Q', 1) + RLE_MARKER +
+        RLE_MARKER + struct.pack('!Q', 3) + word
+    )
+    assert rle_runs(encoded) == [0, 48, 72]
+    assert rle_decode(encoded) == frame
+
+
+def test_chunks_never_split_runs():
+    word = b'\x01\x02\x03\x04\x05\x06\x07\x08'
+    encoded = rle_encode(word + (word + b'\x00' * 8) * 2 + b'\x22' * 80 + word)
+    runs = rle_runs(encoded)
+    assert runs == [40]
+
+    ends = list(chunk_ends(encoded, 50, runs))
+    assert ends == [40, 72]
+    assert list(chunk_ends(encoded, 50, runs, start=40)) == [72]
+
+
+def test_rgba_to_ycbcr():
+    frame = rgba_to_ycbcr(bytes([255, 255, 255, 255, 0, 0, 0, 0]))
+    a1, u, y1 = frame[0] << 4 | frame[1] >> 4, (frame[1] & 0x0f) << 6 | frame[2] >> 2, (frame[2] & 0x03) << 8 | frame[3]
+    a2, v, y2 = frame[4] << 4 | frame[5] >> 4, (frame[5] & 0x0f) << 6 | frame[6] >> 2, (frame[6] & 0x03) << 8 | frame[7]
+
+    assert (a1, a2) == (940, 64)
+    assert 930 <= y1 <= 940 and y2 == 64
+    assert abs(u - 512) <= 2 and abs(v - 512) <= 2
+
+
+def _connect(monkeypatch):
+    clock = Clock()
+    for module in (protocol, atem_device, transfer):
+        monkeypatch.setattr(module, 'reactor', clock)
+    # Without a running reactor, there's no thread pool to defer to
+    monkeypatch.setattr(transfer, 'deferToThread', maybeDeferred)
+
+    simulator = ATEMSimulator(mes=1, inputs=2)
+    device = _create_device()
+    progress = []
+    device._send_transfer_progress = progress.append
+    device._media_transfers._on_progress = progress.append
+
+    client = device.get_protocol()
+    client.transport = LoopbackTransport(simulator, ('127.0.0.1', 9910))
+    simulator.transport = LoopbackTransport(client, None)
+    client.startProtocol()
+    return device, simulator, clock, progress
+
+
+def test_upload_and_download_still(monkeypatch):
+    device, simulator, clock, progress = _connect(monkeypatch)
+
+    # A frame with long runs and plenty of incompressible data, spanning many FTCDs
+    frame = b'\x00' * 80000 + bytes(range(256)) * 200 + b'\x10' * 8000
+    results = []
+    device.upload_still(3, frame, 'Lower third').addBoth(results.append)
+    clock.advance(0)
+
+    assert len(results) == 1, results
+    stats = results[0]
+    assert stats['direction'] == 'upload'
+    assert stats['bytes'] == stats['total'] < len(frame)
+
+    data, filename = simulator.media[(0, 3)]
+    assert filename == 'Lower third'
+    assert rle_decode(data) == frame
+    assert progress[-1]['transfer_id'] == stats['transfer_id']
+
+    downloaded = []
+    device.download_still(3).addBoth(downloaded.append)
+    clock.advance(0)
+    assert downloaded == [frame]
+
+    missing = []
+    device.download_still(4).addErrback(missing.append)
+    clock.advance(0)
+    assert missing[0].check(TransferError)
+
+    assert device._get_media_transfers() == []
+    assert device._state['media_pool']['locks'][0] == 0
+
+
+def _body(command):
+    return command.to_bytes()[4:]
+
+
+def test_truncated_chunks_are_rejected():
+    assert DataTransferData.parse_body(b'\x00\x01\x00\x03abc').data == b'abc'
+    with pytest.raises(StreamError):
+        DataTransferData.parse_body(b'\x00\x01\x00\x10abc')
+
+
+def test_truncated_chunks_fail_only_their_transfer():
+    device = _create_device()
+    download = Download(7, 0, 1)
+    device._media_transfers._transfers[7] = download
+    failures = []
+    download.finished.addErrback(failures.append)
+
+    # A chunk claiming 16 bytes but carrying 3, followed by a PrgI
+    commands = device.get_protocol()._command_parser.parse_commands(
+        b'\x00\x0f\x00\x00FTDa\x00\x07\x00\x10abc' + b'\x00\x0c\x00\x00PrgI\x00\x00\x00\x03'
+    )
+
+    assert [(command.name, command.source) for command in commands] == [(b'PrgI', 3)]
+    assert failures[0].check(TransferError)
+
+
+def test_retries_use_a_new_transfer_id(monkeypatch):
+    monkeypatch.setattr(transfer, 'reactor', Clock())
+    monkeypatch.setattr(transfer, 'deferToThread', maybeDeferred)
+
+    sent = []
+    transfers = MediaTransfers(lambda command: sent.append(command) or succeed(None))
+    handlers = transfers.handlers
+    results = []
+    transfers.upload(0, 1, b'\x01' * 40, 'Still', compress=False).addBoth(results.append)
+    handlers[MediaPoolLockObtained.name](_body(MediaPoolLockObtained(index=0)))
+
+    first = sent[-1]
+    assert isinstance(first, DataTransferUploadRequest)
+    handlers[DataTransferUploadContinue.name](_body(
+        DataTransferUploadContinue(transfer_id=first.transfer_id, chunk_size=28, chunk_count=1)
+    ))
+    handlers[DataTransferError.name](_body(DataTransferError(transfer_id=first.transfer_id, error_code=1)))
+
+    retry = sent[-1]
+    assert isinstance(retry, DataTransferUploadRequest)
+    assert retry.transfer_id != first.transfer_id
+
+    # Anything more for the failed attempt is ignored
+    del sent[:]
+    handlers[DataTransferUploadContinue.name](_body(
+        DataTransferUploadContinue(transfer_id=first.transfer_id, chunk_size=28, chunk_count=2)
+    ))
+    assert sent == []
+
+    handlers[DataTransferUploadContinue.name](_body(
+        DataTransferUploadContinue(transfer_id=retry.transfer_id, chunk_size=28, chunk_count=2)
+    ))
+    chunks = [command for command in sent if isinstance(command, DataTransferData)]
+    assert [chunk.transfer_id for chunk in chunks] == [retry.transfer_id] * 2
+    assert b''.join(chunk.data for chunk in chunks) == b'\x01' * 40
+
+    handlers[DataTransferComplete.name](_body(DataTransferComplete(transfer_id=retry.transfer_id)))
+    assert results[0]['transfer_id'] == retry.transfer_id
+    assert transfers.get_stats() == []
+
+
+def test_failing_to_send_a_lock_fails_the_transfer(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(transfer, 'reactor', clock)
+    monkeypatch.setattr(transfer, 'deferToThread', maybeDeferred)
+
+    def send_command(command):
+        raise RuntimeError('Not connected')
+
+    transfers = MediaTransfers(send_command)
+    failures = []
+    transfers.download(0, 1).addErrback(failures.append)
+
+    assert failures[0].check(TransferError)
+    assert not transfers._lock_waiters.get(0)
+    assert not clock.getDelayedCalls()
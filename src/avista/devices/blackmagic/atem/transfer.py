@@ -0,0 +1,480 @@
+'''
+Transfers to and from the ATEM's media pool. Each transfer locks its store,
+then moves the file in chunks: uploads are paced by the ATEM, which grants a
+number of chunks at a time (FTCD) that are all queued for sending at once,
+so that they're pipelined within the protocol's send window, while downloaded
+chunks (FTDa) are acknowledged as they arrive. Both finish with FTDC.
+
+Stills are sent as 10-bit YCbCr 4:2:2 frames with alpha (eight bytes for
+every two pixels), run-length encoded: runs of identical eight-byte words are
+replaced by RLE_MARKER, a count and the word.
+'''
+from bisect import bisect_right
+from construct.core import StreamError
+from itertools import groupby, islice
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredLock, ensureDeferred, maybeDeferred
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+
+from .commands import DataTransferAck, DataTransferComplete, DataTransferData, DataTransferDownloadRequest, \
+    DataTransferError, DataTransferFileDescription, DataTransferUploadContinue, DataTransferUploadRequest, \
+    MediaPoolLock, MediaPoolLockObtained
+from .packet import MAX_PAYLOAD_SIZE, PAYLOAD_HEADER
+
+import hashlib
+import struct
+import time
+
+
+RLE_MARKER = b'\xfe' * 8
+RLE_WORD = struct.Struct('!Q')
+# Every transfer command starts with the ID of its transfer
+TRANSFER_ID = struct.Struct('!H')
+
+# The media pool store holding stills; clips are in the stores that follow
+STILLS_STORE = 0
+# FTSD and FTSU modes for writing and reading a still
+UPLOAD_MODE = 0x0001
+DOWNLOAD_STILL_MODE = 0x00F9
+
+# FTDE error codes
+ERROR_RETRY = 1
+ERROR_NOT_FOUND = 2
+ERROR_NOT_LOCKED = 5
+
+# How long (in seconds) a transfer may go without progress before failing,
+# how often progress is reported, and how many times a transfer is retried
+# when the ATEM asks
+TRANSFER_TIMEOUT = 10
+PROGRESS_INTERVAL = 0.5
+MAX_TRANSFER_RETRIES = 3
+
+# The most data a single FTDa can carry, allowing for its headers
+MAX_CHUNK_SIZE = (MAX_PAYLOAD_SIZE - PAYLOAD_HEADER.size - 8) & ~7
+
+
+class TransferError(Exception):
+    pass
+
+
+def rle_encode(data):
+    '''
+    Run-length encodes a frame, whose length must be a multiple of eight
+    bytes. Words that happen to match the marker are always encoded as runs,
+    so that they can't be mistaken for one.
+    '''
+    if len(data) % 8:
+        raise ValueError('Frame length must be a multiple of 8 bytes')
+
+    words = memoryview(data).cast('Q')
+    encoded = bytearray()
+    marker, = memoryview(RLE_MARKER).cast('Q')
+    pack_word = struct.Struct('=Q').pack
+
+    for word, run in groupby(words):
+        count = sum(1 for _ in run)
+        if count > 2 or word == marker:
+            encoded += RLE_MARKER
+            encoded += RLE_WORD.pack(count)
+            encoded += pack_word(word)
+        else:
+            encoded += pack_word(word) * count
+
+    return bytes(encoded)
+
+
+def rle_runs(data):
+    '''
+    Returns the offsets of the runs (each a marker, count and word) in
+    run-length encoded data.
+    '''
+    runs = []
+    offset = data.find(RLE_MARKER)
+    while offset != -1:
+        if offset % 8:
+            # A marker-like sequence straddling two literal words
+            offset = data.find(RLE_MARKER, offset + 1)
+            continue
+        runs.append(offset)
+        offset = data.find(RLE_MARKER, offset + 24)
+    return runs
+
+
+def rle_decode(data):
+    decoded = bytearray()
+    position = 0
+    for offset in rle_runs(data):
+        decoded += data[position:offset]
+        count, = RLE_WORD.unpack_from(data, offset + 8)
+        decoded += data[offset + 16:offset + 24] * count
+        position = offset + 24
+    decoded += data[position:]
+    return bytes(decoded)
+
+
+def chunk_ends(data, chunk_size, runs=None, start=0):
+    '''
+    Yields the end of each chunk of at most `chunk_size` bytes (rounded down
+    to whole words) that `data` is sent in from `start`, never splitting one
+    of the given runs.
+    '''
+    chunk_size &= ~7
+    if chunk_size < 24:
+        raise ValueError('Chunks must be able to hold a run')
+
+    while start < len(data):
+        end = min(start + chunk_size, len(data))
+        if runs:
+            idx = bisect_right(runs, end - 1) - 1
+            if idx >= 0 and runs[idx] >= start and runs[idx] + 24 > end:
+                end = runs[idx]
+        yield end
+        start = end
+
+
+# BT.709, scaled to 16 bits and then shifted to 10
+_KR = 0.2126
+_KB = 0.0722
+_KG = 1 - _KR - _KB
+_Y_TABLES = [[round(k * 219 * v) for v in range(256)] for k in (_KR, _KG, _KB)]
+_CB_TABLES = [[round(k * 112 * v) for v in range(256)] for k in (-_KR / (1 - _KB), -_KG / (1 - _KB), 1)]
+_CR_TABLES = [[round(k * 112 * v) for v in range(256)] for k in (1, -_KG / (1 - _KR), -_KB / (1 - _KR))]
+_ALPHA_TABLE = [((v << 2) * 219) // 255 + (16 << 2) for v in range(256)]
+
+
+def rgba_to_ycbcr(rgba):
+    '''
+    Converts 8-bit RGBA pixels into the ATEM's 10-bit YCbCr 4:2:2 frame
+    format, with chroma taken from the first of each pair of pixels.
+    '''
+    if len(rgba) % 8:
+        raise ValueError('RGBA data must be an even number of pixels')
+
+    yr, yg, yb = _Y_TABLES
+    cbr, cbg, cbb = _CB_TABLES
+    crr, crg, crb = _CR_TABLES
+    alpha = _ALPHA_TABLE
+    frame = bytearray(len(rgba))
+
+    for i in range(0, len(rgba), 8):
+        r1, g1, b1, a1, r2, g2, b2, a2 = rgba[i:i + 8]
+        y1 = ((16 << 8) + yr[r1] + yg[g1] + yb[b1]) >> 6
+        y2 = ((16 << 8) + yr[r2] + yg[g2] + yb[b2]) >> 6
+        cb = ((128 << 8) + cbr[r1] + cbg[g1] + cbb[b1]) >> 6
+        cr = ((128 << 8) + crr[r1] + crg[g1] + crb[b1]) >> 6
+        a1 = alpha[a1]
+        a2 = alpha[a2]
+
+        frame[i:i + 8] = (
+            a1 >> 4,
+            ((a1 & 0x0f) << 4) | (cb >> 6),
+            ((cb & 0x3f) << 2) | (y1 >> 8),
+            y1 & 0xff,
+            a2 >> 4,
+            ((a2 & 0x0f) << 4) | (cr >> 6),
+            ((cr & 0x3f) << 2) | (y2 >> 8),
+            y2 & 0xff
+        )
+
+    return bytes(frame)
+
+
+def prepare_upload(data, compress=True, rgba=False):
+    '''
+    Converts (from RGBA, if `rgba` is set) and compresses (if `compress` is)
+    a frame for uploading. Returns the data to send, the digest of the
+    uncompressed frame, and the runs in the compressed data (see rle_runs)
+    or None.
+    '''
+    if rgba:
+        data = rgba_to_ycbcr(data)
+    digest = hashlib.md5(data).digest()
+    if not compress:
+        return data, digest, None
+    data = rle_encode(data)
+    return data, digest, rle_runs(data)
+
+
+def _padded(text, size):
+    return text.encode('utf-8')[:size - 1].ljust(size, b'\x00')
+
+
+class Transfer(object):
+    def __init__(self, transfer_id, direction, store, slot, total=None):
+        self.transfer_id = transfer_id
+        self.direction = direction
+        self.store = store
+        self.slot = slot
+        self.total = total
+        self.bytes = 0
+        self.started = self.last_activity = time.time()
+        self.finished = Deferred()
+        self.retries = 0
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return {
+            'transfer_id': self.transfer_id,
+            'direction': self.direction,
+            'store': self.store,
+            'slot': self.slot,
+            'bytes': self.bytes,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': self.bytes / elapsed if elapsed else 0
+        }
+
+    def fail(self, error):
+        if not self.finished.called:
+            self.finished.errback(error)
+
+
+class Upload(Transfer):
+    def __init__(self, transfer_id, store, slot, data, filename, description, digest, runs=None):
+        super().__init__(transfer_id, 'upload', store, slot, len(data))
+        self.data = data
+        # Chunks mustn't split runs of compressed data
+        self.runs = runs
+        self.filename = filename
+        self.description = description
+        self.digest = digest
+        self.described = False
+
+
+class Download(Transfer):
+    def __init__(self, transfer_id, store, slot):
+        super().__init__(transfer_id, 'download', store, slot)
+        self.data = bytearray()
+
+
+class MediaTransfers(object):
+    '''
+    Runs media pool transfers for a device, one at a time per store. Commands
+    from the ATEM reach it through `handlers`, and progress (see
+    Transfer.stats) is passed to `on_progress` while transfers run.
+    '''
+    def __init__(self, send_command, on_progress=None):
+        self._send_command = send_command
+        self._on_progress = on_progress
+        self._transfers = {}
+        self._next_transfer_id = 0
+        self._store_locks = {}
+        self._lock_waiters = {}
+        self._progress_loop = None
+
+    @property
+    def handlers(self):
+        return {
+            MediaPoolLockObtained.name: self._lock_obtained,
+            DataTransferUploadContinue.name: self._upload_continue,
+            DataTransferData.name: self._data_received,
+            DataTransferComplete.name: self._transfer_complete,
+            DataTransferError.name: self._transfer_error
+        }
+
+    def get_stats(self):
+        return [transfer.stats() for transfer in self._transfers.values()]
+
+    def upload(self, store, slot, data, filename, description='', compress=True, rgba=False):
+        '''
+        Uploads `data` (converted from RGBA first, if `rgba` is set, and
+        compressed, if `compress` is) to a slot in a store. Returns a Deferred
+        firing with the transfer's final stats.
+        '''
+        return ensureDeferred(self._upload(store, slot, data, filename, description, compress, rgba))
+
+    async def _upload(self, store, slot, data, filename, description, compress, rgba):
+        # Preparing a frame takes long enough to hold up every device in the
+        # process, so happens in a thread
+        data, digest, runs = await deferToThread(prepare_upload, data, compress, rgba)
+        return await self._run(
+            store,
+            lambda transfer_id: Upload(transfer_id, store, slot, data, filename, description, digest, runs)
+        )
+
+    def download(self, store, slot, decompress=True):
+        '''
+        Downloads the contents of a slot in a store, returning a Deferred
+        firing with the data (decompressed, if `decompress` is set).
+        '''
+        d = ensureDeferred(self._run(store, lambda transfer_id: Download(transfer_id, store, slot)))
+        if decompress:
+            d.addCallback(lambda data: deferToThread(rle_decode, data))
+        return d
+
+    async def _run(self, store, create_transfer):
+        store_lock = self._store_locks.setdefault(store, DeferredLock())
+        await store_lock.acquire()
+        try:
+            await self._lock(store)
+            try:
+                transfer = create_transfer(self._new_transfer_id())
+                self._transfers[transfer.transfer_id] = transfer
+                self._start_progress()
+                try:
+                    self._request(transfer)
+                    return await transfer.finished
+                finally:
+                    del self._transfers[transfer.transfer_id]
+                    self._report(transfer)
+            finally:
+                self._unlock(store)
+        finally:
+            store_lock.release()
+
+    def _new_transfer_id(self):
+        self._next_transfer_id = (self._next_transfer_id + 1) & 0xFFFF
+        return self._next_transfer_id
+
+    def _send(self, command, transfer):
+        '''
+        Sends a command for a transfer, failing the transfer if it can't be.
+        '''
+        try:
+            self._send_command(command).addErrback(transfer.fail)
+        except Exception as e:
+            transfer.fail(e)
+
+    def _lock(self, store):
+        d = Deferred()
+        self._lock_waiters.setdefault(store, []).append(d)
+
+        def failed(failure):
+            if d in self._lock_waiters.get(store, []):
+                self._lock_waiters[store].remove(d)
+            raise TransferError('Unable to lock media pool store {}: {}'.format(store, failure.getErrorMessage()))
+
+        d.addTimeout(TRANSFER_TIMEOUT, reactor).addErrback(failed)
+        # The send may fail straight away, such as without a connection
+        maybeDeferred(self._send_command, MediaPoolLock(index=store, lock=True)).addErrback(
+            lambda failure: None if d.called else d.errback(failure)
+        )
+        return d
+
+    def _unlock(self, store):
+        try:
+            # There's nothing more to be done if this fails
+            self._send_command(MediaPoolLock(index=store, lock=False)).addErrback(lambda _: None)
+        except Exception:
+            pass
+
+    def _lock_obtained(self, body):
+        store = MediaPoolLockObtained.parse_body(body).index
+        for d in self._lock_waiters.pop(store, []):
+            d.callback(store)
+
+    def _request(self, transfer):
+        if isinstance(transfer, Upload):
+            self._send(DataTransferUploadRequest(
+                transfer_id=transfer.transfer_id,
+                store=transfer.store,
+                slot=transfer.slot,
+                size=len(transfer.data),
+                mode=UPLOAD_MODE
+            ), transfer)
+        else:
+            self._send(DataTransferDownloadRequest(
+                transfer_id=transfer.transfer_id,
+                store=transfer.store,
+                slot=transfer.slot,
+                mode=DOWNLOAD_STILL_MODE if transfer.store == STILLS_STORE else 0
+            ), transfer)
+
+    def _upload_continue(self, body):
+        command = DataTransferUploadContinue.parse_body(body)
+        transfer = self._transfers.get(command.transfer_id)
+        if not isinstance(transfer, Upload):
+            return
+        transfer.last_activity = time.time()
+
+        if not transfer.described:
+            transfer.described = True
+            self._send(DataTransferFileDescription(
+                transfer_id=transfer.transfer_id,
+                filename=_padded(transfer.filename, 64),
+                description=_padded(transfer.description, 128),
+                hash=transfer.digest
+            ), transfer)
+
+        # Every chunk granted is queued now, to be pipelined by the protocol
+        chunk_size = min(command.chunk_size - 4, MAX_CHUNK_SIZE)
+        ends = chunk_ends(transfer.data, chunk_size, transfer.runs, transfer.bytes)
+        for end in islice(ends, command.chunk_count):
+            self._send(DataTransferData(
+                transfer_id=transfer.transfer_id,
+                data=transfer.data[transfer.bytes:end]
+            ), transfer)
+            transfer.bytes = end
+
+    def _data_received(self, body):
+        try:
+            command = DataTransferData.parse_body(body)
+        except StreamError as e:
+            # Without the chunk the data would be incomplete, so the transfer
+            # can't succeed
+            transfer = self._transfers.get(TRANSFER_ID.unpack_from(body)[0]) if len(body) >= TRANSFER_ID.size else None
+            if transfer:
+                transfer.fail(TransferError('Transfer {} received a malformed chunk: {}'.format(transfer.transfer_id, e)))
+            raise
+        transfer = self._transfers.get(command.transfer_id)
+        if not isinstance(transfer, Download):
+            return
+        transfer.last_activity = time.time()
+        transfer.data += command.data
+        transfer.bytes = len(transfer.data)
+        self._send(DataTransferAck(transfer_id=transfer.transfer_id, slot=transfer.slot & 0xFF), transfer)
+
+    def _transfer_complete(self, body):
+        transfer = self._transfers.get(DataTransferComplete.parse_body(body).transfer_id)
+        if transfer and not transfer.finished.called:
+            if isinstance(transfer, Download):
+                transfer.total = transfer.bytes
+                transfer.finished.callback(bytes(transfer.data))
+            else:
+                transfer.finished.callback(transfer.stats())
+
+    def _transfer_error(self, body):
+        command = DataTransferError.parse_body(body)
+        transfer = self._transfers.get(command.transfer_id)
+        if not transfer:
+            return
+
+        if command.error_code == ERROR_RETRY and transfer.retries < MAX_TRANSFER_RETRIES:
+            # Chunks of the failed attempt may still be queued, so the retry
+            # gets a new ID for them not to be taken as part of it
+            del self._transfers[transfer.transfer_id]
+            transfer.transfer_id = self._new_transfer_id()
+            self._transfers[transfer.transfer_id] = transfer
+            transfer.retries += 1
+            transfer.bytes = 0
+            transfer.last_activity = time.time()
+            if isinstance(transfer, Upload):
+                transfer.described = False
+            else:
+                transfer.data = bytearray()
+            self._request(transfer)
+        else:
+            transfer.fail(TransferError('Transfer {} failed with error {}'.format(transfer.transfer_id, command.error_code)))
+
+    def _start_progress(self):
+        if self._progress_loop is None or not self._progress_loop.running:
+            self._progress_loop = LoopingCall(self._check_progress)
+            self._progress_loop.clock = reactor
+            self._progress_loop.start(PROGRESS_INTERVAL, now=False)
+
+    def _check_progress(self):
+        now = time.time()
+        for transfer in list(self._transfers.values()):
+            if transfer.last_activity + TRANSFER_TIMEOUT < now:
+                transfer.fail(TransferError('Transfer {} timed out'.format(transfer.transfer_id)))
+            else:
+                self._report(transfer)
+
+        if not self._transfers:
+            self._progress_loop.stop()
+
+    def _report(self, transfer):
+        if self._on_progress:
+            self._on_progress(transfer.stats())
+
@@ -1,12 +1,172 @@
 from avista.core import Device, expose
 from twisted.internet import reactor
-from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from twisted.internet.abstract import isIPAddress, isIPv6Address
+from twisted.internet.defer import DeferredList
+from twisted.internet.protocol import DatagramProtocol, Protocol, ReconnectingClientFactory
+
+import txaio
+
+
+log = txaio.make_logger()
 
 
 class NotConnectedException(Exception):
     pass
 
 
+class AddressInUseException(Exception):
+    pass
+
+
+class UnsupportedAddressException(Exception):
+    pass
+
+
+class UDPEndpoint(object):
+    '''
+    The transport given to a datagram protocol attached to a UDPHub. It
+    writes through the hub's socket, to the resolved form of each address the
+    protocol was attached for, and can be stopped (detaching the protocol)
+    like the port returned by `reactor.listenUDP`.
+    '''
+    def __init__(self, hub, protocol, addresses):
+        self.hub = hub
+        self.protocol = protocol
+        self.addresses = addresses
+        # Attached address to the (IP address, port) it resolved to
+        self.resolved = {}
+        self.stopped = False
+
+    def write(self, data, address):
+        self.hub.transport.write(data, self.resolved.get(address, address))
+
+    def write_batch(self, datagrams):
+        '''
+        Sends a sequence of `(data, address)` pairs. Twisted has no batched
+        send, so this is a write per datagram, but saves callers building
+        their own loop around the address lookup.
+        '''
+        write = self.hub.transport.write
+        resolved = self.resolved
+        for data, address in datagrams:
+            write(data, resolved.get(address, address))
+
+    def getHost(self):
+        return self.hub.transport.getHost()
+
+    def stopListening(self):
+        self.hub.detach(self)
+
+
+class UDPHub(DatagramProtocol):
+    '''
+    A single UDP socket, bound to an ephemeral local port, shared by any
+    number of datagram protocols. Each protocol is attached for the remote
+    addresses it talks to, and receives only the datagrams from those
+    addresses, so several devices of the same kind (and on the same remote
+    port) can run in one process. Hostnames are resolved to IP addresses
+    when attaching, since datagrams arrive from (and can only be sent to) the
+    latter.
+    '''
+    def __init__(self, interface=''):
+        self.interface = interface
+        self._endpoints = {}
+        self._port = None
+        # Addresses that datagrams have arrived from for no attached protocol
+        self._unknown_addresses = set()
+
+    def attach(self, protocol, *addresses):
+        '''
+        Attaches a protocol for datagrams from the given `(host, port)`
+        addresses, and returns its transport. The protocol is started once
+        every address has been resolved. The hub's socket is IPv4, so IPv6
+        addresses are rejected.
+        '''
+        for address in addresses:
+            if address in self._endpoints:
+                raise AddressInUseException(address)
+            if isIPv6Address(address[0]):
+                raise UnsupportedAddressException(address)
+
+        if not self._port:
+            self._port = reactor.listenUDP(0, self, interface=self.interface)
+
+        endpoint = UDPEndpoint(self, protocol, addresses)
+        resolutions = []
+        for address in addresses:
+            host, port = address
+            if isIPAddress(host):
+                self._add_address(endpoint, address, address)
+            else:
+                resolutions.append(
+                    reactor.resolve(host).addCallbacks(
+                        lambda ip, address=address: self._add_address(endpoint, address, (ip, address[1])),
+                        lambda failure, host=host: log.error(
+                            'Unable to resolve {host}: {e}', host=host, e=failure.getErrorMessage()
+                        )
+                    )
+                )
+
+        def start(_=None):
+            if not endpoint.stopped:
+                protocol.makeConnection(endpoint)
+
+        if resolutions:
+            DeferredList(resolutions).addCallback(start)
+        else:
+            start()
+        return endpoint
+
+    def _add_address(self, endpoint, address, resolved):
+        if endpoint.stopped:
+            return
+        existing = self._endpoints.get(resolved)
+        if existing and existing is not endpoint:
+            log.error(
+                '{address} resolved to {resolved}, which is already attached; ignoring it',
+                address=address,
+                resolved=resolved
+            )
+            return
+        endpoint.resolved[address] = resolved
+        self._endpoints[resolved] = endpoint
+
+    def detach(self, endpoint):
+        endpoint.stopped = True
+        for resolved in endpoint.resolved.values():
+            if self._endpoints.get(resolved) is endpoint:
+                del self._endpoints[resolved]
+        # A protocol whose addresses are still being resolved hasn't started
+        if endpoint.protocol.transport is endpoint:
+            endpoint.protocol.doStop()
+
+        if not self._endpoints and self._port:
+            self._port.stopListening()
+            self._port = None
+
+    def datagramReceived(self, datagram, address):
+        endpoint = self._endpoints.get(address)
+        if endpoint:
+            endpoint.protocol.datagramReceived(datagram, address)
+        elif address not in self._unknown_addresses:
+            # Likely a device configured with a different address than the one
+            # it replies from; logged once per address, to avoid flooding
+            self._unknown_addresses.add(address)
+            log.warn('Ignoring datagram from {address}, which no device is attached for', address=address)
+
+
+_hubs = {}
+
+
+def get_udp_hub(interface=''):
+    '''
+    Returns the shared UDPHub for a local interface.
+    '''
+    if interface not in _hubs:
+        _hubs[interface] = UDPHub(interface)
+    return _hubs[interface]
+
+
 class NetworkProtocolFactory(ReconnectingClientFactory):
     maxDelay = 30
 
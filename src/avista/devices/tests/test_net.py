@@ -0,0 +1,168 @@
+from autobahn.wamp.types import ComponentConfig
+from avista.devices import net
+from avista.devices.timemachines.device import Manager
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import DatagramProtocol
+
+import pytest
+
+
+class FakePort(object):
+    def __init__(self):
+        self.written = []
+        self.listening = True
+
+    def write(self, data, address):
+        self.written.append((data, address))
+
+    def stopListening(self):
+        self.listening = False
+
+
+class FakeReactor(object):
+    def __init__(self):
+        self.ports = []
+        self.hosts = {}
+
+    def resolve(self, host):
+        return self.hosts.get(host) or succeed('10.0.0.5')
+
+    def listenUDP(self, port, protocol, interface=''):
+        assert port == 0
+        fake_port = FakePort()
+        protocol.transport = fake_port
+        self.ports.append(fake_port)
+        return fake_port
+
+
+class RecordingProtocol(DatagramProtocol):
+    def __init__(self):
+        self.received = []
+        self.started = False
+        self.stopped = False
+
+    def startProtocol(self):
+        self.started = True
+
+    def stopProtocol(self):
+        self.stopped = True
+
+    def datagramReceived(self, datagram, address):
+        self.received.append((datagram, address))
+
+
+@pytest.fixture
+def fake_reactor(monkeypatch):
+    fake = FakeReactor()
+    monkeypatch.setattr(net, 'reactor', fake)
+    return fake
+
+
+def test_hub_demultiplexes_by_remote_address(fake_reactor):
+    hub = net.UDPHub()
+    first = RecordingProtocol()
+    second = RecordingProtocol()
+
+    hub.attach(first, ('10.0.0.1', 9910))
+    hub.attach(second, ('10.0.0.2', 9910), ('10.0.0.3', 9910))
+
+    assert first.started and second.started
+    assert len(fake_reactor.ports) == 1
+
+    hub.datagramReceived(b'a', ('10.0.0.1', 9910))
+    hub.datagramReceived(b'b', ('10.0.0.3', 9910))
+    hub.datagramReceived(b'c', ('10.0.0.4', 9910))
+
+    assert first.received == [(b'a', ('10.0.0.1', 9910))]
+    assert second.received == [(b'b', ('10.0.0.3', 9910))]
+
+    with pytest.raises(net.AddressInUseException):
+        hub.attach(RecordingProtocol(), ('10.0.0.1', 9910))
+
+
+def test_endpoint_writes_and_stops(fake_reactor):
+    hub = net.UDPHub()
+    first = RecordingProtocol()
+    second = RecordingProtocol()
+
+    first_endpoint = hub.attach(first, ('10.0.0.1', 9910))
+    second_endpoint = hub.attach(second, ('10.0.0.2', 7372))
+
+    first.transport.write(b'a', ('10.0.0.1', 9910))
+    second.transport.write_batch([(b'b', ('10.0.0.2', 7372)), (b'c', ('10.0.0.2', 7372))])
+    port = fake_reactor.ports[0]
+    assert port.written == [
+        (b'a', ('10.0.0.1', 9910)),
+        (b'b', ('10.0.0.2', 7372)),
+        (b'c', ('10.0.0.2', 7372))
+    ]
+
+    first_endpoint.stopListening()
+    assert first.stopped
+    assert first.transport is None
+    assert port.listening
+
+    hub.datagramReceived(b'd', ('10.0.0.1', 9910))
+    assert first.received == []
+
+    # The socket is closed once nothing is attached
+    second_endpoint.stopListening()
+    assert not port.listening
+
+
+def test_ipv6_addresses_are_rejected(fake_reactor):
+    hub = net.UDPHub()
+    with pytest.raises(net.UnsupportedAddressException):
+        hub.attach(RecordingProtocol(), ('10.0.0.1', 9910), ('::1', 9910))
+    assert fake_reactor.ports == []
+    assert hub._endpoints == {}
+
+
+def test_time_machines_share_the_hub(fake_reactor, monkeypatch):
+    monkeypatch.setattr(net, '_hubs', {})
+    managers = [
+        Manager(ComponentConfig(realm='avista', extra={'name': 'Clocks{}'.format(idx), 'clocks': clocks, 'alwaysPowered': True}))
+        for idx, clocks in enumerate(('10.0.0.1,10.0.0.2', '10.0.0.3'))
+    ]
+
+    # One ephemeral port (see FakeReactor.listenUDP) for every clock
+    assert len(fake_reactor.ports) == 1
+    assert fake_reactor.ports[0].written == [
+        (b'\xA1\x04\xB2', ('10.0.0.1', 7372)),
+        (b'\xA1\x04\xB2', ('10.0.0.2', 7372)),
+        (b'\xA1\x04\xB2', ('10.0.0.3', 7372))
+    ]
+    assert all(isinstance(manager._connection, net.UDPEndpoint) for manager in managers)
+
+    # Each manager's protocol hears only from its own clocks
+    received = []
+    for manager in managers:
+        manager.get_protocol().datagramReceived = lambda datagram, address, manager=manager: received.append(
+            (manager.name, address)
+        )
+    for clock in ('10.0.0.2', '10.0.0.3'):
+        net.get_udp_hub().datagramReceived(b'A\x00', (clock, 7372))
+    assert received == [('Clocks0', ('10.0.0.2', 7372)), ('Clocks1', ('10.0.0.3', 7372))]
+
+
+def test_hostnames_are_resolved(fake_reactor):
+    hub = net.UDPHub()
+    protocol = RecordingProtocol()
+
+    hub.attach(protocol, ('atem.local', 9910))
+    assert protocol.started
+
+    protocol.transport.write(b'a', ('atem.local', 9910))
+    assert fake_reactor.ports[0].written == [(b'a', ('10.0.0.5', 9910))]
+
+    hub.datagramReceived(b'b', ('10.0.0.5', 9910))
+    assert protocol.received == [(b'b', ('10.0.0.5', 9910))]
+
+    # A protocol detached before its addresses are resolved is never started
+    fake_reactor.hosts['slow.local'] = pending = Deferred()
+    slow = RecordingProtocol()
+    hub.attach(slow, ('slow.local', 9910)).stopListening()
+    pending.callback('10.0.0.6')
+    assert not slow.started
+    hub.datagramReceived(b'c', ('10.0.0.6', 9910))
+    assert slow.received == []
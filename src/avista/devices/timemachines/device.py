@@ -1,7 +1,6 @@
 from avista.core import expose
-from avista.devices.net import NetworkDevice
+from avista.devices.net import NetworkDevice, get_udp_hub
 from avista.devices.timemachines.protocol import TMProtocol
-from twisted.internet import reactor
 
 
 class UnknownClockException(Exception):
@@ -10,6 +9,7 @@ class UnknownClockException(Exception):
 
 class Manager(NetworkDevice):
     default_port = 7372
+    versioned_state = True
 
     def __init__(self, config):
         self._clocks = config.extra.get('clocks', '').split(',')
@@ -22,10 +22,9 @@ class Manager(NetworkDevice):
         return TMProtocol(self)
 
     def _connect(self):
-        protocol = self.get_protocol()
-        self._connection = reactor.listenUDP(
-            self.port,
-            protocol
+        self._connection = get_udp_hub().attach(
+            self.get_protocol(),
+            *[(clock, self.port) for clock in self._clocks]
         )
 
     def _handle_query_response(self, source, data):
@@ -36,6 +35,7 @@ class Manager(NetworkDevice):
                 'timer_running': data.display.running
             }
         }
+        self.state_changed('clocks')
 
         self.broadcast_device_message(
             'state',
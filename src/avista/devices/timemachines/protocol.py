@@ -8,6 +8,7 @@ class MalformedPacketException(Exception):
 
 
 COMMAND_ACK = b'A\x00'
+QUERY = b'\xA1\x04\xB2'
 
 
 class TMProtocol(DatagramProtocol):
@@ -17,12 +18,13 @@ class TMProtocol(DatagramProtocol):
         self.manager = manager
 
     def startProtocol(self):
-        for clock in self.manager._clocks:
-            self.query_clock(clock)
+        self.transport.write_batch(
+            (QUERY, (clock, self.manager.port)) for clock in self.manager._clocks
+        )
 
     def query_clock(self, clock):
         self.transport.write(
-            b'\xA1\x04\xB2',
+            QUERY,
             (clock, self.manager.port)
         )
 